@@ -0,0 +1 @@
+#python package for the benchmark scripts, run them from the backend folder, e.g. python -m benchmarks.persist_benchmark
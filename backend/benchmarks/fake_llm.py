@@ -0,0 +1,135 @@
+#fake_llm.py
+#Purpose: A chat model that answers like GPT would, but instantly (or after a simulated delay) and for free,
+#so the whole generation pipeline can be benchmarked offline.
+
+#Install it in place of OpenAI with:
+#   set_generator_context(build_generator_context(FakeStoryChatModel(depth=4, branching=3, latency=0.5)))
+#failure_rate, slow_rate and garbage_rate make some calls fail with a 503, take slow_factor times longer
+#or answer with broken JSON, to see what retries and hedging (core/llm_call.py) do about it.
+
+import random
+import threading
+import time
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from benchmarks.story_fixtures import build_llm_response
+
+
+# Looks like the error the OpenAI client raises for a 503, as far as core/llm_call.py is concerned.
+class FakeUpstreamError(Exception):
+    status_code = 503
+
+
+class FakeStoryChatModel(BaseChatModel):
+    depth: int = 4  # levels of the canned story, root included
+    branching: int = 3  # options per non-ending node
+    content_size: int = 200  # characters of text per node
+    latency: float = 0.0  # seconds per call (spread over the chunks when streaming)
+    jitter: float = 0.0  # +/- fraction of latency, drawn from a seeded random generator
+    stream_chunk_size: int = 16  # characters per streamed chunk
+    failure_rate: float = 0.0  # fraction of calls that fail right away with FakeUpstreamError, like a 503
+    slow_rate: float = 0.0  # fraction of calls that take slow_factor times the latency (the tail)
+    slow_factor: float = 10.0
+    garbage_rate: float = 0.0  # fraction of calls that answer with JSON cut off halfway
+    seed: int = 0
+
+    _random: random.Random = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _call_seconds: list = PrivateAttr()  # how long every call took, for the benchmark report
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._random = random.Random(self.seed)
+        self._lock = threading.Lock()
+        self._call_seconds = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-story"
+
+    @property
+    def call_seconds(self) -> list[float]:
+        with self._lock:
+            return list(self._call_seconds)
+
+    # Picks the canned answer for the prompt: a full story, a fan-out outline or a fan-out branch.
+    def response_for(self, messages: List[BaseMessage]) -> str:
+        prompt = messages[-1].content if messages else ""
+
+        if "The player reached this node" in prompt:
+            return build_llm_response(max(self.depth - 1, 1), self.branching, self.content_size).rootNode.model_dump_json()
+
+        story = build_llm_response(self.depth, self.branching, self.content_size)
+        if "story outline" in prompt:
+            for option in story.rootNode.options or []:
+                option.nextNode.isEnding = False
+                option.nextNode.isWinningEnding = False
+                option.nextNode.options = []
+        return story.model_dump_json()
+
+    # Rough token counts (about 4 characters per token), so token metrics have something to show.
+    def usage_for(self, messages: List[BaseMessage], content: str) -> dict:
+        input_tokens = sum(len(str(message.content)) for message in messages) // 4
+        output_tokens = len(content) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    # (delay, fail, garbage) for one call, all drawn from the seeded generator.
+    def _plan(self) -> tuple[float, bool, bool]:
+        with self._lock:
+            spread = self._random.uniform(-self.jitter, self.jitter)
+            slow = self._random.random() < self.slow_rate
+            fail = self._random.random() < self.failure_rate
+            garbage = self._random.random() < self.garbage_rate
+        delay = max(self.latency * (1 + spread), 0.0) * (self.slow_factor if slow else 1)
+        return delay, fail, garbage
+
+    def _record(self, seconds: float):
+        with self._lock:
+            self._call_seconds.append(seconds)
+
+    def _generate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Any = None,
+            **kwargs: Any
+    ) -> ChatResult:
+        start = time.perf_counter()
+        delay, fail, garbage = self._plan()
+        if fail:
+            raise FakeUpstreamError("fake upstream error (503)")
+        time.sleep(delay)
+        content = self.response_for(messages)
+        self._record(time.perf_counter() - start)
+        if garbage:
+            content = content[:len(content) // 2]
+        message = AIMessage(content=content, usage_metadata=self.usage_for(messages, content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Any = None,
+            **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        start = time.perf_counter()
+        delay, fail, garbage = self._plan()
+        if fail:  # before the first chunk, like a 503
+            raise FakeUpstreamError("fake upstream error (503)")
+        content = self.response_for(messages)
+        if garbage:
+            content = content[:len(content) // 2]
+        chunks = [content[i:i + self.stream_chunk_size] for i in range(0, len(content), self.stream_chunk_size)]
+        pause = delay / max(len(chunks), 1)
+
+        for text in chunks:
+            time.sleep(pause)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self.usage_for(messages, content)))
+        self._record(time.perf_counter() - start)
@@ -0,0 +1,79 @@
+#load_test.py
+#Purpose: Hammers a running API with concurrent GET requests and reports requests per second and latency,
+#to compare server changes (e.g. sync vs async database layer) before and after.
+
+#Usage (from the backend folder, with the API running, e.g. `uvicorn main:app --workers 1`):
+#   python -m benchmarks.load_test --base-url http://localhost:8000/api --story-id 1 --concurrency 64 --duration 15
+#Paths are picked round-robin; the default mix reads a story overview, the full story and (with --job-id) a job.
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def worker(client: httpx.AsyncClient, paths: list[str], deadline: float, latencies: list, errors: list, offset: int):
+    index = offset
+    while time.perf_counter() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        start = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(base_url: str, paths: list[str], concurrency: int, duration: float):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await client.get(paths[0])  # warm up
+
+        latencies, errors = [], []
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            worker(client, paths, deadline, latencies, errors, offset) for offset in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"requests:     {len(latencies)} in {elapsed:.1f}s ({len(errors)} errors)")
+    print(f"throughput:   {len(latencies) / elapsed:.1f} req/s")
+    print(f"latency ms:   mean {statistics.fmean(latencies) * 1000:.1f}  "
+          f"p50 {percentile(latencies, 0.50) * 1000:.1f}  "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f}  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f}")
+    if errors:
+        print(f"first errors: {errors[:5]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent read load test")
+    parser.add_argument("--base-url", default="http://localhost:8000/api")
+    parser.add_argument("--story-id", type=int, default=1)
+    parser.add_argument("--job-id", help="an existing job id to include in the mix")
+    parser.add_argument("--path", action="append", help="path to request instead of the default mix (repeatable)")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=15)
+    args = parser.parse_args()
+
+    paths = args.path or [f"/stories/{args.story_id}", f"/stories/{args.story_id}/complete"]
+    if args.job_id and not args.path:
+        paths.append(f"/jobs/{args.job_id}")
+    asyncio.run(run(args.base_url, paths, args.concurrency, args.duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#parse_benchmark.py
+#Purpose: Compares how GPT's answer is turned into a validated story tree:
+#  legacy   PydanticOutputParser with nextNode typed as a plain dict, then every nextNode validated again while walking the tree
+#  parser   PydanticOutputParser with the recursive models (LLM_OUTPUT_MODE="parser")
+#  json     JsonModelParser, one pass of pydantic's JSON parser over the recursive models (LLM_OUTPUT_MODE="json")
+#and how many prompt tokens each mode's format instructions cost.
+
+#Usage (from the backend folder):
+#   python -m benchmarks.parse_benchmark
+#   python -m benchmarks.parse_benchmark --repeat 200 --fenced-repeat 5
+
+import argparse
+import statistics
+import time
+import tracemalloc
+from typing import Any, List, Optional
+
+from langchain_core.output_parsers import PydanticOutputParser
+from pydantic import BaseModel
+
+from core.llm_context import JsonModelParser
+from core.models import StoryLLMResponse
+from core.prompts import STORY_JSON_FORMAT
+from benchmarks.story_fixtures import build_llm_response, count_nodes
+
+TREE_SIZES = [(3, 2), (4, 3), (5, 3), (6, 3)]  # (depth, branching)
+FENCED_TREE_SIZES = [(3, 2), (4, 3)]  # LangChain's fenced-JSON path is quadratic, larger trees take minutes
+
+
+# The previous models, kept here only as the baseline to measure against.
+class LegacyOptionLLM(BaseModel):
+    text: str
+    nextNode: dict[str, Any]
+
+
+class LegacyNodeLLM(BaseModel):
+    content: str
+    isEnding: bool
+    isWinningEnding: bool
+    options: Optional[List[LegacyOptionLLM]] = None
+
+
+class LegacyStoryLLMResponse(BaseModel):
+    title: str
+    rootNode: LegacyNodeLLM
+
+
+def parse_legacy(parser, text: str):
+    story = parser.parse(text)
+    pending = [story.rootNode]
+    while pending:  # what _flatten_story_tree used to do for every option
+        node = pending.pop()
+        for option in node.options or []:
+            pending.append(LegacyNodeLLM.model_validate(option.nextNode))
+    return story
+
+
+def count_tokens(text: str) -> int:
+    try:
+        import tiktoken  # installed with langchain-openai
+        return len(tiktoken.get_encoding("o200k_base").encode(text))
+    except Exception:
+        return len(text) // 4  # rough estimate
+
+
+def measure(parse, text: str, repeat: int) -> tuple[float, float]:
+    parse(text)  # warm up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(text)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    parse(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings) * 1000, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM output parsing benchmark")
+    parser.add_argument("--repeat", type=int, default=50, help="parses per tree size and mode")
+    parser.add_argument("--fenced-repeat", type=int, default=3, help="parses per tree size and mode for fenced answers")
+    args = parser.parse_args()
+
+    legacy_parser = PydanticOutputParser(pydantic_object=LegacyStoryLLMResponse)
+    recursive_parser = PydanticOutputParser(pydantic_object=StoryLLMResponse)
+    json_parser = JsonModelParser(StoryLLMResponse, STORY_JSON_FORMAT)
+
+    modes = {
+        "legacy": lambda text: parse_legacy(legacy_parser, text),
+        "parser": recursive_parser.parse,
+        "json": json_parser.parse,
+    }
+
+    print("format instructions per prompt:")
+    for name, instructions in (
+            ("legacy", legacy_parser.get_format_instructions()),
+            ("parser", recursive_parser.get_format_instructions()),
+            ("json", json_parser.get_format_instructions())):
+        print(f"  {name:<7} {count_tokens(instructions):>5} tokens ({len(instructions)} chars)")
+
+    # plain JSON is what JSON mode returns; without JSON mode models often wrap it in a ```json fence
+    for fenced, sizes, repeat in ((False, TREE_SIZES, args.repeat), (True, FENCED_TREE_SIZES, args.fenced_repeat)):
+        print()
+        print("answer wrapped in a ```json fence:" if fenced else "plain JSON answer:")
+        print(f"{'depth x branch':>14} {'nodes':>6} " + " ".join(f"{name + ' ms':>10} {name + ' KiB':>11}" for name in modes))
+        for depth, branching in sizes:
+            text = build_llm_response(depth, branching).model_dump_json(indent=2)
+            if fenced:
+                text = "```json\n" + text + "\n```"
+            results = [measure(parse, text, repeat) for parse in modes.values()]
+            print(f"{f'{depth} x {branching}':>14} {count_nodes(depth, branching):>6} "
+                  + " ".join(f"{ms:>10.2f} {kib:>11.0f}" for ms, kib in results))
+
+
+if __name__ == "__main__":
+    main()
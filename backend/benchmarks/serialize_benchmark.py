@@ -0,0 +1,127 @@
+#serialize_benchmark.py
+#Purpose: How long it takes to turn a complete story (the /stories/{id}/complete response) into JSON bytes,
+#and how many bytes go over the wire with and without compression, for trees of different sizes.
+
+#Encoders compared:
+#  jsonable_encoder + json     what FastAPI does for routes with a custom response class (and used to do for all)
+#  jsonable_encoder + orjson   ORJSONResponse (only if orjson is installed)
+#  pydantic dump_json          FastAPI's response_model path today, and how Story.document is built
+#Compression (core/compression.py): gzip at GZIP_LEVEL and at the level used for cached finished stories,
+#and br the same way if the brotli package is installed.
+
+#Usage (from the backend folder):
+#   python -m benchmarks.serialize_benchmark
+#   python -m benchmarks.serialize_benchmark --repeat 200
+
+import argparse
+import json
+import random
+import statistics
+import string
+import time
+from datetime import datetime, timezone
+
+from fastapi.encoders import jsonable_encoder
+
+from core.config import settings
+from core.compression import compress, brotli, IMMUTABLE_GZIP_LEVEL, IMMUTABLE_BROTLI_QUALITY
+from core.story_document import build_story_response
+from core.story_tree import StoryTreeLimits, flatten_story_tree
+from models.story import Story
+from benchmarks.story_fixtures import build_llm_response, count_nodes
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+TREE_SIZES = [(3, 2), (4, 3), (5, 3), (6, 3)]  # (depth, branching)
+
+
+def median_ms(fn, repeat: int) -> float:
+    fn()  # warm up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+# Pseudo-prose: a fixed vocabulary picked with a Zipf-like skew, so it compresses roughly like real text
+# (the fixture's repeated sentence would compress far better than any story).
+def prose_writer(seed: int = 7):
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(2000)]
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+
+    def write(size: int) -> str:
+        text = ""
+        while len(text) < size:
+            sentence = " ".join(rng.choices(words, weights, k=rng.randint(6, 16)))
+            text += sentence[0].upper() + sentence[1:] + ". "
+        return text[:size]
+    return write
+
+
+# The response model of a story, built from node rows the way the read path does (no database needed).
+def build_response(depth: int, branching: int):
+    story_structure = build_llm_response(depth, branching)
+    write = prose_writer()
+    limits = StoryTreeLimits(max_depth=depth, max_options=branching, max_nodes=count_nodes(depth, branching),
+                             max_text_chars=10_000, prune=False)
+    flat_nodes = flatten_story_tree(story_structure.rootNode, limits)
+    rows = [
+        {
+            "id": index + 1,
+            "is_root": flat_node["is_root"],
+            "content": write(len(flat_node["node"].content)),
+            "is_ending": flat_node["node"].isEnding,
+            "is_winning_ending": flat_node["node"].isWinningEnding,
+            "options": [{"text": write(len(text)), "node_id": child + 1} for text, child in flat_node["options"]]
+        }
+        for index, flat_node in enumerate(flat_nodes)
+    ]
+    story = Story(id=1, title=story_structure.title, session_id="benchmark", created_at=datetime.now(timezone.utc))
+    return build_story_response(story, rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Story JSON serialization and compression benchmark")
+    parser.add_argument("--repeat", type=int, default=50, help="runs per tree size and encoder")
+    args = parser.parse_args()
+
+    encoders = {"stdlib json": lambda response: json.dumps(jsonable_encoder(response)).encode()}
+    if orjson is not None:
+        encoders["orjson"] = lambda response: orjson.dumps(jsonable_encoder(response), option=orjson.OPT_NON_STR_KEYS)
+    encoders["pydantic"] = lambda response: response.model_dump_json().encode()
+
+    codings = [("gzip", False, f"gzip {settings.GZIP_LEVEL}"), ("gzip", True, f"gzip {IMMUTABLE_GZIP_LEVEL}")]
+    if brotli is not None:
+        codings += [("br", False, f"br {settings.BROTLI_QUALITY}"), ("br", True, f"br {IMMUTABLE_BROTLI_QUALITY}")]
+    else:
+        print("brotli is not installed, only gzip is measured (pip install brotli)\n")
+
+    print("serialization, median ms:")
+    print(f"{'depth x branch':>14} {'nodes':>6} " + " ".join(f"{name:>12}" for name in encoders))
+    bodies = {}
+    for depth, branching in TREE_SIZES:
+        response = build_response(depth, branching)
+        timings = [median_ms(lambda: encode(response), args.repeat) for encode in encoders.values()]
+        bodies[(depth, branching)] = response.model_dump_json().encode()
+        print(f"{f'{depth} x {branching}':>14} {count_nodes(depth, branching):>6} "
+              + " ".join(f"{ms:>12.2f}" for ms in timings))
+
+    print("\npayload size in KiB (compression ms):")
+    print(f"{'depth x branch':>14} {'raw':>8} " + " ".join(f"{label:>18}" for _, _, label in codings))
+    for (depth, branching), body in bodies.items():
+        cells = []
+        for encoding, immutable, _ in codings:
+            compressed = compress(body, encoding, immutable)
+            ms = median_ms(lambda: compress(body, encoding, immutable), max(args.repeat // 10, 3))
+            cells.append(f"{len(compressed) / 1024:>9.1f} ({ms:>5.2f})")
+        print(f"{f'{depth} x {branching}':>14} {len(body) / 1024:>8.1f} " + " ".join(f"{cell:>18}" for cell in cells))
+
+
+if __name__ == "__main__":
+    main()
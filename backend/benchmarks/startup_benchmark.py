@@ -0,0 +1,122 @@
+#startup_benchmark.py
+#Purpose: How fast a fresh API process is ready: the time to `import main` (each run in a new interpreter),
+#and the time from starting uvicorn until the first GET /docs and GET /openapi.json are answered.
+#Also fails (exit code 1) if importing main loads any of HEAVY_MODULES, which belong to the first
+#story generation or a dedicated worker.py, so a stray top-level import shows up as a regression.
+
+#Usage (from the backend folder):
+#   python -m benchmarks.startup_benchmark
+#   python -m benchmarks.startup_benchmark --runs 10 --port 8765
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+HEAVY_MODULES = ("langchain_core", "langchain_openai", "openai", "tiktoken")
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import main
+print(time.perf_counter() - start)
+print(",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def benchmark_env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("DEBUG", "true")
+    env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}")
+    env.setdefault("OPENAI_API_KEY", "benchmark")  # never used, nothing is generated
+    env["RUN_EMBEDDED_WORKER"] = "false"  # measure the API alone
+    return env
+
+
+# Seconds to import main in a new interpreter, and the heavy modules that came with it.
+def time_import(env: dict) -> tuple[float, list[str]]:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT.format(heavy=HEAVY_MODULES)],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    return float(output[0]), [name for name in output[1].split(",") if name]
+
+
+# The slowest top-level imports of main, from python -X importtime (cumulative microseconds).
+def slowest_imports(env: dict, count: int = 8) -> list[tuple[int, str]]:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        env=env, capture_output=True, text=True, check=True
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("   ") and not name.startswith("    "):  # direct imports of main (one level in)
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+# Seconds from starting uvicorn until each path answered 200 for the first time.
+def time_first_responses(env: dict, port: int, paths: list[str]) -> dict[str, float]:
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env
+    )
+    answered = {}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            for path in paths:
+                while path not in answered:
+                    if server.poll() is not None:
+                        raise RuntimeError("uvicorn exited before answering")
+                    try:
+                        if client.get(path).status_code == 200:
+                            answered[path] = time.perf_counter() - start
+                    except httpx.TransportError:
+                        time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+    return answered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API startup time benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    env = benchmark_env()
+
+    import_times, heavy = [], set()
+    for _ in range(args.runs):
+        seconds, loaded = time_import(env)
+        import_times.append(seconds)
+        heavy.update(loaded)
+    print(f"import main:        median {statistics.median(import_times) * 1000:.0f} ms, "
+          f"min {min(import_times) * 1000:.0f} ms ({args.runs} runs)")
+
+    paths = ["/docs", "/openapi.json"]
+    first = [time_first_responses(env, args.port, paths) for _ in range(args.runs)]
+    for path in paths:
+        print(f"first {path:<14} median {statistics.median(run[path] for run in first) * 1000:.0f} ms after start")
+
+    print("\nslowest imports of main (cumulative ms):")
+    for microseconds, name in slowest_imports(env):
+        print(f"  {microseconds / 1000:>8.1f}  {name}")
+
+    if heavy:
+        print(f"\nREGRESSION: importing main loaded {', '.join(sorted(heavy))}")
+        sys.exit(1)
+    print("\nno LLM modules loaded at import")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+#story_fixtures.py
+#Purpose: Builds fake stories of any size so benchmarks don't need to call OpenAI.
+
+from core.models import StoryLLMResponse, StoryNodeLLM, StoryOptionLLM
+
+
+# Builds a full tree `depth` levels deep (root included) where every non-ending node has `branching` options.
+# The last level is all endings, and the very first ending is a winning one.
+def build_llm_response(depth: int = 4, branching: int = 3, content_size: int = 200) -> StoryLLMResponse:
+    counter = {"nodes": 0}
+
+    def build_node(level: int) -> StoryNodeLLM:
+        counter["nodes"] += 1
+        number = counter["nodes"]
+        content = f"Node {number}: " + ("The path winds on. " * (content_size // 19 + 1))[:content_size]
+
+        if level >= depth:
+            return StoryNodeLLM(content=content, isEnding=True, isWinningEnding=number == depth, options=None)
+
+        options = [
+            StoryOptionLLM(text=f"Option {index + 1} from node {number}", nextNode=build_node(level + 1))
+            for index in range(branching)
+        ]
+        return StoryNodeLLM(content=content, isEnding=False, isWinningEnding=False, options=options)
+
+    return StoryLLMResponse(title=f"Benchmark story ({depth}x{branching})", rootNode=build_node(1))
+
+
+# Number of nodes in a full tree built by build_llm_response.
+def count_nodes(depth: int, branching: int) -> int:
+    return sum(branching ** level for level in range(depth))
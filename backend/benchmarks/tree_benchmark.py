@@ -0,0 +1,111 @@
+#tree_benchmark.py
+#Purpose: Feeds normal and hostile story trees (very deep, very wide, very large) through the
+#STORY_TREE_* limits and shows how many nodes are kept, how long it takes and the memory peak,
+#for the non-streaming path (flatten_story_tree) and the streaming one (StoryStreamBuilder, which stops
+#reading once the node limit is reached).
+
+#Usage (from the backend folder):
+#   python -m benchmarks.tree_benchmark
+#   python -m benchmarks.tree_benchmark --repeat 10
+
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from core.models import StoryLLMResponse, StoryNodeLLM, StoryOptionLLM
+from core.story_stream import StoryStreamBuilder
+from core.story_tree import StoryTreeBudget, StoryTreeLimits, flatten_story_tree
+from benchmarks.story_fixtures import build_llm_response, count_nodes
+
+
+# A story that is one long corridor, `levels` nodes deep (built bottom up, so no recursion here either).
+def build_chain(levels: int) -> StoryLLMResponse:
+    node = StoryNodeLLM(content="The end.", isEnding=True, isWinningEnding=True, options=None)
+    for level in range(levels - 1, 0, -1):
+        node = StoryNodeLLM(content=f"Level {level}", isEnding=False, isWinningEnding=False,
+                            options=[StoryOptionLLM(text="Go on", nextNode=node)])
+    return StoryLLMResponse(title="Chain", rootNode=node)
+
+
+# A root node with `width` options that all end at once.
+def build_wide(width: int) -> StoryLLMResponse:
+    options = [
+        StoryOptionLLM(text=f"Door {index}", nextNode=StoryNodeLLM(content="A room.", isEnding=True,
+                                                                   isWinningEnding=False, options=None))
+        for index in range(width)
+    ]
+    return StoryLLMResponse(title="Wide", rootNode=StoryNodeLLM(content="A hall of doors.", isEnding=False,
+                                                                isWinningEnding=False, options=options))
+
+
+def flatten_kept(story: StoryLLMResponse, limits: StoryTreeLimits) -> int:
+    return len(flatten_story_tree(story.rootNode, limits))
+
+
+def stream_kept(text: str, limits: StoryTreeLimits) -> int:
+    kept = []
+
+    def on_node(node, depth):
+        kept.append(node)
+        return node
+
+    builder = StoryStreamBuilder(
+        on_title=lambda title: None,
+        on_node=on_node,
+        on_option=lambda parent, option_text, child, depth: None,
+        budget=StoryTreeBudget(limits)
+    )
+    for start in range(0, len(text), 64):  # chunks about the size the LLM streams
+        builder.feed(text[start:start + 64])
+        if builder.exhausted:
+            break
+    builder.close()
+    return len(kept)
+
+
+def measure(fn, repeat: int) -> tuple[int, float, float]:
+    kept = fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return kept, statistics.median(timings) * 1000, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Story tree limits benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case")
+    args = parser.parse_args()
+
+    limits = StoryTreeLimits.from_settings()
+    print(f"limits: {limits.max_depth} levels, {limits.max_options} options, {limits.max_nodes} nodes, "
+          f"{limits.max_text_chars} chars\n")
+
+    cases = [
+        ("normal 4x3", build_llm_response(4, 3), count_nodes(4, 3)),
+        ("full 8x4", build_llm_response(8, 4, content_size=50), count_nodes(8, 4)),
+        ("wide root 5000", build_wide(5000), 5001),
+        ("chain 20000 deep", build_chain(20000), 20000),
+    ]
+
+    print(f"{'case':<18} {'nodes in':>9} {'path':>8} {'kept':>6} {'ms':>9} {'peak KiB':>9}")
+    for name, story, nodes_in in cases:
+        paths = [("flatten", lambda story=story: flatten_kept(story, limits))]
+        # pydantic's JSON output stops at about 60 nested levels, so the chain only goes through flatten
+        if not name.startswith("chain"):
+            text = story.model_dump_json()
+            paths.append(("stream", lambda text=text: stream_kept(text, limits)))
+        for path, fn in paths:
+            kept, ms, kib = measure(fn, args.repeat)
+            print(f"{name:<18} {nodes_in:>9} {path:>8} {kept:>6} {ms:>9.2f} {kib:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#compression.py
+#Purpose: Compresses JSON (and other text) responses for clients that accept it. A long story's all_nodes map
+#is mostly repeated keys and prose, so it shrinks several times over on the wire.
+
+# - CompressionMiddleware: pure ASGI middleware. Picks br (when the optional `brotli` package is installed)
+#   or gzip from Accept-Encoding and compresses bodies of at least COMPRESSION_MIN_BYTES.
+#   Streamed responses (the SSE on /jobs/{id}/events) and bodies that are already encoded pass through untouched.
+# - ETags: a compressed body is a different representation, so its ETag gets the coding appended
+#   ("abc" -> "abc-gzip"). etag_matches (core/response_cache.py) strips it again, so a client's
+#   If-None-Match still gets 304 whichever coding it stored. That 304 carries the ETag the client stored
+#   (suffix included) and the same Vary as the 200 it revalidates.
+# - Vary: Accept-Encoding goes on every response of a compressible type, compressed or not, so a shared cache
+#   keeps the variants of one URL apart.
+# - Immutable responses (finished stories) are compressed once at a higher level and kept in a small LRU
+#   keyed by ETag + coding, so repeat reads don't pay for compression either.
+# Starlette's GZipMiddleware does none of the last three, which is why this isn't just that.
+
+import gzip
+from typing import Optional
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+from core.config import settings
+from core.response_cache import LRUBytesCache, CachedResponse, strip_encoding_suffix
+
+try:
+    import brotli  # optional dependency: pip install brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+SKIPPED_TYPES = ("text/event-stream",)
+THREAD_MIN_BYTES = 128 * 1024  # bigger bodies are compressed in a worker thread, off the event loop
+
+# Compressed once and cached, so spend more CPU for smaller bodies.
+IMMUTABLE_GZIP_LEVEL = 9
+IMMUTABLE_BROTLI_QUALITY = 9
+
+
+# The coding to use for this Accept-Encoding header, or None: br first, then gzip. "q=0" means "not this one".
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    wildcard = accepted.get("*", 0.0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str, immutable: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=IMMUTABLE_BROTLI_QUALITY if immutable else settings.BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=IMMUTABLE_GZIP_LEVEL if immutable else settings.GZIP_LEVEL, mtime=0)
+
+
+# Decided from the headers alone, before any body arrives.
+def compressible(status: int, headers: Headers) -> bool:
+    content_type = headers.get("content-type", "")
+    return (
+        status not in (204, 304)
+        and "content-encoding" not in headers
+        and content_type.startswith(COMPRESSIBLE_TYPES)
+        and not content_type.startswith(SKIPPED_TYPES)
+    )
+
+
+# The encoded variant of etag ("abc-gzip") that an If-None-Match header names, or None if it only names etag
+# itself (or nothing). That is the validator the client stored, so the 304 has to repeat it.
+def revalidated_etag(etag: str, if_none_match: str) -> Optional[str]:
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip().removeprefix("W/")
+        if candidate != etag and strip_encoding_suffix(candidate) == etag:
+            return candidate
+    return None
+
+
+class CompressionMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+        self.cache = LRUBytesCache(settings.COMPRESSION_CACHE_MAX_BYTES)  # ETag + coding -> compressed body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""))
+        if_none_match = request_headers.get("if-none-match", "")
+
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                if message["status"] == 304:
+                    headers.add_vary_header("Accept-Encoding")
+                    etag = headers.get("etag")
+                    encoded_etag = revalidated_etag(etag, if_none_match) if etag and encoding else None
+                    if encoded_etag:
+                        headers["ETag"] = encoded_etag
+                    passthrough = True
+                    await send(message)
+                elif not compressible(message["status"], headers):
+                    passthrough = True  # e.g. the SSE stream: headers go out right away
+                    await send(message)
+                elif encoding is None:
+                    headers.add_vary_header("Accept-Encoding")  # another client may get it compressed
+                    passthrough = True
+                    await send(message)
+                else:
+                    headers.add_vary_header("Accept-Encoding")
+                    start_message = message  # headers may still change, wait for the body
+                return
+
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start_message["headers"])
+            # only whole bodies: a streamed response is sent on as it comes
+            if message.get("more_body", False) or len(body) < settings.COMPRESSION_MIN_BYTES:
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = await self._compress(body, encoding, headers)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            etag = headers.get("etag")
+            if etag and etag.endswith('"'):
+                headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+    async def _compress(self, body: bytes, encoding: str, headers: MutableHeaders) -> bytes:
+        etag = headers.get("etag")
+        immutable = etag is not None and "immutable" in headers.get("cache-control", "")
+        if immutable:
+            cached = self.cache.get(etag + encoding)
+            if cached is not None:
+                return cached.body
+
+        if len(body) >= THREAD_MIN_BYTES:
+            compressed = await anyio.to_thread.run_sync(compress, body, encoding, immutable)
+        else:
+            compressed = compress(body, encoding, immutable)
+
+        if immutable:
+            self.cache.set(etag + encoding, CachedResponse(compressed, etag))
+        return compressed
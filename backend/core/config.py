@@ -17,14 +17,139 @@ class Settings(BaseSettings):
 
     DATABASE_URL: str = None  # The database connection string (set dynamically if not in debug mode)
 
+    # Embedded SQLite instead of Postgres, for small single-node deployments (see db/database.py, core/sqlite_writer.py)
+    SQLITE_PATH: str = ""  # Database file; when set it is used instead of DATABASE_URL / the DB_* Postgres settings, DEBUG or not
+    SQLITE_JOURNAL_MODE: str = "wal"  # "wal": readers never wait for the writer and the writer never waits for readers
+    SQLITE_SYNCHRONOUS: str = "normal"  # "normal": in WAL mode safe against app crashes, a power cut may lose the last commits; "full" fsyncs every commit
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000  # How long a connection waits for the write lock before "database is locked"
+    SQLITE_CACHE_SIZE_KB: int = 64 * 1024  # Page cache per connection
+    SQLITE_MMAP_SIZE_BYTES: int = 256 * 1024 * 1024  # Read the file through memory mapping up to this size (0 = off)
+    SQLITE_WRITE_QUEUE: bool = True  # Story saves go through one writer thread per process instead of competing for the write lock
+
+    # Connection pool per engine and process (the API uses an async engine, workers a sync one)
+    DB_POOL_SIZE: int = 10  # Connections kept open
+    DB_MAX_OVERFLOW: int = 20  # Extra connections allowed under load, closed again when returned
+    DB_POOL_TIMEOUT: int = 30  # Seconds to wait for a free connection before failing the request
+    DB_POOL_RECYCLE: int = 1800  # Replace connections older than this (avoids server/proxy idle timeouts)
+    DB_POOL_PRE_PING: bool = True  # Check a connection is alive before using it
+
+    CREATE_TABLES_ON_STARTUP: bool = False  # Create missing tables when the API / worker starts (otherwise run `python manage.py create-tables` once)
+
     ALLOWED_ORIGINS: str = ""  # Comma-separated list of origins allowed for CORS requests
 
     OPENAI_API_KEY: str  # API key for OpenAI services (must be set in environment variables)
 
+    # The LLM client, shared by all jobs in a process (see core/llm_context.py)
+    LLM_MODEL: str = "gpt-4o-mini"  # OpenAI chat model used for stories
+    LLM_MAX_CONNECTIONS: int = 20  # HTTP connections kept to the LLM endpoint (at least WORKER_CONCURRENCY)
+    LLM_KEEPALIVE_SECONDS: float = 60  # Idle connections are kept this long for reuse by the next job
+    LLM_OUTPUT_MODE: str = "json"  # "json": provider JSON mode + one-pass validation, "parser": JSON schema in the prompt + PydanticOutputParser
+
+    # Deadlines, retries and hedged requests for every LLM call (see core/llm_call.py)
+    LLM_ATTEMPT_TIMEOUT_SECONDS: float = 120  # One request is given up after this (streaming: after this long without a chunk); 0 = no limit
+    LLM_MAX_ATTEMPTS: int = 3  # Tries per call, the first one included; timeouts, 429/5xx and answers that don't parse are retried
+    LLM_BACKOFF_BASE_SECONDS: float = 1.0  # Wait before the second try, doubled for every further one (with jitter)
+    LLM_BACKOFF_MAX_SECONDS: float = 20.0  # Upper bound for one wait, also for a provider's Retry-After
+    LLM_HEDGE_ENABLED: bool = False  # Send a second identical request when the first is slower than usual; the first valid answer wins
+    LLM_HEDGE_PERCENTILE: float = 0.95  # "Slower than usual": this percentile of recent successful requests of the same kind
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 1.0  # Never hedge earlier than this
+    LLM_HEDGE_MIN_SAMPLES: int = 20  # Successful requests seen before the percentile is trusted (no hedging until then)
+
+    # How stories are generated (see core/story_generator.py)
+    STORY_GENERATION_MODE: str = "single"  # "single": one blocking LLM call, "stream": save nodes while the LLM is still writing, "fanout": outline first, then all branches in parallel
+    FANOUT_MAX_CONCURRENCY: int = 3  # Branch calls in flight at once per story (fanout mode)
+    FANOUT_BRANCH_LEVELS: int = 3  # Levels per branch below the root (fanout mode); the whole story is one level deeper
+
+    # Limits on the story tree the LLM sends back, checked before anything is saved (see core/story_tree.py)
+    STORY_TREE_MAX_DEPTH: int = 6  # Levels, root included
+    STORY_TREE_MAX_OPTIONS: int = 4  # Options per node
+    STORY_TREE_MAX_NODES: int = 400  # Nodes per story
+    STORY_TREE_MAX_TEXT_CHARS: int = 4000  # Characters per node content and per option text
+    STORY_TREE_LIMIT_MODE: str = "prune"  # "prune": cut the tree down to the limits, "reject": fail the job
+
+    # Sharing generations between players who ask for the same theme (see core/story_cache.py)
+    THEME_SINGLE_FLIGHT: bool = True  # Jobs with the same theme that run at the same time share one LLM call
+    THEME_CACHE_ENABLED: bool = False  # Also reuse a recently generated story for the same theme
+    THEME_CACHE_MAX_ENTRIES: int = 256  # Least recently used themes are dropped beyond this
+    THEME_CACHE_TTL_SECONDS: int = 600  # How long a generated story is reused for its theme
+
+    # Warm pool of ready-made stories for popular themes (see core/story_pool.py)
+    STORY_POOL_ENABLED: bool = False  # Keep stories ready and hand them out instantly on POST /stories/create
+    STORY_POOL_THEMES: str = ""  # Comma-separated themes to keep ready, e.g. "fantasy,space pirates,haunted house"
+    STORY_POOL_SIZE_PER_THEME: int = 3  # Ready stories kept per theme
+    STORY_POOL_GENERIC_SIZE: int = 2  # Ready stories for players who ask for any theme (STORY_POOL_GENERIC_ALIASES)
+    STORY_POOL_GENERIC_ALIASES: str = "random,any,surprise me"  # Themes that mean "anything is fine"
+    STORY_POOL_GENERIC_THEME: str = "a surprising adventure in any setting"  # What generic stories are generated with
+    STORY_POOL_REFILL_CONCURRENCY: int = 2  # LLM calls the filler makes at once (on top of the worker slots)
+    STORY_POOL_CHECK_SECONDS: float = 30  # How often the filler looks for missing stories when nothing was claimed
+
+    # Cache of finished /stories/{id}/complete responses (see core/response_cache.py)
+    STORY_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # In-process cache size per API process
+    STORY_CACHE_REDIS_URL: str = ""  # Optional shared cache for all processes, e.g. redis://localhost:6379/0
+
+    # GET /stories/{story_id}/nodes/{node_id}: how many levels of children come with each node
+    NODE_PREFETCH_DEPTH: int = 2  # Default when the client doesn't ask for a depth
+    NODE_PREFETCH_MAX_DEPTH: int = 5  # Upper limit a client can ask for
+
+    # GET /stories: the caller's story library, one page at a time
+    STORY_LIST_PAGE_SIZE: int = 20  # Default when the client doesn't ask for a limit
+    STORY_LIST_MAX_PAGE_SIZE: int = 100  # Upper limit a client can ask for
+
+    # Response compression (see core/compression.py)
+    COMPRESSION_ENABLED: bool = True  # gzip/br for clients that send Accept-Encoding (br needs the `brotli` package)
+    COMPRESSION_MIN_BYTES: int = 1024  # Smaller bodies are sent as they are (not worth the CPU, may even grow)
+    GZIP_LEVEL: int = 6  # 1 (fast) .. 9 (small), for responses that are compressed on every request
+    BROTLI_QUALITY: int = 5  # 0 (fast) .. 11 (small), same
+    COMPRESSION_CACHE_MAX_BYTES: int = 32 * 1024 * 1024  # Compressed finished stories kept per API process
+
+    # Limits on POST /stories/create (see core/rate_limit.py); 0 turns a limit off
+    RATE_LIMIT_SESSION_PER_MINUTE: float = 6  # Stories one session can create per minute, on average
+    RATE_LIMIT_SESSION_BURST: int = 3  # Stories one session can create back to back
+    RATE_LIMIT_IP_PER_MINUTE: float = 30  # Same per client address (new sessions are free to make, addresses are not)
+    RATE_LIMIT_IP_BURST: int = 10
+    # POST /stories/batch has buckets of its own, one token per theme, so seeding neither eats into a player's
+    # /create budget nor is capped by it
+    RATE_LIMIT_BATCH_SESSION_PER_MINUTE: float = 100  # Batch themes one session can submit per minute, on average
+    RATE_LIMIT_BATCH_SESSION_BURST: int = 100  # Batch themes one session can submit at once
+    RATE_LIMIT_BATCH_IP_PER_MINUTE: float = 200  # Same per client address
+    RATE_LIMIT_BATCH_IP_BURST: int = 200
+    RATE_LIMIT_TRUST_FORWARDED_FOR: bool = False  # Take the client address from X-Forwarded-For (only behind a trusted proxy)
+    RATE_LIMIT_REDIS_URL: str = ""  # Share the limits between API processes, e.g. redis://localhost:6379/1
+    MAX_ACTIVE_JOBS: int = 200  # Pending + processing jobs allowed in total before new ones are refused
+    ACTIVE_JOBS_RETRY_AFTER_SECONDS: int = 10  # Retry-After sent when MAX_ACTIVE_JOBS is reached
+
+    # Story generation workers (see core/worker.py)
+    RUN_EMBEDDED_WORKER: bool = True  # Also run a worker inside the API process (turn off when running worker.py separately)
+    WORKER_CONCURRENCY: int = 4  # How many stories one worker process generates at the same time (LLM slots)
+    WORKER_POLL_SECONDS: float = 1.0  # How long an idle slot waits before looking for pending jobs again
+    JOB_LEASE_SECONDS: int = 120  # A claimed job is re-queued if its worker stops heartbeating for this long
+    JOB_HEARTBEAT_SECONDS: int = 15  # How often a worker renews the lease on the jobs it is running
+    JOB_MAX_ATTEMPTS: int = 3  # Stale jobs are re-queued until they have been claimed this many times
+    JOB_MAX_RUNTIME_SECONDS: int = 1800  # Processing jobs older than this are failed even if their worker still heartbeats
+    JOB_DEADLINE_SECONDS: int = 600  # A job still unfinished this long after it was created stops itself as timed_out (0 = no deadline)
+
+    # Batches of themes submitted at once with POST /stories/batch (see core/worker.py)
+    STORY_BATCH_MAX_THEMES: int = 100  # Themes allowed in one request (also at most RATE_LIMIT_BATCH_*_BURST: every theme costs a token)
+    STORY_BATCH_CLAIM_SIZE: int = 8  # Jobs of the same batch a worker slot claims and writes together (1 = one by one, like other jobs)
+    STORY_BATCH_MAX_CONCURRENCY: int = 4  # LLM calls in flight at once for the jobs a slot claimed together
+
+    # Cleaning up the story_jobs table (see JobQueue.purge_finished, run by the worker housekeeping)
+    JOB_MAINTENANCE_SECONDS: int = 300  # How often a worker runs the stuck-job check and retention sweep
+    JOB_RETENTION_SECONDS: int = 7 * 24 * 3600  # Completed/failed jobs are removed this long after finishing (0 = keep forever)
+    JOB_RETENTION_BATCH_SIZE: int = 1000  # Jobs removed per transaction
+    JOB_RETENTION_MAX_BATCHES: int = 10  # Batches per housekeeping run, so a big backlog is worked off gradually
+    JOB_ARCHIVE_ENABLED: bool = False  # Copy removed jobs into story_jobs_archive instead of just deleting them
+
+    # Prometheus metrics (see core/metrics.py)
+    METRICS_ENABLED: bool = True  # Serve GET /metrics on the API and time every request
+    WORKER_METRICS_PORT: int = 0  # Standalone worker.py serves its own metrics on this port (0 = off)
+
     # Custom initialization logic to build DATABASE_URL when DEBUG is False
     def __init__(self, **values):
         super().__init__(**values)
-        if not self.DEBUG:
+        if self.SQLITE_PATH:
+            self.DATABASE_URL = f"sqlite:///{self.SQLITE_PATH}"
+        elif not self.DEBUG:
             # Pull database credentials from environment variables
             db_user = os.getenv("DB_USER")
             db_password = os.getenv("DB_PASSWORD")
@@ -0,0 +1,132 @@
+#job_control.py
+#Purpose: Lets a running story job be stopped part way, when its player cancels it (DELETE /jobs/{job_id}) or it
+#runs past JOB_DEADLINE_SECONDS, so its worker slot and DB connection go to the next queued job.
+
+# Stopping is cooperative: the generator calls check_job() where stopping is safe (before and while waiting for
+# an LLM attempt, between streamed chunks, before saving). The JobAborted it raises unwinds the job like any other
+# error (a half-written story is deleted, the transaction rolled back) and run_story_job records the job as
+# cancelled or timed_out instead of failed.
+# - JobControl: the cancel flag and the deadline of one running job.
+# - control_job(): makes a JobControl the current one (a contextvar, so fan-out branch threads started with a copy
+#   of the context see it too) and lists it in running_jobs. current_job() does only the first part.
+# - running_jobs: this process's running jobs by job_id. The API cancels through it right away when the worker
+#   runs in the same process; other workers notice cancel_requested_at on their next heartbeat.
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class JobAborted(Exception):
+
+    def __init__(self, status: str, message: str):
+        super().__init__(message)
+        self.status = status  # "cancelled" or "timed_out"
+
+
+class JobControl:
+
+    def __init__(self, job_id: str, deadline: Optional[float] = None):
+        self.job_id = job_id
+        self.deadline = deadline  # time.monotonic() value, None = no deadline
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    # Seconds until the deadline (negative once it passed), None without one.
+    def time_left(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise JobAborted("cancelled", "Job was cancelled")
+        time_left = self.time_left()
+        if time_left is not None and time_left <= 0:
+            raise JobAborted("timed_out", "Job ran past its deadline")
+
+    # Sleeps like time.sleep, but wakes up (and raises) as soon as the job is cancelled or out of time.
+    def sleep(self, seconds: float):
+        time_left = self.time_left()
+        if time_left is not None:
+            seconds = min(seconds, max(time_left, 0))
+        self._cancelled.wait(seconds)
+        self.check()
+
+
+class RunningJobs:
+
+    def __init__(self):
+        self._controls = {}  # job_id -> JobControl
+        self._lock = threading.Lock()
+
+    def add(self, control: JobControl):
+        with self._lock:
+            self._controls[control.job_id] = control
+
+    def remove(self, control: JobControl):
+        with self._lock:
+            if self._controls.get(control.job_id) is control:
+                del self._controls[control.job_id]
+
+    # True if the job runs in this process (it stops at its next check).
+    def cancel(self, job_id: str) -> bool:
+        with self._lock:
+            control = self._controls.get(job_id)
+        if control is None:
+            return False
+        control.cancel()
+        return True
+
+
+# One registry per process, like settings.
+running_jobs = RunningJobs()
+
+_current: contextvars.ContextVar[Optional[JobControl]] = contextvars.ContextVar("job_control", default=None)
+
+
+@contextmanager
+def control_job(control: JobControl) -> Iterator[JobControl]:
+    running_jobs.add(control)
+    try:
+        with current_job(control):
+            yield control
+    finally:
+        running_jobs.remove(control)
+
+
+# Only makes control the current one, for code that keeps it in running_jobs itself
+# (a batch lists all its jobs for as long as the batch runs, core/worker.py).
+@contextmanager
+def current_job(control: JobControl) -> Iterator[JobControl]:
+    token = _current.set(control)
+    try:
+        yield control
+    finally:
+        _current.reset(token)
+
+
+# Raises JobAborted if the current job was cancelled or is out of time. Does nothing outside a job
+# (e.g. a benchmark calling the generator directly), so generation code can call it anywhere.
+def check_job():
+    control = _current.get()
+    if control is not None:
+        control.check()
+
+
+# Seconds the current job has left, None outside a job or without a deadline.
+def job_time_left() -> Optional[float]:
+    control = _current.get()
+    return control.time_left() if control is not None else None
+
+
+def job_sleep(seconds: float):
+    control = _current.get()
+    if control is None:
+        time.sleep(seconds)
+    else:
+        control.sleep(seconds)
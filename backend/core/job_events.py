@@ -0,0 +1,120 @@
+#job_events.py
+#Purpose: Pushes story job status changes to whoever is waiting for them (the /jobs/{job_id}/events stream),
+#so clients don't have to poll the database.
+
+# - JobQueue calls notify() after every status change it commits.
+# - On Postgres, notify() sends a NOTIFY; every API process LISTENs on the channel and fans the
+#   event out to its own subscribers, so workers on other processes/hosts reach every client.
+# - Anywhere else (SQLite, embedded worker) events are delivered in-process directly.
+
+import asyncio
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+
+from sqlalchemy import func
+from sqlalchemy import select as sql_select
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "story_job_events"
+TERMINAL_STATUSES = ("completed", "failed", "cancelled", "timed_out")
+
+
+class JobEventHub:
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)  # job_id -> {(event loop, asyncio.Queue)}
+        self._lock = threading.Lock()
+        self._listener = None
+        self._stop = threading.Event()
+
+    # Registers the calling coroutine's interest in a job; events arrive on the returned queue.
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers[job_id].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id)
+            if not subscribers:
+                return
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    # Hands an event to every local subscriber of its job. Safe to call from any thread.
+    def publish(self, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(event["job_id"], ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                pass  # the subscriber's event loop is already closed
+
+    # Announces a committed status change, through Postgres when available so every process hears it.
+    def notify(self, db: Session, event: dict):
+        if db.get_bind().dialect.name == "postgresql":
+            db.execute(sql_select(func.pg_notify(NOTIFY_CHANNEL, json.dumps(event, default=str))))
+            db.commit()
+        else:
+            self.publish(event)
+
+    # notify() for the API's async sessions.
+    async def notify_async(self, db: AsyncSession, event: dict):
+        if db.bind.dialect.name == "postgresql":
+            await db.execute(sql_select(func.pg_notify(NOTIFY_CHANNEL, json.dumps(event, default=str))))
+            await db.commit()
+        else:
+            self.publish(event)
+
+    # Starts the LISTEN thread for Postgres; does nothing for other databases.
+    def start(self, engine: Engine):
+        if engine.dialect.name != "postgresql" or self._listener:
+            return
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen, args=(engine,), name="job-event-listener", daemon=True)
+        self._listener.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._listener:
+            self._listener.join(timeout=5)
+            self._listener = None
+
+    # Keeps one dedicated connection LISTENing and republishes every notification locally.
+    # Reconnects after errors so a database restart doesn't silently stop the events.
+    def _listen(self, engine: Engine):
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                dbapi_connection = connection.dbapi_connection
+                dbapi_connection.autocommit = True
+                dbapi_connection.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+
+                while not self._stop.is_set():
+                    if select.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notification = dbapi_connection.notifies.pop(0)
+                        self.publish(json.loads(notification.payload))
+            except Exception:
+                logger.exception("Job event listener lost its connection, reconnecting")
+                self._stop.wait(1.0)
+            finally:
+                if connection is not None:
+                    connection.invalidate()  # don't hand a LISTENing connection back to the pool
+
+
+# One hub per process, like settings.
+job_events = JobEventHub()
@@ -0,0 +1,340 @@
+#job_queue.py
+#Purpose: Turns the story_jobs table into a durable queue that any number of worker processes can share.
+
+# - claim_next: atomically moves one pending job to processing for a worker (FOR UPDATE SKIP LOCKED on Postgres).
+# - claim_batch: claims more pending jobs of the same batch (POST /stories/batch) to write them together.
+# - heartbeat: keeps the worker's lease on a job alive while it is generating.
+# - requeue_stale: puts jobs back to pending when their worker died (lease ran out), or fails them after too many tries.
+# - fail_stuck: fails jobs that have been processing for longer than JOB_MAX_RUNTIME_SECONDS (e.g. a hung LLM call).
+# - purge_finished: removes (or archives) completed/failed jobs after JOB_RETENTION_SECONDS, in batches.
+# - mark_playable: a streamed story can already be played while the job is still processing.
+# - complete / fail / abort: final status updates, only applied if the worker still owns the job.
+# - cancel: DELETE /jobs/{job_id} (the one async method, it runs in the API); cancel_requested tells a worker
+#   which of its running jobs to stop (core/job_control.py).
+# Every status change is announced through core/job_events.py once it is committed.
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select, update, delete, insert, func, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.job_control import running_jobs
+from core.job_events import job_events
+from models.job import StoryJob, StoryJobArchive, ACTIVE_JOB_STATUSES, FINISHED_JOB_STATUSES
+
+CANCELLED_ERROR = "Job was cancelled"
+
+# Added to queries on pending/processing jobs so they can use the partial index ix_story_jobs_active
+# (Postgres works this out from `status = ...` alone, SQLite needs the index condition spelled out).
+# SQLite only matches the index's WHERE clause against literal values, so the statuses are rendered into the
+# SQL (`status IN ('pending', 'processing')`) instead of being sent as bound parameters.
+IS_ACTIVE = StoryJob.status.in_(bindparam("active_statuses", list(ACTIVE_JOB_STATUSES), expanding=True, literal_execute=True))
+# Same for ix_story_jobs_finished_v2 (the retention sweep).
+IS_FINISHED = StoryJob.status.in_(bindparam("finished_statuses", list(FINISHED_JOB_STATUSES), expanding=True, literal_execute=True))
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# The payload pushed to clients: same field names as StoryJobResponse.
+def job_event(job_id: str, status: str, story_id: int = None, error: str = None, playable_at: str = None) -> dict:
+    return {"job_id": job_id, "status": status, "story_id": story_id, "error": error, "playable_at": playable_at}
+
+
+class JobQueue:
+
+    # Claims the oldest pending job for this worker and returns it, or None if there is nothing to do.
+    # Players' own jobs go before jobs from POST /stories/batch, so seeding a big batch never makes them wait:
+    # batch jobs are only looked at when no player job is pending. Both lookups read ix_story_jobs_active in
+    # (created_at, id) order, so neither has to sort the backlog.
+    # On Postgres the SELECT skips rows another worker has locked, so workers never wait on each other.
+    # The UPDATE re-checks status="pending" so the claim is also safe on SQLite, which has no row locks;
+    # losing that race just means trying the next pending job.
+    @classmethod
+    def claim_next(cls, db: Session, worker_id: str, max_races: int = 5) -> Optional[StoryJob]:
+        for _ in range(max_races):
+            job_pk = cls._oldest_pending(db, StoryJob.batch_id.is_(None))
+            if job_pk is None:
+                job_pk = cls._oldest_pending(db, StoryJob.batch_id.is_not(None))
+
+            if job_pk is None:
+                db.rollback()  # release the (empty) transaction
+                return None
+
+            claimed_job_id = db.execute(
+                update(StoryJob)
+                .where(StoryJob.id == job_pk, StoryJob.status == "pending")
+                .values(**cls._claim_values(worker_id))
+                .returning(StoryJob.job_id)
+            ).scalar()
+            db.commit()
+
+            if claimed_job_id is not None:
+                job_events.notify(db, job_event(claimed_job_id, "processing"))
+                return db.get(StoryJob, job_pk)
+
+        return None  # kept losing races, the slot will simply try again after its poll delay
+
+    @classmethod
+    def _oldest_pending(cls, db: Session, condition) -> Optional[int]:
+        return db.execute(
+            select(StoryJob.id)
+            .where(IS_ACTIVE, StoryJob.status == "pending", condition)
+            .order_by(StoryJob.created_at, StoryJob.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar()
+
+    # Claims up to `limit` more pending jobs of a batch, for a slot that just claimed one of them
+    # (STORY_BATCH_CLAIM_SIZE). Jobs another worker got first are simply not in the result.
+    @classmethod
+    def claim_batch(cls, db: Session, worker_id: str, batch_id: str, limit: int) -> list[StoryJob]:
+        if limit <= 0:
+            return []
+        job_pks = db.execute(
+            select(StoryJob.id)
+            .where(IS_ACTIVE, StoryJob.status == "pending", StoryJob.batch_id == batch_id)
+            .order_by(StoryJob.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not job_pks:
+            db.rollback()
+            return []
+
+        claimed = db.execute(
+            update(StoryJob)
+            .where(StoryJob.id.in_(job_pks), StoryJob.status == "pending")
+            .values(**cls._claim_values(worker_id))
+            .returning(StoryJob.id, StoryJob.job_id)
+        ).all()
+        db.commit()
+
+        for row in claimed:
+            job_events.notify(db, job_event(row.job_id, "processing"))
+        if not claimed:
+            return []
+        return list(db.execute(select(StoryJob).where(StoryJob.id.in_([row.id for row in claimed]))).scalars())
+
+    @classmethod
+    def _claim_values(cls, worker_id: str) -> dict:
+        now = utcnow()
+        return dict(
+            status="processing",
+            worker_id=worker_id,
+            attempts=func.coalesce(StoryJob.attempts, 0) + 1,
+            started_at=now,
+            heartbeat_at=now,
+            lease_expires_at=now + timedelta(seconds=settings.JOB_LEASE_SECONDS)
+        )
+
+    # Extends the lease on a job. Returns False if the worker no longer owns it
+    # (it was re-queued after a long pause and picked up by someone else).
+    @classmethod
+    def heartbeat(cls, db: Session, job_id: str, worker_id: str) -> bool:
+        now = utcnow()
+        result = db.execute(
+            update(StoryJob)
+            .where(StoryJob.job_id == job_id, StoryJob.worker_id == worker_id, StoryJob.status == "processing")
+            .values(heartbeat_at=now, lease_expires_at=now + timedelta(seconds=settings.JOB_LEASE_SECONDS))
+        )
+        db.commit()
+        return result.rowcount == 1
+
+    # Finds processing jobs whose lease ran out (their worker crashed or was restarted).
+    # They go back to pending, unless they already used up JOB_MAX_ATTEMPTS, in which case they fail,
+    # or their player cancelled them meanwhile, in which case they are cancelled.
+    # Returns how many jobs were touched.
+    @classmethod
+    def requeue_stale(cls, db: Session) -> int:
+        now = utcnow()
+        stale = IS_ACTIVE & (StoryJob.status == "processing") & (StoryJob.lease_expires_at < now)
+        out_of_attempts = func.coalesce(StoryJob.attempts, 0) >= settings.JOB_MAX_ATTEMPTS
+
+        error = f"Job abandoned by its worker {settings.JOB_MAX_ATTEMPTS} times"
+
+        cancelled = db.execute(
+            update(StoryJob)
+            .where(stale, StoryJob.cancel_requested_at.is_not(None))
+            .values(status="cancelled", error=CANCELLED_ERROR, completed_at=now, worker_id=None, lease_expires_at=None)
+            .returning(StoryJob.job_id)
+        ).scalars().all()
+        failed = db.execute(
+            update(StoryJob)
+            .where(stale, out_of_attempts)
+            .values(status="failed", error=error, completed_at=now, worker_id=None, lease_expires_at=None)
+            .returning(StoryJob.job_id)
+        ).scalars().all()
+        requeued = db.execute(
+            update(StoryJob)
+            .where(stale, ~out_of_attempts)
+            .values(status="pending", worker_id=None, lease_expires_at=None)
+            .returning(StoryJob.job_id)
+        ).scalars().all()
+        db.commit()
+
+        for job_id in cancelled:
+            job_events.notify(db, job_event(job_id, "cancelled", error=CANCELLED_ERROR))
+        for job_id in failed:
+            job_events.notify(db, job_event(job_id, "failed", error=error))
+        for job_id in requeued:
+            job_events.notify(db, job_event(job_id, "pending"))
+        return len(cancelled) + len(failed) + len(requeued)
+
+    # Fails jobs that have been processing for too long, even though their worker is still alive and heartbeating.
+    # If that worker finishes later, complete()/fail() see the job is no longer theirs and change nothing.
+    @classmethod
+    def fail_stuck(cls, db: Session) -> int:
+        now = utcnow()
+        error = f"Job ran for more than {settings.JOB_MAX_RUNTIME_SECONDS} seconds"
+
+        failed = db.execute(
+            update(StoryJob)
+            .where(
+                IS_ACTIVE,
+                StoryJob.status == "processing",
+                StoryJob.started_at < now - timedelta(seconds=settings.JOB_MAX_RUNTIME_SECONDS)
+            )
+            .values(status="failed", error=error, completed_at=now, worker_id=None, lease_expires_at=None)
+            .returning(StoryJob.job_id)
+        ).scalars().all()
+        db.commit()
+
+        for job_id in failed:
+            job_events.notify(db, job_event(job_id, "failed", error=error))
+        return len(failed)
+
+    # Deletes completed/failed jobs that finished more than JOB_RETENTION_SECONDS ago, oldest first,
+    # batch_size per transaction and at most max_batches transactions (None = until none are left).
+    # With JOB_ARCHIVE_ENABLED they are copied into story_jobs_archive in the same transaction.
+    # The stories they produced are kept. Returns how many jobs were removed.
+    @classmethod
+    def purge_finished(cls, db: Session, batch_size: int = None, max_batches: Optional[int] = None) -> int:
+        if settings.JOB_RETENTION_SECONDS <= 0:
+            return 0
+
+        batch_size = batch_size or settings.JOB_RETENTION_BATCH_SIZE
+        cutoff = utcnow() - timedelta(seconds=settings.JOB_RETENTION_SECONDS)
+        removed = 0
+        batches = 0
+
+        while max_batches is None or batches < max_batches:
+            job_pks = db.execute(
+                select(StoryJob.id)
+                .where(IS_FINISHED, StoryJob.completed_at < cutoff)
+                .order_by(StoryJob.completed_at)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)  # another worker's sweep takes other rows
+            ).scalars().all()
+            if not job_pks:
+                db.rollback()
+                break
+
+            if settings.JOB_ARCHIVE_ENABLED:
+                columns = ["id", "job_id", "session_id", "theme", "status", "story_id", "error", "attempts", "created_at", "completed_at"]
+                db.execute(
+                    insert(StoryJobArchive).from_select(
+                        columns,
+                        select(*(getattr(StoryJob, column) for column in columns)).where(StoryJob.id.in_(job_pks))
+                    )
+                )
+            db.execute(delete(StoryJob).where(StoryJob.id.in_(job_pks)))
+            db.commit()
+
+            removed += len(job_pks)
+            batches += 1
+            if len(job_pks) < batch_size:
+                break
+
+        return removed
+
+    # Streaming mode: points the job at its story before generation is over.
+    @classmethod
+    def mark_playable(cls, db: Session, job_id: str, worker_id: str, story_id: int) -> bool:
+        playable_at = utcnow()
+        result = db.execute(
+            update(StoryJob)
+            .where(StoryJob.job_id == job_id, StoryJob.worker_id == worker_id, StoryJob.status == "processing")
+            .values(story_id=story_id, playable_at=playable_at)
+        )
+        db.commit()
+
+        if result.rowcount != 1:
+            return False
+        job_events.notify(db, job_event(job_id, "processing", story_id=story_id, playable_at=playable_at.isoformat()))
+        return True
+
+    # Marks the job completed with its story. Returns False if the worker lost the job in the meantime.
+    # llm_attempts: the LLM requests made for it (core/llm_call.py), stored on the row but not sent to clients.
+    @classmethod
+    def complete(cls, db: Session, job_id: str, worker_id: str, story_id: int, llm_attempts: list = None) -> bool:
+        return cls._finish(db, job_id, worker_id, llm_attempts, status="completed", story_id=story_id)
+
+    # Marks the job failed with the error message. Returns False if the worker lost the job in the meantime.
+    @classmethod
+    def fail(cls, db: Session, job_id: str, worker_id: str, error: str, llm_attempts: list = None) -> bool:
+        return cls._finish(db, job_id, worker_id, llm_attempts, status="failed", error=error)
+
+    # Marks the job cancelled or timed_out (JobAborted.status) after its worker stopped it part way.
+    # A streamed story it already pointed at has been deleted again, so story_id is cleared.
+    @classmethod
+    def abort(cls, db: Session, job_id: str, worker_id: str, status: str, error: str, llm_attempts: list = None) -> bool:
+        return cls._finish(db, job_id, worker_id, llm_attempts, status=status, error=error, story_id=None)
+
+    # Which of these running jobs their players asked to cancel (checked by workers on every heartbeat).
+    @classmethod
+    def cancel_requested(cls, db: Session, job_ids: list[str]) -> list[str]:
+        if not job_ids:
+            return []
+        job_ids = db.execute(
+            select(StoryJob.job_id)
+            .where(IS_ACTIVE, StoryJob.job_id.in_(job_ids), StoryJob.cancel_requested_at.is_not(None))
+        ).scalars().all()
+        db.rollback()  # end the read transaction, like the other housekeeping queries
+        return job_ids
+
+    # DELETE /jobs/{job_id}, for the session that created the job. A pending job is cancelled on the spot,
+    # so no worker ever claims it. A processing one gets cancel_requested_at and is stopped by its worker:
+    # right away when that runs in this process, otherwise on its next heartbeat.
+    # Returns the job as it is afterwards (finished jobs unchanged), or None if the session has no such job.
+    @classmethod
+    async def cancel(cls, db: AsyncSession, job_id: str, session_id: str) -> Optional[StoryJob]:
+        now = utcnow()
+        owned = (StoryJob.job_id == job_id) & (StoryJob.session_id == session_id)
+
+        cancelled = (await db.execute(
+            update(StoryJob)
+            .where(owned, IS_ACTIVE, StoryJob.status == "pending")
+            .values(status="cancelled", error=CANCELLED_ERROR, completed_at=now)
+        )).rowcount == 1
+        if not cancelled:
+            await db.execute(
+                update(StoryJob)
+                .where(owned, IS_ACTIVE, StoryJob.status == "processing", StoryJob.cancel_requested_at.is_(None))
+                .values(cancel_requested_at=now)
+            )
+        await db.commit()
+
+        if cancelled:
+            await job_events.notify_async(db, job_event(job_id, "cancelled", error=CANCELLED_ERROR))
+        else:
+            running_jobs.cancel(job_id)
+        return (await db.execute(select(StoryJob).where(owned))).scalar()
+
+    @classmethod
+    def _finish(cls, db: Session, job_id: str, worker_id: str, llm_attempts: Optional[list], **values) -> bool:
+        result = db.execute(
+            update(StoryJob)
+            .where(StoryJob.job_id == job_id, StoryJob.worker_id == worker_id, StoryJob.status == "processing")
+            .values(completed_at=utcnow(), lease_expires_at=None, llm_attempts=llm_attempts, **values)
+        )
+        db.commit()
+
+        if result.rowcount != 1:
+            return False
+        job_events.notify(db, job_event(job_id, **values))
+        return True
@@ -0,0 +1,294 @@
+#llm_call.py
+#Purpose: Calls the LLM with a deadline per attempt, retries and (optionally) a hedged second request, so one
+#slow or failed upstream answer neither pins a worker slot nor fails the whole story job.
+
+# - call_llm(stage, request, parse): sends request() and parses its answer, until one attempt gives a valid result
+#   or LLM_MAX_ATTEMPTS are used up.
+#   - An attempt runs on a helper thread and is given up after LLM_ATTEMPT_TIMEOUT_SECONDS. The OpenAI client has
+#     the same timeout (core/llm_context.py), so the request that was given up ends soon after on its own.
+#   - Timeouts, connection errors, 408/409/429/5xx and answers that don't parse are retried after a jittered
+#     exponential backoff (at least the provider's Retry-After); anything else (bad key, bad request) fails at once.
+#   - LLM_HEDGE_ENABLED: if an attempt is still running after the LLM_HEDGE_PERCENTILE latency of recent successful
+#     attempts of the same stage, an identical second request is sent and the first valid answer wins.
+#     The other request is left to finish on its own and ignored.
+# - retry_llm_call(stage, run_once, can_retry): the same retries for streaming, which runs in the caller's thread
+#   (it writes to the job's DB session) and can only be retried until players have seen part of the story.
+# - record_llm_calls(): collects every attempt made for one job (stage, outcome, milliseconds), for the job row.
+# A job that is cancelled or out of time (core/job_control.py) stops waiting within JOB_CHECK_SECONDS,
+# makes no further attempts and sleeps no longer than it has left.
+
+import contextvars
+import logging
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+import httpx
+
+from core.config import settings
+from core.job_control import JobAborted, check_job, job_sleep
+from core.metrics import llm_attempts_total, llm_hedged_total
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+TRANSIENT_STATUS_CODES = (408, 409, 429)  # and every 5xx
+JOB_CHECK_SECONDS = 0.25  # how often a waiting attempt looks whether its job was cancelled or ran out of time
+
+
+class LLMTimeoutError(TimeoutError):
+    pass
+
+
+# The LLM answered, but not with something the parser accepts.
+class LLMParseError(ValueError):
+    pass
+
+
+# Every attempt failed; the last error is the __cause__.
+class LLMCallError(RuntimeError):
+    pass
+
+
+# The last `size` successful attempt durations per stage, to know what "slower than usual" is.
+class LatencyWindow:
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._samples = {}  # stage -> deque of seconds
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.size)
+            samples.append(seconds)
+
+    # None until min_samples durations were seen for the stage.
+    def percentile(self, stage: str, fraction: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+# One window per process, like settings.
+latency_window = LatencyWindow()
+
+
+# The attempts made for one job, in the order they finished.
+class LLMCallLog:
+
+    def __init__(self):
+        self._attempts = []
+        self._lock = threading.Lock()  # fan-out branches add from their own threads
+
+    def add(self, stage: str, attempt: int, outcome: str, seconds: float, hedge: bool = False):
+        entry = {"stage": stage, "attempt": attempt, "outcome": outcome, "ms": round(seconds * 1000)}
+        if hedge:
+            entry["hedge"] = True
+        with self._lock:
+            self._attempts.append(entry)
+
+    def to_list(self) -> list[dict]:
+        with self._lock:
+            return list(self._attempts)
+
+
+_call_log: contextvars.ContextVar[Optional[LLMCallLog]] = contextvars.ContextVar("llm_call_log", default=None)
+
+
+# with record_llm_calls() as log: ... every LLM attempt made inside the block (and in threads started with a copy
+# of its context) is added to log.
+@contextmanager
+def record_llm_calls() -> Iterator[LLMCallLog]:
+    log = LLMCallLog()
+    token = _call_log.set(log)
+    try:
+        yield log
+    finally:
+        _call_log.reset(token)
+
+
+def _record(stage: str, attempt: int, outcome: str, seconds: float, hedge: bool = False):
+    llm_attempts_total.inc(stage=stage, outcome=outcome)
+    if outcome == "ok":
+        latency_window.add(stage, seconds)
+    log = _call_log.get()
+    if log is not None:
+        log.add(stage, attempt, outcome, seconds, hedge)
+
+
+# "ok" never comes from here: parse_error, timeout, error (worth retrying), fatal or aborted (not).
+def classify(error: BaseException) -> str:
+    if isinstance(error, JobAborted):
+        return "aborted"
+    if isinstance(error, LLMParseError):
+        return "parse_error"
+    if isinstance(error, (TimeoutError, httpx.TimeoutException)):
+        return "timeout"
+    if isinstance(error, (ConnectionError, httpx.TransportError)):
+        return "error"
+
+    status_code = getattr(error, "status_code", None)  # openai.APIStatusError and friends
+    if isinstance(status_code, int):
+        return "error" if status_code in TRANSIENT_STATUS_CODES or status_code >= 500 else "fatal"
+
+    # Only the OpenAI client raises these, and it has been imported whenever it is in use.
+    openai = sys.modules.get("openai")
+    if openai is not None:
+        if isinstance(error, openai.APITimeoutError):
+            return "timeout"
+        if isinstance(error, openai.APIConnectionError):
+            return "error"
+    return "fatal"
+
+
+# How long to wait after the given (1-based) attempt failed: base * 2^(attempt - 1), capped, of which
+# a random half is dropped so jobs that failed together don't retry together.
+def backoff_seconds(attempt: int, error: Optional[BaseException] = None) -> float:
+    delay = min(settings.LLM_BACKOFF_MAX_SECONDS, settings.LLM_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers:
+        try:
+            delay = max(delay, min(float(headers.get("retry-after")), settings.LLM_BACKOFF_MAX_SECONDS))
+        except (TypeError, ValueError):
+            pass  # no Retry-After, or an HTTP date we don't bother with
+    return delay
+
+
+def _with_retries(stage: str, run_once: Callable[[int], T], can_retry: Optional[Callable[[], bool]] = None) -> T:
+    max_attempts = max(settings.LLM_MAX_ATTEMPTS, 1)
+    for attempt in range(1, max_attempts + 1):
+        check_job()
+        try:
+            return run_once(attempt)
+        except Exception as error:
+            outcome = classify(error)
+            if outcome in ("fatal", "aborted") or max_attempts == 1 or (can_retry is not None and not can_retry()):
+                raise
+            if attempt == max_attempts:
+                raise LLMCallError(f"LLM {stage} call failed {attempt} times, last error: {error}") from error
+
+            delay = backoff_seconds(attempt, error)
+            logger.warning("LLM %s attempt %d failed (%s: %s), retrying in %.1fs", stage, attempt, outcome, error, delay)
+            job_sleep(delay)
+
+
+# Helper threads the attempts run on. A request that was given up keeps its thread until the OpenAI client's
+# own timeout ends it, so there is room for twice as many as there are connections.
+_executor = ThreadPoolExecutor(max_workers=settings.LLM_MAX_CONNECTIONS * 2, thread_name_prefix="llm-attempt")
+
+
+def _hedge_delay(stage: str) -> Optional[float]:
+    if not settings.LLM_HEDGE_ENABLED:
+        return None
+    usual = latency_window.percentile(stage, settings.LLM_HEDGE_PERCENTILE, settings.LLM_HEDGE_MIN_SAMPLES)
+    if usual is None:
+        return None
+    return max(usual, settings.LLM_HEDGE_MIN_DELAY_SECONDS)
+
+
+# One attempt: the request (and maybe its hedge) on helper threads, waited for until the deadline.
+def _attempt(stage: str, attempt: int, request: Callable[[], Any], parse: Callable[[Any], T]) -> T:
+
+    # Runs on a helper thread and returns (result, error, seconds) instead of raising,
+    # so the outcome is recorded by the caller (whose context holds the job's call log).
+    def send() -> tuple:
+        start = time.perf_counter()
+        try:
+            raw = request()
+        except Exception as error:
+            return None, error, time.perf_counter() - start
+        try:
+            return parse(raw), None, time.perf_counter() - start
+        except Exception as error:
+            parse_error = LLMParseError(f"Could not parse the LLM answer: {error}")
+            parse_error.__cause__ = error
+            return None, parse_error, time.perf_counter() - start
+
+    timeout = settings.LLM_ATTEMPT_TIMEOUT_SECONDS or None
+    hedge_delay = _hedge_delay(stage)
+    started = time.perf_counter()
+    pending = {_executor.submit(contextvars.copy_context().run, send): (False, started)}  # future -> (is hedge, sent at)
+    hedged = False
+    error = None
+
+    while pending:
+        elapsed = time.perf_counter() - started
+        wake_up = [JOB_CHECK_SECONDS]
+        if timeout:
+            wake_up.append(timeout - elapsed)
+        if hedge_delay is not None and not hedged:
+            wake_up.append(hedge_delay - elapsed)
+        done, _ = wait(pending, timeout=max(min(wake_up), 0), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            hedge, _ = pending.pop(future)
+            result, error, seconds = future.result()
+            if error is None:
+                _record(stage, attempt, "ok", seconds, hedge)
+                for other_hedge, sent_at in pending.values():
+                    _record(stage, attempt, "abandoned", time.perf_counter() - sent_at, other_hedge)
+                if hedged:
+                    llm_hedged_total.inc(stage=stage, winner="hedge" if hedge else "first")
+                return result
+            _record(stage, attempt, classify(error), seconds, hedge)
+
+        try:
+            check_job()
+        except JobAborted:
+            for hedge, sent_at in pending.values():
+                _record(stage, attempt, "aborted", time.perf_counter() - sent_at, hedge)
+            raise
+
+        elapsed = time.perf_counter() - started
+        if pending and timeout and elapsed >= timeout:
+            for hedge, sent_at in pending.values():
+                _record(stage, attempt, "timeout", time.perf_counter() - sent_at, hedge)
+            if hedged:
+                llm_hedged_total.inc(stage=stage, winner="none")
+            raise LLMTimeoutError(f"LLM {stage} request took longer than {timeout:g}s")
+        if pending and hedge_delay is not None and not hedged and elapsed >= hedge_delay:
+            hedged = True
+            pending[_executor.submit(contextvars.copy_context().run, send)] = (True, time.perf_counter())
+
+    if hedged:
+        llm_hedged_total.inc(stage=stage, winner="none")
+    raise error
+
+
+# Sends request() (one LLM call, returning its raw answer) and returns parse(answer), with the deadline,
+# retries and hedging described at the top. stage names the kind of call ("story", "outline", "branch"):
+# hedging compares against recent attempts of the same stage. Raises the error of a call that can't be
+# retried, or LLMCallError once every attempt failed.
+def call_llm(stage: str, request: Callable[[], Any], parse: Callable[[Any], T]) -> T:
+    return _with_retries(stage, lambda attempt: _attempt(stage, attempt, request, parse))
+
+
+# Retries run_once() (which does the whole call itself, in this thread) the same way, as long as can_retry()
+# says it is still safe to start over. No deadline thread and no hedging; the client's timeout applies per chunk.
+# run_once should raise LLMParseError for an answer it can't read, so that gets retried too.
+def retry_llm_call(stage: str, run_once: Callable[[], T], can_retry: Callable[[], bool]) -> T:
+
+    def timed(attempt: int) -> T:
+        start = time.perf_counter()
+        try:
+            result = run_once()
+        except Exception as error:
+            _record(stage, attempt, classify(error), time.perf_counter() - start)
+            raise
+        _record(stage, attempt, "ok", time.perf_counter() - start)
+        return result
+
+    return _with_retries(stage, timed, can_retry)
@@ -0,0 +1,189 @@
+#llm_context.py
+#Purpose: Builds the GPT client, output parser and prompt once per process and shares them across all jobs.
+
+# Creating a ChatOpenAI per story meant a new HTTP connection pool (and TLS handshake) every time,
+# and the parser's format instructions and the prompt template were rebuilt on every job too.
+# get_generator_context() builds them on first use; set_generator_context() swaps them
+# (e.g. for a fake LLM in tests and benchmarks).
+
+import os
+import threading
+from typing import Any, Optional, Type
+
+from pydantic import BaseModel
+
+import httpx
+from dotenv import load_dotenv
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from core.config import settings
+from core.models import StoryLLMResponse, StoryNodeLLM
+from core.prompts import STORY_PROMPT, OUTLINE_PROMPT, BRANCH_PROMPT, STORY_JSON_FORMAT, NODE_JSON_FORMAT
+
+
+# Parser for LLM_OUTPUT_MODE="json": the model answers in JSON mode, so the text is decoded and the
+# (recursive) model validated in one pass by pydantic's own JSON parser, with no intermediate dicts.
+# Same parse()/get_format_instructions() interface as PydanticOutputParser.
+class JsonModelParser:
+
+    def __init__(self, model: Type[BaseModel], format_instructions: str):
+        self.model = model
+        self.format_instructions = format_instructions
+
+    def get_format_instructions(self) -> str:
+        return self.format_instructions
+
+    def parse(self, text: str) -> BaseModel:
+        text = text.strip()
+        if text.startswith("```"):  # models occasionally still wrap the JSON in a code fence
+            text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+        return self.model.model_validate_json(text)
+
+
+class GeneratorContext:
+
+    def __init__(
+            self,
+            llm: Any,
+            story_parser: Any,
+            prompt: ChatPromptTemplate,
+            outline_prompt: ChatPromptTemplate,
+            node_parser: Any,
+            branch_prompt: ChatPromptTemplate
+    ):
+        self.llm = llm  # anything LangChain-like with invoke()/stream()/batch()
+        self.story_parser = story_parser  # turns GPT's text into a StoryLLMResponse (PydanticOutputParser or JsonModelParser)
+        self.prompt = prompt  # fill with prompt.invoke({"theme": ...})
+        self.outline_prompt = outline_prompt  # fan-out step 1, parsed with story_parser
+        self.node_parser = node_parser  # turns GPT's text into a single StoryNodeLLM subtree
+        self.branch_prompt = branch_prompt  # fan-out step 2, see build_branch_prompt
+
+
+# Prepares a chat prompt with my story prompt
+# System message: Your rules (STORY_PROMPT).
+# Human message: The user request, {theme} is filled in per job.
+# .partial(...) replaces {format_instructions} in STORY_PROMPT with JSON format rules from story_parser, once.
+def build_story_prompt(story_parser) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages([
+        (
+            "system",
+            STORY_PROMPT
+        ),
+        (
+            "human",
+            "Create the story with this theme: {theme}"
+        )
+    ]).partial(format_instructions=story_parser.get_format_instructions())
+
+
+# Fan-out outline: same shape as the full story, but only one level below the root.
+def build_outline_prompt(story_parser) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages([
+        (
+            "system",
+            OUTLINE_PROMPT
+        ),
+        (
+            "human",
+            "Create the story outline with this theme: {theme}"
+        )
+    ]).partial(format_instructions=story_parser.get_format_instructions())
+
+
+# Fan-out branch: fill with theme, title, root_content, option_text, branch_content and levels.
+def build_branch_prompt(node_parser) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages([
+        (
+            "system",
+            BRANCH_PROMPT
+        ),
+        (
+            "human",
+            "Theme: {theme}\n"
+            "Story title: {title}\n"
+            "Starting situation: {root_content}\n"
+            "The player chose: {option_text}\n"
+            "The player reached this node: {branch_content}"
+        )
+    ]).partial(format_instructions=node_parser.get_format_instructions())
+
+
+# Returns a ready-to-use GPT model (gpt-4o-mini by default) on a pooled, keep-alive HTTP client.
+# stream_usage=True makes streamed answers report their token counts too (see core/metrics.py).
+# With LLM_OUTPUT_MODE="json" every call asks for OpenAI's JSON mode (response_format json_object).
+# Retries and timeouts are left to core/llm_call.py: the client gives up a request after LLM_ATTEMPT_TIMEOUT_SECONDS
+# and doesn't retry on its own (max_retries=0), otherwise its retries would multiply ours.
+# Supports custom API keys and base URLs from environment variables (for deployment setups like Choreo).
+def build_llm():
+    from langchain_openai import ChatOpenAI  # ChatOpenAI → LangChain wrapper for GPT models.
+
+    # Makes sure your .env file (with API keys etc.) is loaded before calling GPT.
+    load_dotenv()
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_SECONDS
+        )
+    )
+
+    timeout = settings.LLM_ATTEMPT_TIMEOUT_SECONDS or None
+
+    #for production!!!!
+    openai_api_key = os.getenv("CHOREO_OPENAI_CONNECTION_OPENAI_API_KEY")
+    serviceurl = os.getenv("CHOREO_OPENAI_CONNECTION_SERVICEURL")
+
+    if openai_api_key and serviceurl:
+        #pass different openai key and baseurl from choreo
+        llm = ChatOpenAI(model=settings.LLM_MODEL, api_key=openai_api_key, base_url=serviceurl, http_client=http_client,
+                         stream_usage=True, timeout=timeout, max_retries=0)
+    else:
+        llm = ChatOpenAI(model=settings.LLM_MODEL, http_client=http_client, stream_usage=True,
+                         timeout=timeout, max_retries=0) #if run locally on our computer
+
+    if settings.LLM_OUTPUT_MODE == "json":
+        return llm.bind(response_format={"type": "json_object"})
+    return llm
+
+
+# "json": JsonModelParser with the short shape descriptions; "parser": LangChain's PydanticOutputParser,
+# which puts the whole JSON schema into every prompt.
+def build_parsers() -> tuple[Any, Any]:
+    if settings.LLM_OUTPUT_MODE == "json":
+        return JsonModelParser(StoryLLMResponse, STORY_JSON_FORMAT), JsonModelParser(StoryNodeLLM, NODE_JSON_FORMAT)
+    return PydanticOutputParser(pydantic_object=StoryLLMResponse), PydanticOutputParser(pydantic_object=StoryNodeLLM)
+
+
+# Builds a full context; pass llm to use something other than OpenAI (a fake model, another provider).
+def build_generator_context(llm: Any = None) -> GeneratorContext:
+    story_parser, node_parser = build_parsers()
+    return GeneratorContext(
+        llm=llm if llm is not None else build_llm(),
+        story_parser=story_parser,
+        prompt=build_story_prompt(story_parser),
+        outline_prompt=build_outline_prompt(story_parser),
+        node_parser=node_parser,
+        branch_prompt=build_branch_prompt(node_parser)
+    )
+
+
+_context: Optional[GeneratorContext] = None
+_context_lock = threading.Lock()
+
+
+def get_generator_context() -> GeneratorContext:
+    global _context
+    if _context is None:
+        with _context_lock:
+            if _context is None:
+                _context = build_generator_context()
+    return _context
+
+
+# Replaces the shared context (None means "build the real one again on next use").
+def set_generator_context(context: Optional[GeneratorContext]):
+    global _context
+    with _context_lock:
+        _context = context
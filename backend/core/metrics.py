@@ -0,0 +1,268 @@
+#metrics.py
+#Purpose: Counts and times what the backend does, and prints it in the Prometheus text format for /metrics.
+
+# - Histogram: how long something took (per stage, per route), as cumulative buckets + sum + count.
+# - Counter: something that only goes up (LLM tokens).
+# - MetricsRegistry: holds every metric of the process and renders them all at once.
+# Recording is a dict lookup, a bisect and a few additions under a lock, so it is cheap enough for every request.
+# Values live in the process that recorded them: the API serves its own at /metrics, and a standalone
+# worker can serve its own with start_metrics_server (WORKER_METRICS_PORT).
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Optional
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a fast DB write up to a very slow LLM call.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labelnames: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: tuple = ()):
+        super().__init__(name, description, labelnames)
+        self._values = {}  # label values -> total
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    # with histogram.time(stage="llm"): ... observes how long the block took, even if it raised.
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for upper, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(upper) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, description: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, description, labelnames))
+
+    def histogram(self, name: str, description: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, labelnames, buckets))
+
+    def _register(self, metric: _Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Renders values that are read at scrape time instead of recorded (e.g. job counts from the database).
+def render_gauge(name: str, description: str, samples: list[tuple[dict, float]]) -> str:
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# One registry per process, like settings.
+metrics = MetricsRegistry()
+
+generation_stage_seconds = metrics.histogram(
+    "story_generation_stage_seconds",
+    "Time spent in each stage of story generation.",
+    ("mode", "stage")
+)
+job_queue_wait_seconds = metrics.histogram(
+    "story_job_queue_wait_seconds",
+    "Time from job creation until a worker claimed it."
+)
+job_run_seconds = metrics.histogram(
+    "story_job_run_seconds",
+    "Time from claim until the job finished, by outcome.",
+    ("status",)
+)
+sqlite_write_queue_wait_seconds = metrics.histogram(
+    "sqlite_write_queue_wait_seconds",
+    "Time story saves waited for the SQLite writer thread."
+)
+http_request_seconds = metrics.histogram(
+    "http_request_duration_seconds",
+    "API request latency until the response starts, by route template.",
+    ("method", "route", "status")
+)
+llm_tokens_total = metrics.counter(
+    "llm_tokens_total",
+    "Tokens reported by the LLM, by direction.",
+    ("type",)
+)
+
+story_create_rejected_total = metrics.counter(
+    "story_create_rejected_total",
+    "POST /stories/create and /stories/batch requests refused with 429, by reason.",
+    ("reason",)
+)
+story_pool_claims_total = metrics.counter(
+    "story_pool_claims_total",
+    "POST /stories/create requests for a pooled theme, by whether a ready story was left.",
+    ("result",)
+)
+story_tree_pruned_total = metrics.counter(
+    "story_tree_pruned_total",
+    "Parts of LLM story trees cut to fit the STORY_TREE_* limits, by limit.",
+    ("limit",)
+)
+llm_attempts_total = metrics.counter(
+    "llm_attempts_total",
+    "LLM requests by kind and outcome (ok, parse_error, error, timeout, fatal, aborted, abandoned).",
+    ("stage", "outcome")
+)
+llm_hedged_total = metrics.counter(
+    "llm_hedged_total",
+    "Hedged LLM requests sent, by kind and which request's answer was used (first, hedge, none).",
+    ("stage", "winner")
+)
+
+# Adds the token counts of an LLM response (or streamed chunk) if the provider reported them.
+def record_token_usage(message) -> None:
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    if usage.get("input_tokens"):
+        llm_tokens_total.inc(usage["input_tokens"], type="input")
+    if usage.get("output_tokens"):
+        llm_tokens_total.inc(usage["output_tokens"], type="output")
+
+
+# ASGI middleware that times every HTTP request until its response starts (so long-lived SSE streams
+# count their time to first byte, not their whole life). Routes are labelled by their template
+# (/stories/{story_id}), never by the raw path, so ids don't create new series.
+class RequestMetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+
+        async def send_and_time(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                http_request_seconds.observe(
+                    time.perf_counter() - start,
+                    method=scope["method"],
+                    route=getattr(route, "path", "unmatched"),
+                    status=message["status"]
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_and_time)
+
+
+# Serves this process's metrics on their own port (for worker processes that have no API).
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+    if not port:
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes every few seconds would flood the worker log
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
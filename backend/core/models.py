@@ -1,13 +1,14 @@
 #models.py
 #Pydantic data models, defines the shape of our AI story data
 
-from typing import List, Dict, Any, Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field
 
 #each option in the story has text and points to another node
+#nextNode is a real StoryNodeLLM, so parsing validates the whole tree once, all the way down
 class StoryOptionLLM(BaseModel):
     text: str = Field(description= "the text of the option shown to the user")
-    nextNode: dict[str, Any] = Field(description= "the next node content and its options")
+    nextNode: "StoryNodeLLM" = Field(description= "the next node content and its options")
 
 #A node in the story — contains text, ending info, and possible choices
 class StoryNodeLLM(BaseModel):
@@ -19,4 +20,7 @@ class StoryNodeLLM(BaseModel):
 #The full story structure returned by the AI
 class StoryLLMResponse(BaseModel):
     title: str = Field(description="The title of the story")
-    rootNode: StoryNodeLLM = Field(description="The root node of the story")
\ No newline at end of file
+    rootNode: StoryNodeLLM = Field(description="The root node of the story")
+
+#resolves the "StoryNodeLLM" forward reference now that both classes exist
+StoryOptionLLM.model_rebuild()
\ No newline at end of file
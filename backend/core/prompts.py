@@ -28,6 +28,64 @@ STORY_PROMPT = """
                 Don't add any text outside of the JSON structure.
                 """
 
+# Fan-out mode (STORY_GENERATION_MODE="fanout") splits the story into one outline call and one call per branch,
+# so the branches are written at the same time instead of one after another.
+
+#Step 1: title, root node and the first node behind every root option (no deeper options yet).
+OUTLINE_PROMPT = """
+                You are a creative story writer that creates engaging choose-your-own-adventure stories.
+                Plan the opening of a branching story in the JSON format I'll specify.
+
+                The outline should have:
+                1. A compelling title
+                2. A starting situation (root node) with 2-3 options
+                3. For each option, the node it leads to: its content and whether it is an ending
+                   (at most one of them may be an ending)
+
+                Don't write any options for the nodes behind the root options (leave their "options" empty),
+                each of those branches is written separately afterwards.
+
+                Output the outline in this exact JSON structure:
+                {format_instructions}
+
+                Don't add any text outside of the JSON structure.
+                """
+
+#Step 2: one call per root option, writes the whole subtree of that branch.
+BRANCH_PROMPT = """
+                You are a creative story writer that continues one branch of a choose-your-own-adventure story.
+                You get the story so far and the node the player just reached; write everything that follows from it.
+
+                The branch should have:
+                1. The node the player reached (keep its content) with 2-3 options
+                2. Each option leads to another node with its own options
+                3. Some paths should lead to endings (both winning and losing)
+                4. At least one path should lead to a winning ending
+
+                Branch structure requirements:
+                - Each node should have 2-3 options except for ending nodes
+                - The branch should be {levels} levels deep (including the node the player reached)
+                - Add variety in the path lengths (some end earlier, some later)
+
+                Output the branch in this exact JSON structure, with the node the player reached as the top node:
+                {format_instructions}
+
+                Don't simplify or omit any part of the branch structure.
+                Don't add any text outside of the JSON structure.
+                """
+
+# Format instructions for LLM_OUTPUT_MODE="json": the provider's JSON mode guarantees valid JSON,
+# so the prompt only has to describe the shape, in far fewer tokens than the full JSON schema.
+NODE_JSON_SHAPE = """{"content": string, "isEnding": boolean, "isWinningEnding": boolean, "options": [{"text": string, "nextNode": Node}]}"""
+
+STORY_JSON_FORMAT = """A JSON object {"title": string, "rootNode": Node},
+                where Node is """ + NODE_JSON_SHAPE + """
+                and ending nodes have "options": []."""
+
+NODE_JSON_FORMAT = """A JSON object Node,
+                where Node is """ + NODE_JSON_SHAPE + """
+                and ending nodes have "options": []."""
+
 json_structure = """
         {
             "title": "Story Title",
@@ -0,0 +1,122 @@
+#rate_limit.py
+#Purpose: Stops one player (or one address) from queueing story after story, since every story costs an LLM call.
+
+# - Token buckets: each key gets `burst` tokens that refill at `per_minute`; a request takes one token per story
+#   (a POST /stories/batch takes one per theme), and when there aren't enough left the caller learns how many
+#   seconds until there are (for Retry-After).
+# - InMemoryRateLimitBackend: buckets inside this process (fine for one API process).
+# - RedisRateLimitBackend: the same buckets in Redis, so all API processes share them (RATE_LIMIT_REDIS_URL).
+# The cap on running generations is not here: it counts active jobs in the database, see routers/story.py.
+
+import logging
+import math
+import threading
+import time
+from typing import Optional
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryRateLimitBackend:
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, last refill time, tokens per second, burst)
+        self._lock = threading.Lock()
+
+    # Takes `cost` tokens from the key's bucket. Returns 0 if allowed, else the seconds until enough are available.
+    def take(self, key: str, per_minute: float, burst: int, cost: int = 1) -> float:
+        rate = per_minute / 60.0
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated, _, _ = self._buckets.get(key, (burst, now, rate, burst))
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now, rate, burst)
+                retry_after = 0.0
+            else:
+                self._buckets[key] = (tokens, now, rate, burst)
+                retry_after = (cost - tokens) / rate
+
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return retry_after
+
+    # Forgets buckets that have refilled completely, they behave exactly like a new one.
+    # If that is not enough (many new keys at once), the least recently created half goes too,
+    # which only makes those keys start over with a full bucket.
+    def _prune(self, now: float):
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if bucket[0] + (now - bucket[1]) * bucket[2] < bucket[3]
+        }
+        if len(self._buckets) > self.max_keys:
+            keep = list(self._buckets.items())[len(self._buckets) - self.max_keys // 2:]
+            self._buckets = dict(keep)
+
+
+class RedisRateLimitBackend:
+
+    # Refill + take in one atomic step, so concurrent API processes can't both spend the last token.
+    TAKE_SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local cost = tonumber(ARGV[4])
+        local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(now - updated, 0) * rate)
+        local retry_after = 0
+        if tokens >= cost then
+            tokens = tokens - cost
+        else
+            retry_after = (cost - tokens) / rate
+        end
+        redis.call("HSET", KEYS[1], "tokens", tokens, "updated", now)
+        redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(retry_after)
+    """
+
+    def __init__(self, url: str, prefix: str = "rate-limit:"):
+        import redis  # optional dependency, only needed for the shared backend
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self.TAKE_SCRIPT)
+
+    def take(self, key: str, per_minute: float, burst: int, cost: int = 1) -> float:
+        return float(self._take(keys=[self.prefix + key], args=[per_minute / 60.0, burst, time.time(), cost]))
+
+
+class RateLimiter:
+
+    def __init__(self, backend=None):
+        self.backend = backend or InMemoryRateLimitBackend()
+
+    # Returns None if the request (worth `cost` stories) may go ahead, else whole seconds to put in Retry-After.
+    # cost must not exceed burst, or the bucket never holds enough.
+    # If the shared backend is down, requests are let through rather than failing story creation.
+    def check(self, key: str, per_minute: float, burst: int, cost: int = 1) -> Optional[int]:
+        if per_minute <= 0:
+            return None  # this limit is turned off
+        try:
+            retry_after = self.backend.take(key, per_minute, burst, cost)
+        except Exception:
+            logger.warning("Rate limit backend unavailable, allowing request", exc_info=True)
+            return None
+        return math.ceil(retry_after) if retry_after > 0 else None
+
+
+def build_rate_limiter() -> RateLimiter:
+    if settings.RATE_LIMIT_REDIS_URL:
+        return RateLimiter(RedisRateLimitBackend(settings.RATE_LIMIT_REDIS_URL))
+    return RateLimiter()
+
+
+# One limiter per process, like settings.
+rate_limiter = build_rate_limiter()
@@ -0,0 +1,144 @@
+#response_cache.py
+#Purpose: Keeps the finished JSON of stories in memory, because a generated story never changes again.
+
+# - LRUBytesCache: in-process cache of response bytes, capped by total size (least recently used goes first).
+# - RedisBytesCache: optional shared tier so all API processes can reuse each other's work (STORY_CACHE_REDIS_URL).
+# - StoryResponseCache: checks local first, then shared, and keeps a strong ETag next to every body.
+# - cached_json_response: answers with the bytes, or with 304 Not Modified if the client already has them.
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from fastapi import Request, Response
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+class LRUBytesCache:
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> CachedResponse
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CachedResponse):
+        if len(entry.body) > self.max_bytes:
+            return  # would evict everything else and still not fit
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous.body)
+            self._entries[key] = entry
+            self._size += len(entry.body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.body)
+
+
+# Shared tier backed by Redis. Only used when STORY_CACHE_REDIS_URL is set (needs the `redis` package).
+class RedisBytesCache:
+
+    def __init__(self, url: str, prefix: str = "story-response:"):
+        import redis  # optional dependency, only needed for the shared tier
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(self.prefix + key)
+
+    def set(self, key: str, body: bytes):
+        self._client.set(self.prefix + key, body)
+
+
+class StoryResponseCache:
+
+    def __init__(self, max_bytes: int, redis_url: str = ""):
+        self.local = LRUBytesCache(max_bytes)
+        self.shared = RedisBytesCache(redis_url) if redis_url else None
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.local.get(key)
+        if entry is not None or self.shared is None:
+            return entry
+
+        try:
+            body = self.shared.get(key)
+        except Exception:
+            logger.warning("Shared story cache unavailable", exc_info=True)
+            return None
+        if body is None:
+            return None
+
+        entry = CachedResponse(body, make_etag(body))
+        self.local.set(key, entry)
+        return entry
+
+    def set(self, key: str, body: bytes) -> CachedResponse:
+        entry = CachedResponse(body, make_etag(body))
+        self.local.set(key, entry)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, body)
+            except Exception:
+                logger.warning("Shared story cache unavailable", exc_info=True)
+        return entry
+
+
+# Added to the ETag of a compressed body by core/compression.py ("abc" -> "abc-gzip").
+ENCODED_ETAG_SUFFIXES = ('-br"', '-gzip"')
+
+
+def strip_encoding_suffix(etag: str) -> str:
+    for suffix in ENCODED_ETAG_SUFFIXES:
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+# True if the client's If-None-Match already names this ETag (or "*"), in any content coding.
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    # weak comparison is what RFC 9110 asks for with If-None-Match
+    return "*" in candidates or any(strip_encoding_suffix(candidate.removeprefix("W/")) == etag for candidate in candidates)
+
+
+# Sends cached JSON with its ETag; immutable bodies can be kept by browsers and CDNs forever.
+def cached_json_response(request: Request, entry: CachedResponse, immutable: bool = True) -> Response:
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else "no-cache"
+    }
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+story_response_cache = StoryResponseCache(settings.STORY_CACHE_MAX_BYTES, settings.STORY_CACHE_REDIS_URL)
@@ -0,0 +1,54 @@
+#sqlite_writer.py
+#Purpose: On SQLite, story saves of a process are made by one writer thread, one after the other.
+
+# SQLite has one write lock for the whole file. Worker slots committing stories at the same time would otherwise
+# wait for it inside SQLite, which polls with growing sleeps (busy_timeout) and hands the lock to whoever happens
+# to poll next. Sending every save to one thread makes them take turns in order, and the lock is free between
+# saves for the small job-row updates.
+# The caller still waits for its save (it needs the story id), so this changes who writes, not what a job waits for.
+# On Postgres, or with SQLITE_WRITE_QUEUE off, run() simply calls write() in the caller's thread.
+
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.metrics import sqlite_write_queue_wait_seconds
+
+T = TypeVar("T")
+
+
+class SQLiteWriter:
+
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    # Runs write() (which works with db and commits) on the writer thread and returns its result or raises its error.
+    # db is only used by write() while the caller waits, so handing it to another thread is safe.
+    def run(self, db: Session, write: Callable[[], T]) -> T:
+        if not settings.SQLITE_WRITE_QUEUE or db.get_bind().dialect.name != "sqlite":
+            return write()
+
+        queued_at = time.perf_counter()
+
+        def timed_write() -> T:
+            sqlite_write_queue_wait_seconds.observe(time.perf_counter() - queued_at)
+            return write()
+
+        return self._get_executor().submit(contextvars.copy_context().run, timed_write).result()
+
+    # Started on the first save, so processes that never write (or use Postgres) have no extra thread.
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+            return self._executor
+
+
+# One writer per process, like settings.
+sqlite_writer = SQLiteWriter()
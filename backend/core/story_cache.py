@@ -0,0 +1,151 @@
+#story_cache.py
+#Purpose: Avoids paying for the same story twice when many players ask for the same theme.
+
+# - normalize_theme: "  Space   Pirates! " and "space pirates" count as the same theme.
+# - SingleFlight: while a theme is being generated, other jobs for that theme wait for it
+#   instead of starting their own LLM call, and then get their own copy of the result.
+# - ThemeStoryCache: optionally remembers the last story per theme (bounded, LRU, with a TTL)
+#   so later jobs for the theme get a copy right away.
+# Both live in the worker process; separate worker processes each coalesce their own jobs.
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.job_control import JobAborted, check_job
+from models.story import Story
+
+
+def normalize_theme(theme: str) -> str:
+    theme = re.sub(r"\s+", " ", theme or "").strip().lower()
+    return theme.strip(" .,!?;:'\"")
+
+
+# Runs one call per key at a time; callers with the same key that arrive meanwhile share its result.
+class SingleFlight:
+
+    CHECK_SECONDS = 0.25
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    # Returns (result, leader): leader is True for the caller whose fn actually ran.
+    # If fn raises, every waiting caller gets the same exception.
+    # check is called every CHECK_SECONDS while waiting for another caller's result and may raise to stop waiting.
+    def do(self, key: str, fn: Callable[[], Any], check: Optional[Callable[[], None]] = None) -> tuple[Any, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            while not call.done.wait(self.CHECK_SECONDS):
+                if check is not None:
+                    check()
+            if call.error:
+                raise call.error
+            return call.result, False
+
+        try:
+            call.result = fn()
+            return call.result, True
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+# theme -> story id, bounded to max_entries (least recently used goes first), entries expire after ttl_seconds.
+class ThemeStoryCache:
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # theme -> (story_id, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, theme: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(theme)
+            if entry is None:
+                return None
+            story_id, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[theme]
+                return None
+            self._entries.move_to_end(theme)
+            return story_id
+
+    def put(self, theme: str, story_id: int):
+        with self._lock:
+            self._entries[theme] = (story_id, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(theme)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, theme: str):
+        with self._lock:
+            self._entries.pop(theme, None)
+
+
+single_flight = SingleFlight()
+theme_cache = ThemeStoryCache(settings.THEME_CACHE_MAX_ENTRIES, settings.THEME_CACHE_TTL_SECONDS)
+
+
+# What the worker calls instead of StoryGenerator.generate_story directly.
+# Cached or shared stories are cloned, so every session still owns its own copy.
+def get_story_for_theme(
+        db: Session,
+        session_id: str,
+        theme: str,
+        on_playable: Optional[Callable[[int], None]] = None
+) -> Story:
+    from core.story_generator import StoryGenerator  # pulls in LangChain, so only once a story is actually needed
+
+    key = normalize_theme(theme)
+
+    if settings.THEME_CACHE_ENABLED:
+        cached_story_id = theme_cache.get(key)
+        if cached_story_id is not None:
+            try:
+                return StoryGenerator.clone_story(db, cached_story_id, session_id)
+            except ValueError:
+                db.rollback()
+                theme_cache.discard(key)  # the cached story was deleted, generate a new one
+
+    def generate() -> int:
+        return StoryGenerator.generate_story(db, session_id, theme, on_playable).id
+
+    if not settings.THEME_SINGLE_FLIGHT:
+        story_id, leader = generate(), True
+    else:
+        while True:
+            try:
+                story_id, leader = single_flight.do(key, generate, check=check_job)
+                break
+            except JobAborted:
+                check_job()  # raises again if it was this job that got cancelled or timed out
+                # otherwise the job we were waiting for was stopped: generate it ourselves (or wait for the next one)
+
+    if leader:
+        if settings.THEME_CACHE_ENABLED:
+            theme_cache.put(key, story_id)
+        return db.get(Story, story_id)
+
+    return StoryGenerator.clone_story(db, story_id, session_id)
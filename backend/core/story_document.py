@@ -0,0 +1,55 @@
+#story_document.py
+#Purpose: Builds the full-story JSON (the exact /stories/{id}/complete response) once, when the story is written,
+#so reading a story is just returning a stored string.
+
+from datetime import datetime
+from typing import Iterable, Union
+
+from models.story import Story, StoryNode
+from schemas.story import CompleteStoryResponse, CompleteStoryNodeResponse
+
+
+# Turns a story and its nodes (StoryNode rows or the plain dicts used for bulk inserts) into the API response.
+# Raises ValueError if there is no root node.
+def build_story_response(story: Story, nodes: Iterable[Union[StoryNode, dict]]) -> CompleteStoryResponse:
+    node_dict = {}
+    root_id = None
+
+    for node in nodes:
+        node_response = CompleteStoryNodeResponse.model_validate(node)
+        node_dict[node_response.id] = node_response
+        if (node["is_root"] if isinstance(node, dict) else node.is_root):
+            root_id = node_response.id
+
+    if root_id is None:
+        raise ValueError(f"Story {story.id} has no root node")
+
+    return CompleteStoryResponse(
+        id=story.id,
+        title=story.title,
+        session_id=story.session_id,
+        created_at=story.created_at,
+        root_node=node_dict[root_id],
+        all_nodes=node_dict
+    )
+
+
+# Stores the counts shown in the story library (GET /stories) on the story, so listing never counts nodes.
+def set_story_summary(story: Story, nodes: Iterable[Union[StoryNode, dict]]) -> None:
+    story.node_count = story.ending_count = story.winning_ending_count = 0
+    for node in nodes:
+        node = node if isinstance(node, dict) else {"is_ending": node.is_ending, "is_winning_ending": node.is_winning_ending}
+        story.node_count += 1
+        story.ending_count += bool(node["is_ending"])
+        story.winning_ending_count += bool(node["is_winning_ending"])
+
+
+# Same as build_story_response, serialized to the compact JSON stored in Story.document.
+def build_story_document(story: Story, nodes: Iterable[Union[StoryNode, dict]]) -> str:
+    return build_story_response(story, nodes).model_dump_json()
+
+
+# The same document handed to another owner (a warm-pool story given to a player), without touching the nodes.
+def reassign_story_document(document: str, session_id: str, created_at: datetime) -> str:
+    response = CompleteStoryResponse.model_validate_json(document)
+    return response.model_copy(update={"session_id": session_id, "created_at": created_at}).model_dump_json()
@@ -5,136 +5,427 @@
 # - Talking to GPT-4 to generate a complete branching story in JSON form.
 # - Validating that GPT’s output matches your expected structure (StoryLLMResponse).
 # - Saving that structure into your database as Story and StoryNode records.
-# - Doing this recursively so every branch and choice gets stored.
+# - Flattening the tree in memory so every branch and choice gets stored in one batch.
 
-from sqlalchemy.orm import Session  # Needed to talk to your database (via SQLAlchemy ORM).
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
 
-from langchain_openai import ChatOpenAI  # ChatOpenAI → LangChain wrapper for GPT models.
-from langchain_core.prompts import ChatPromptTemplate  # ChatPromptTemplate → Lets you build structured prompts.
-from langchain_core.output_parsers import PydanticOutputParser  # PydanticOutputParser → Ensures GPT’s output matches your Pydantic models.
+from sqlalchemy import insert, update, delete, select, func, text  # Core helpers for bulk inserts, streaming updates and id reservation.
+from sqlalchemy.orm import Session  # Needed to talk to your database (via SQLAlchemy ORM).
 
-from core.prompts import STORY_PROMPT  # STORY_PROMPT: The instructions for GPT.
+from core.config import settings  # STORY_GENERATION_MODE picks between one blocking call, streaming and fan-out.
+from core.llm_context import get_generator_context  # The shared GPT client, output parser and prompt.
+from core.llm_call import call_llm, retry_llm_call, LLMParseError  # Deadlines, retries and hedging around every GPT call.
+from core.job_control import check_job  # Stops here if the job was cancelled or ran past its deadline.
+from core.sqlite_writer import sqlite_writer  # On SQLite, finished stories are written by one thread per process.
+from core.story_stream import StoryStreamBuilder, StoryStreamError  # Incremental JSON reader used by the streaming mode.
+from core.story_document import build_story_document, set_story_summary  # The precomputed /complete JSON and library counts stored with each story.
+from core.story_tree import flatten_story_tree, StoryTreeBudget  # Limits on depth, options, nodes and text size.
+from core.metrics import generation_stage_seconds, record_token_usage  # Per-stage timings and token counts for /metrics.
 from models.story import Story, StoryNode  # Story / StoryNode: Your database models.
 from core.models import StoryLLMResponse, StoryNodeLLM  # StoryLLMResponse / StoryNodeLLM: Your Pydantic models that describe the expected structure of GPT output.
-from dotenv import load_dotenv
-import os
 
-# Makes sure your .env file (with API keys, DB connection, etc.) is loaded before calling GPT.
-load_dotenv()
 
 # This class is essentially a service that handles story creation.
 class StoryGenerator:
 
-    # Returns a ready-to-use GPT model (gpt-4o-mini here instead of gpt-4-turbo).
-    # Supports custom API keys and base URLs from environment variables (for deployment setups like Choreo).
+    # This is the main function you call when you want to make a new story.
+    # on_playable(story_id) is called in streaming mode once the start of the story can already be played.
     @classmethod
-    def _get_llm(cls):  # private method
-        #for production!!!!
-        openai_api_key = os.getenv("CHOREO_OPENAI_CONNECTION_OPENAI_API_KEY")
-        serviceurl = os.getenv("CHOREO_OPENAI_CONNECTION_SERVICEURL")
+    def generate_story(
+            cls,
+            db: Session,
+            session_id: str,
+            theme: str = "fantasy",
+            on_playable: Optional[Callable[[int], None]] = None
+    ) -> Story:
+        if settings.STORY_GENERATION_MODE == "stream":
+            return cls._generate_story_streaming(db, session_id, theme, on_playable)
+        if settings.STORY_GENERATION_MODE == "fanout":
+            return cls._generate_story_fanout(db, session_id, theme)
 
-        if openai_api_key and serviceurl:
-            return ChatOpenAI(model="gpt-4o-mini", api_key=openai_api_key, base_url=serviceurl) #pass different openai key and baseurl from choreo
+        story_structure = cls.write_story(theme)
+        return cls._save_story(db, session_id, story_structure, mode="single")
 
-        return ChatOpenAI(model="gpt-4o-mini") #if run locally on our computer
-
-    # This is the main function you call when you want to make a new story.
+    # Writes a whole story for the theme with one GPT call and returns it parsed, without saving anything.
+    # Used by the single-call mode and by batches (core/worker.py), which save many stories at once.
     @classmethod
-    def generate_story(cls, db: Session, session_id: str, theme: str = "fantasy") -> Story:
-        llm = cls._get_llm()  # get the model
-
-        # Tells LangChain: "Whatever GPT outputs, try to turn it into a StoryLLMResponse object."
+    def write_story(cls, theme: str, mode: str = "single") -> StoryLLMResponse:
+        # The model, parser and prompt are built once per process (core/llm_context.py).
+        # story_parser tells LangChain: "Whatever GPT outputs, try to turn it into a StoryLLMResponse object."
         # If GPT outputs something invalid, this will raise an error.
-        story_parser = PydanticOutputParser(pydantic_object=StoryLLMResponse)
-
-        # Prepares a chat prompt with my story prompt
-        # System message: Your rules (STORY_PROMPT).
-        # Human message: The user request (theme).
-        # .partial(...) replaces {format_instructions} in STORY_PROMPT with JSON format rules from story_parser.
-        prompt = ChatPromptTemplate.from_messages([
-            (
-                "system",
-                STORY_PROMPT
-            ),
-            (
-                "human",
-                f"Create the story with this theme: {theme}"
+        context = get_generator_context()
+
+        # prompt.invoke(...) → builds the final prompt text with the theme filled in.
+        # llm.invoke(...) → sends it to GPT and gets a response, which is parsed into a StoryLLMResponse.
+        # call_llm retries a call that times out, fails upstream or comes back in the wrong shape,
+        # so "llm" covers every attempt (and their parsing).
+        prompt_value = context.prompt.invoke({"theme": theme})
+        with generation_stage_seconds.time(mode=mode, stage="llm"):
+            return call_llm(
+                "story",
+                lambda: cls._invoke_llm(context.llm, prompt_value),
+                lambda raw_response: cls._parse_response(context.story_parser, raw_response, mode=mode)
             )
-        ]).partial(format_instructions=story_parser.get_format_instructions())
 
-        # prompt.invoke({}) → builds the final prompt text.
-        # llm.invoke(...) → sends it to GPT and gets a response.
-        raw_response = llm.invoke(prompt.invoke({}))
+    # Writes a fully parsed story (title + node tree) and commits it.
+    @classmethod
+    def _save_story(cls, db: Session, session_id: str, story_structure: StoryLLMResponse, mode: str) -> Story:
+        check_job()  # a cancelled or timed-out job writes nothing
 
-        # Some LLM wrappers return an object; here, we grab just the .content text if available.
-        response_text = raw_response
-        if hasattr(raw_response, "content"):
-            response_text = raw_response.content
+        # The parser already validated the whole tree (StoryNodeLLM is recursive); here it is checked
+        # against the STORY_TREE_* limits and flattened before any database work.
+        with generation_stage_seconds.time(mode=mode, stage="flatten"):
+            flat_nodes = flatten_story_tree(story_structure.rootNode)
 
-        # Converts GPT’s JSON string into a real Python object (StoryLLMResponse).
-        # This step will fail if GPT’s JSON is missing fields or formatted wrong.
-        story_structure = story_parser.parse(response_text)
+        return sqlite_writer.run(db, lambda: cls._insert_story(db, session_id, story_structure.title, flat_nodes, mode))
 
+    # The database part of _save_story.
+    @classmethod
+    def _insert_story(cls, db: Session, session_id: str, title: str, flat_nodes: list[dict], mode: str) -> Story:
         # Adds a new row in your stories table.
         # flush() writes to DB and populates story_db.id.
-        story_db = Story(title=story_structure.title, session_id=session_id)
+        story_db = Story(title=title, session_id=session_id)
         db.add(story_db)
         db.flush()
 
-        # Ensures root node is a proper StoryNodeLLM object.
-        root_node_data = story_structure.rootNode
-        if isinstance(root_node_data, dict):
-            root_node_data = StoryNodeLLM.model_validate(root_node_data)
-
-        # calls _process_story_node to recursively save nodes and options
-        cls._process_story_node(db, story_db.id, root_node_data, is_root=True)
+        # saves every node and its options in one batch,
+        # then stores the ready-to-send JSON of the whole story on the story row
+        with generation_stage_seconds.time(mode=mode, stage="persist"):
+            node_rows = cls._persist_story_nodes(db, story_db.id, flat_nodes)
+        with generation_stage_seconds.time(mode=mode, stage="document"):
+            story_db.document = build_story_document(story_db, node_rows)
+            set_story_summary(story_db, node_rows)
 
         # commit transaction
-        db.commit()
+        with generation_stage_seconds.time(mode=mode, stage="commit"):
+            db.commit()
         return story_db
 
-    # This is where the recursive magic happens
-    @classmethod
-    def _process_story_node(cls, db: Session, story_id: int, node_data: StoryNodeLLM, is_root: bool = False) -> StoryNode:
-        # Create a DB row for the node
-        node = StoryNode(
-            story_id=story_id,
-            content=node_data.content if hasattr(node_data, "content") else node_data["content"],
-            is_root=is_root,
-            is_ending=node_data.isEnding if hasattr(node_data, "isEnding") else node_data["isEnding"],
-            is_winning_ending=node_data.isWinningEnding if hasattr(node_data, "isWinningEnding") else node_data["isWinningEnding"],
-            options=[]
+    # Saves several flattened stories, given as (session_id, title, flat_nodes), in one transaction:
+    # one multi-row INSERT for the stories, one node id reservation and one multi-row INSERT for all their nodes,
+    # instead of a round-trip set per story. Returns the stories in the same order.
+    @classmethod
+    def save_stories(cls, db: Session, items: list[tuple[str, str, list[dict]]], mode: str = "batch") -> list[Story]:
+        return sqlite_writer.run(db, lambda: cls._insert_stories(db, items, mode))
+
+    @classmethod
+    def _insert_stories(cls, db: Session, items: list[tuple[str, str, list[dict]]], mode: str) -> list[Story]:
+        stories = [Story(title=title, session_id=session_id) for session_id, title, _ in items]
+        db.add_all(stories)
+        db.flush()  # one INSERT ... RETURNING for all of them fills in the ids
+
+        with generation_stage_seconds.time(mode=mode, stage="persist"):
+            node_ids = cls._reserve_node_ids(db, sum(len(flat_nodes) for _, _, flat_nodes in items))
+            rows_by_story = []
+            offset = 0
+            for story_db, (_, _, flat_nodes) in zip(stories, items):
+                rows_by_story.append(cls._node_rows(story_db.id, flat_nodes, node_ids[offset:offset + len(flat_nodes)]))
+                offset += len(flat_nodes)
+            db.execute(insert(StoryNode), [row for rows in rows_by_story for row in rows])
+
+        with generation_stage_seconds.time(mode=mode, stage="document"):
+            for story_db, node_rows in zip(stories, rows_by_story):
+                story_db.document = build_story_document(story_db, node_rows)
+                set_story_summary(story_db, node_rows)
+
+        with generation_stage_seconds.time(mode=mode, stage="commit"):
+            db.commit()
+        return stories
+
+    # One request to GPT (the "request" of call_llm).
+    @classmethod
+    def _invoke_llm(cls, llm: Any, prompt_value: Any) -> Any:
+        raw_response = llm.invoke(prompt_value)
+        record_token_usage(raw_response)
+        return raw_response
+
+    # Converts GPT’s JSON string into a real Python object (the "parse" of call_llm).
+    # This step will fail if GPT’s JSON is missing fields or formatted wrong.
+    @classmethod
+    def _parse_response(cls, parser: Any, raw_response: Any, mode: str) -> Any:
+        with generation_stage_seconds.time(mode=mode, stage="parse"):
+            return parser.parse(cls._response_text(raw_response))
+
+    # Some LLM wrappers return an object; here, we grab just the .content text if available.
+    @classmethod
+    def _response_text(cls, raw_response) -> str:
+        if hasattr(raw_response, "content"):
+            return raw_response.content
+        return raw_response
+
+    # Fan-out mode: one short call writes the title, the root node and the node behind every root option,
+    # then every non-ending branch is written by its own call, FANOUT_MAX_CONCURRENCY at a time.
+    # Waiting time is roughly outline + the slowest branch instead of the whole tree in one long answer,
+    # so branches can go deeper (FANOUT_BRANCH_LEVELS) without players waiting longer.
+    # The branches are merged back into the outline, which is then saved like a single-call story.
+    @classmethod
+    def _generate_story_fanout(cls, db: Session, session_id: str, theme: str) -> Story:
+        context = get_generator_context()
+
+        outline_prompt = context.outline_prompt.invoke({"theme": theme})
+        with generation_stage_seconds.time(mode="fanout", stage="llm_outline"):
+            outline = call_llm(
+                "outline",
+                lambda: cls._invoke_llm(context.llm, outline_prompt),
+                lambda raw_outline: cls._parse_response(context.story_parser, raw_outline, mode="fanout")
+            )
+        root_node_data = outline.rootNode
+
+        # (option, the node it leads to) for every branch that still needs writing
+        branches = []
+        if not root_node_data.isEnding:
+            for option_data in root_node_data.options or []:
+                branch_node = option_data.nextNode
+                if not branch_node.isEnding:
+                    branches.append((option_data, branch_node))
+
+        branch_prompts = [
+            context.branch_prompt.invoke({
+                "theme": theme,
+                "title": outline.title,
+                "root_content": root_node_data.content,
+                "option_text": option_data.text,
+                "branch_content": branch_node.content,
+                "levels": settings.FANOUT_BRANCH_LEVELS
+            })
+            for option_data, branch_node in branches
+        ]
+        # Every branch is its own call_llm (with its own retries) on a small thread pool; each thread gets a copy
+        # of this context so its attempts land in the job's call log. A branch that still fails fails the whole
+        # story, and branches that haven't started yet are dropped.
+        def write_branch(branch_prompt):
+            return call_llm(
+                "branch",
+                lambda: cls._invoke_llm(context.llm, branch_prompt),
+                lambda raw_branch: cls._parse_response(context.node_parser, raw_branch, mode="fanout")
+            )
+
+        with generation_stage_seconds.time(mode="fanout", stage="llm_branches"):
+            pool = ThreadPoolExecutor(max_workers=settings.FANOUT_MAX_CONCURRENCY, thread_name_prefix="story-branch")
+            try:
+                futures = [
+                    pool.submit(contextvars.copy_context().run, write_branch, branch_prompt)
+                    for branch_prompt in branch_prompts
+                ]
+                subtrees = [future.result() for future in futures]
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        for (option_data, branch_node), subtree in zip(branches, subtrees):
+            # The outline decided what this node says; the branch only adds what comes after it.
+            subtree.content = branch_node.content
+            subtree.isEnding = False
+            subtree.isWinningEnding = False
+            option_data.nextNode = subtree
+
+        return cls._save_story(db, session_id, outline, mode="fanout")
+
+    # Streaming mode: reads GPT's answer token by token and saves each node as soon as it is known,
+    # instead of waiting for the whole JSON tree.
+    # - A node row is inserted when its content/isEnding/isWinningEnding are known (before its children).
+    # - An option is added to its parent (and committed) once its text and its child node exist.
+    # - The story is playable once the root node has its first option linked; the remaining
+    #   first-level options are added to the root as the model gets to them (JSON comes depth-first).
+    # The story is marked is_complete only after the full JSON was received; if anything fails,
+    # the partial story is deleted again.
+    # A failed stream is started over (retry_llm_call) only while nothing was playable yet: after that,
+    # players may already be reading the story that was just deleted.
+    @classmethod
+    def _generate_story_streaming(
+            cls,
+            db: Session,
+            session_id: str,
+            theme: str,
+            on_playable: Optional[Callable[[int], None]] = None
+    ) -> Story:
+        # "first_playable" is how long players wait before they can start, failed attempts included.
+        progress = {"playable": False, "started": time.perf_counter()}
+        return retry_llm_call(
+            "stream",
+            lambda: cls._stream_story(db, session_id, theme, on_playable, progress),
+            can_retry=lambda: not progress["playable"]
         )
 
-        db.add(node)
+    # One streaming attempt (see _generate_story_streaming).
+    @classmethod
+    def _stream_story(
+            cls,
+            db: Session,
+            session_id: str,
+            theme: str,
+            on_playable: Optional[Callable[[int], None]],
+            progress: dict
+    ) -> Story:
+        context = get_generator_context()
+
+        story_db = Story(title="", session_id=session_id, is_complete=False)
+        db.add(story_db)
         db.flush()
-        # Adds this node to DB.
-        # Now node.id exists after flush().
+        story_id = story_db.id
+        node_rows = []  # everything written so far, to build the story document at the end
+
+        def on_title(title: str):
+            db.execute(update(Story).where(Story.id == story_id).values(title=title))
 
-        # If it’s not an ending, process its options
-        # Loops through each choice in this node.
-        # Validates that the nextNode is a StoryNodeLLM.
-        # Calls _process_story_node again for each child node (recursion).
-        # Links each option text to the child node’s DB id.
-        if not node.is_ending and (hasattr(node_data, "options") and node_data.options):
-            options_list = []
-            for option_data in node_data.options:
-                next_node = option_data.nextNode
+        def on_node(node_data: StoryNodeLLM, depth: int) -> dict:
+            node = StoryNode(
+                story_id=story_id,
+                content=node_data.content,
+                is_root=depth == 0,
+                is_ending=node_data.isEnding,
+                is_winning_ending=node_data.isWinningEnding,
+                options=[]
+            )
+            db.add(node)
+            db.flush()
+            node_rows.append({
+                "id": node.id,
+                "is_root": depth == 0,
+                "content": node_data.content,
+                "is_ending": node_data.isEnding,
+                "is_winning_ending": node_data.isWinningEnding,
+                "options": []
+            })
+            return node_rows[-1]
+
+        def on_option(parent: dict, option_text: str, child: dict, parent_depth: int):
+            parent["options"].append({"text": option_text, "node_id": child["id"]})
+            db.execute(update(StoryNode).where(StoryNode.id == parent["id"]).values(options=list(parent["options"])))
+            db.commit()  # players can follow this option from now on
+
+            if parent_depth == 0 and not progress["playable"]:
+                progress["playable"] = True
+                generation_stage_seconds.observe(time.perf_counter() - progress["started"], mode="stream", stage="first_playable")
+                if on_playable:
+                    on_playable(story_id)
+
+        builder = StoryStreamBuilder(on_title=on_title, on_node=on_node, on_option=on_option, budget=StoryTreeBudget())
 
-                if isinstance(next_node, dict):
-                    next_node = StoryNodeLLM.model_validate(next_node)
+        # "stream" covers the whole answer, including the node writes done while it arrives.
+        try:
+            with generation_stage_seconds.time(mode="stream", stage="stream"):
+                for chunk in context.llm.stream(context.prompt.invoke({"theme": theme})):
+                    check_job()  # leaving the loop closes the stream, so a cancelled job stops the LLM too
+                    record_token_usage(chunk)
+                    builder.feed((chunk.content if hasattr(chunk, "content") else chunk) or "")
+                    if builder.exhausted:
+                        break  # STORY_TREE_MAX_NODES reached, closing the stream stops the LLM from writing more
+                builder.close()
+            check_job()  # last chance before the story is marked complete
+        except Exception as error:
+            db.rollback()
+            cls._discard_story(db, story_id)
+            if isinstance(error, StoryStreamError):  # broken JSON is retried like any answer that doesn't parse
+                raise LLMParseError(f"Could not parse the streamed story: {error}") from error
+            raise
 
-                child_node = cls._process_story_node(db, story_id, next_node, False)
+        story_db = db.get(Story, story_id)
+        with generation_stage_seconds.time(mode="stream", stage="document"):
+            story_db.document = build_story_document(story_db, node_rows)
+            set_story_summary(story_db, node_rows)
+        story_db.is_complete = True
+        with generation_stage_seconds.time(mode="stream", stage="commit"):
+            db.commit()
+        return story_db
+
+    # Removes a half-written story (its nodes first, because of the foreign key).
+    @classmethod
+    def _discard_story(cls, db: Session, story_id: int):
+        db.execute(delete(StoryNode).where(StoryNode.story_id == story_id))
+        db.execute(delete(Story).where(Story.id == story_id))
+        db.commit()
 
-                options_list.append({
-                    "text": option_data.text,
-                    "node_id": child_node.id
-                })
+    # Copies an existing story (and all its nodes) into another session, e.g. to serve a
+    # story that was just generated for the same theme. Node ids are remapped in one batch.
+    @classmethod
+    def clone_story(cls, db: Session, source_story_id: int, session_id: str) -> Story:
+        return sqlite_writer.run(db, lambda: cls._copy_story(db, source_story_id, session_id))
 
-            node.options = options_list
+    @classmethod
+    def _copy_story(cls, db: Session, source_story_id: int, session_id: str) -> Story:
+        source = db.get(Story, source_story_id)
+        if source is None:
+            raise ValueError(f"Story {source_story_id} not found")
+        source_nodes = db.execute(
+            select(StoryNode).where(StoryNode.story_id == source_story_id).order_by(StoryNode.id)
+        ).scalars().all()
 
+        story_db = Story(title=source.title, session_id=session_id)
+        db.add(story_db)
         db.flush()
-        return node  # return this node
+
+        new_ids = dict(zip((node.id for node in source_nodes), cls._reserve_node_ids(db, len(source_nodes))))
+        node_rows = [
+            {
+                "id": new_ids[node.id],
+                "story_id": story_db.id,
+                "content": node.content,
+                "is_root": node.is_root,
+                "is_ending": node.is_ending,
+                "is_winning_ending": node.is_winning_ending,
+                "options": [
+                    {"text": option["text"], "node_id": new_ids.get(option.get("node_id"))}
+                    for option in (node.options or [])
+                ]
+            }
+            for node in source_nodes
+        ]
+        db.execute(insert(StoryNode), node_rows)
+        story_db.document = build_story_document(story_db, node_rows)
+        set_story_summary(story_db, node_rows)
+
+        db.commit()
+        return story_db
+
+    # Saves the whole flattened tree (flatten_story_tree) with one id reservation and one multi-row INSERT,
+    # instead of an add() + flush() round-trip per node.
+    # Returns the inserted rows as dicts (root first).
+    @classmethod
+    def _persist_story_nodes(cls, db: Session, story_id: int, flat_nodes: list[dict]) -> list[dict]:
+        rows = cls._node_rows(story_id, flat_nodes, cls._reserve_node_ids(db, len(flat_nodes)))
+
+        # A list of dicts makes SQLAlchemy batch these into multi-row INSERT statements.
+        db.execute(insert(StoryNode), rows)
+        return rows
+
+    # The story_nodes rows of a flattened tree, given one reserved id per node.
+    # Every child already has its id, so options can be filled in before the INSERT.
+    @classmethod
+    def _node_rows(cls, story_id: int, flat_nodes: list[dict], node_ids: list[int]) -> list[dict]:
+        rows = []
+        for index, flat_node in enumerate(flat_nodes):
+            node_data = flat_node["node"]
+            rows.append({
+                "id": node_ids[index],
+                "story_id": story_id,
+                "content": node_data.content,
+                "is_root": flat_node["is_root"],
+                "is_ending": node_data.isEnding,
+                "is_winning_ending": node_data.isWinningEnding,
+                "options": [
+                    {"text": option_text, "node_id": node_ids[child_index]}
+                    for option_text, child_index in flat_node["options"]
+                ]
+            })
+        return rows
+
+    # Hands out `count` node ids up front so options can reference children before they are written.
+    # Postgres: pulls a range from the table's id sequence in a single query.
+    # SQLite: the story INSERT already holds the write lock, so max(id) + 1 onwards is ours.
+    @classmethod
+    def _reserve_node_ids(cls, db: Session, count: int) -> list[int]:
+        if db.get_bind().dialect.name == "postgresql":
+            result = db.execute(
+                text("SELECT nextval(pg_get_serial_sequence('story_nodes', 'id')) FROM generate_series(1, :count)"),
+                {"count": count}
+            )
+            return list(result.scalars())
+
+        start = db.execute(select(func.coalesce(func.max(StoryNode.id), 0))).scalar_one() + 1
+        return list(range(start, start + count))
 
 ## Root Node
 # ├─ Option 1 → Node A
@@ -142,5 +433,5 @@ class StoryGenerator:
 # │    └─ Option 1b → Ending Node
 # └─ Option 2 → Node B
 #      └─ ...
-# _process_story_node starts at the root and keeps calling itself
-# for each branch until all leaves (endings) are stored.
+# flatten_story_tree (core/story_tree.py) lays this out as [Root, A, B, A1, Ending, ...] and
+# _persist_story_nodes writes the whole list in one go.
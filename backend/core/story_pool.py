@@ -0,0 +1,192 @@
+#story_pool.py
+#Purpose: Keeps a few finished stories ready for popular themes, so those players start playing at once
+#instead of waiting for the LLM.
+
+# - Pooled stories are normal stories (nodes, document) owned by POOL_SESSION_ID with pool_theme set.
+# - claim_pooled_story: POST /stories/create takes one, gives it to the player's session and clears pool_theme,
+#   in one UPDATE that two requests can never both win.
+# - StoryPoolFiller: a background thread (started with the story worker) that tops every theme up again,
+#   at most STORY_POOL_REFILL_CONCURRENCY generations at a time. They all run under one JobControl, so stop()
+#   cancels them at their next check_job() like a cancelled player job.
+# Each worker process runs its own filler; with several of them a pool can briefly hold a few extra stories.
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from core.job_control import JobAborted, JobControl, current_job
+from core.job_queue import utcnow
+from core.story_cache import normalize_theme
+from core.story_document import reassign_story_document
+from db.database import SessionLocal
+from models.story import Story
+
+logger = logging.getLogger(__name__)
+
+POOL_SESSION_ID = "story-pool"  # owner of stories that nobody has claimed yet
+GENERIC_POOL_KEY = "*"  # pool_theme of the "any theme" stories
+
+
+def _split(value: str) -> list[str]:
+    return [normalize_theme(item) for item in value.split(",") if normalize_theme(item)]
+
+
+# pool key -> (theme the stories are generated with, how many to keep ready)
+def pool_targets() -> dict[str, tuple[str, int]]:
+    targets = {theme: (theme, settings.STORY_POOL_SIZE_PER_THEME) for theme in _split(settings.STORY_POOL_THEMES)}
+    if settings.STORY_POOL_GENERIC_SIZE > 0:
+        targets[GENERIC_POOL_KEY] = (settings.STORY_POOL_GENERIC_THEME, settings.STORY_POOL_GENERIC_SIZE)
+    return targets
+
+
+# Which pool a requested theme is served from, or None if it has none.
+def pool_key_for(theme: str) -> Optional[str]:
+    key = normalize_theme(theme)
+    if key in _split(settings.STORY_POOL_THEMES):
+        return key
+    if settings.STORY_POOL_GENERIC_SIZE > 0 and key in _split(settings.STORY_POOL_GENERIC_ALIASES):
+        return GENERIC_POOL_KEY
+    return None
+
+
+# Moves one ready story of the theme's pool to session_id and returns its id (None if the pool is empty).
+# Doesn't commit, so the caller can save the finished job in the same transaction.
+async def claim_pooled_story(db: AsyncSession, theme: str, session_id: str) -> Optional[int]:
+    key = pool_key_for(theme)
+    if key is None:
+        return None
+
+    # Postgres: concurrent claims skip each other's locked row. SQLite: the statement runs as a whole
+    # under the write lock, and pool_theme = key is re-checked either way.
+    next_story = (
+        select(Story.id)
+        .where(Story.pool_theme == key)
+        .order_by(Story.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    now = utcnow()
+    claimed = (await db.execute(
+        update(Story)
+        .where(Story.id == next_story, Story.pool_theme == key)
+        .values(session_id=session_id, pool_theme=None, created_at=now)
+        .returning(Story.id, Story.document)
+    )).first()
+    if claimed is None:
+        return None
+
+    # the stored JSON names the owner and creation time, so it has to follow the story
+    if claimed.document:
+        await db.execute(
+            update(Story)
+            .where(Story.id == claimed.id)
+            .values(document=reassign_story_document(claimed.document, session_id, now))
+        )
+
+    story_pool_filler.wake()
+    return claimed.id
+
+
+class StoryPoolFiller:
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._control = None
+        self._in_flight = {}  # pool key -> generations running for it
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread or not settings.STORY_POOL_ENABLED:
+            return
+        self._stop.clear()
+        self._control = JobControl("story-pool")
+        self._executor = ThreadPoolExecutor(settings.STORY_POOL_REFILL_CONCURRENCY, thread_name_prefix="story-pool")
+        self._thread = threading.Thread(target=self._run, name="story-pool-filler", daemon=True)
+        self._thread.start()
+
+    # Drops queued generations and cancels running ones, which stop at their next check_job() (an LLM call in
+    # flight is not interrupted). Waits at most `timeout` seconds for the filler thread, like StoryWorker.stop,
+    # and not at all for the generations.
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wake.set()
+        if self._control:
+            self._control.cancel()
+            self._control = None
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    # Asks for a check right away (after a claim) instead of at the next STORY_POOL_CHECK_SECONDS.
+    # Only reaches a filler in the same process; others notice on their next check.
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refill()
+            except Exception:
+                logger.exception("Story pool refill failed")
+            self._wake.wait(settings.STORY_POOL_CHECK_SECONDS)
+            self._wake.clear()
+
+    # Starts one generation for every story missing from a pool (minus the ones already on their way).
+    def refill(self):
+        db = SessionLocal()
+        try:
+            ready = dict(db.execute(
+                select(Story.pool_theme, func.count())
+                .where(Story.pool_theme.isnot(None))
+                .group_by(Story.pool_theme)
+            ).all())
+        finally:
+            db.close()
+
+        for key, (theme, size) in pool_targets().items():
+            with self._lock:
+                missing = size - ready.get(key, 0) - self._in_flight.get(key, 0)
+                if missing <= 0:
+                    continue
+                self._in_flight[key] = self._in_flight.get(key, 0) + missing
+            for _ in range(missing):
+                self._executor.submit(self._generate, key, theme, self._control)
+
+    def _generate(self, key: str, theme: str, control: JobControl):
+        from core.story_generator import StoryGenerator  # pulls in LangChain, see get_story_for_theme
+
+        db = SessionLocal()
+        try:
+            if self._stop.is_set():
+                return
+            # only a finished story joins the pool (in streaming mode generate_story returns once it is complete)
+            with current_job(control):
+                story = StoryGenerator.generate_story(db, POOL_SESSION_ID, theme)
+            db.execute(update(Story).where(Story.id == story.id).values(pool_theme=key))
+            db.commit()
+        except JobAborted:
+            db.rollback()
+            logger.info("Pooled story for %r stopped: the filler is shutting down", key)
+        except Exception:
+            db.rollback()
+            logger.exception("Could not generate a pooled story for %r", key)
+        finally:
+            db.close()
+            with self._lock:
+                self._in_flight[key] -= 1
+
+
+# One filler per process, like settings.
+story_pool_filler = StoryPoolFiller()
@@ -0,0 +1,248 @@
+#story_stream.py
+#Purpose: Reads the story JSON while GPT is still writing it, so nodes can be saved as soon as they are known.
+
+# Two layers:
+# - JsonEventParser: an incremental JSON tokenizer. Feed it text chunks, get back events like
+#   ("start_map",), ("map_key", "content"), ("value", "Once upon a time"), ("end_map",).
+# - StoryStreamBuilder: follows those events through the StoryLLMResponse shape
+#   ({"title": ..., "rootNode": {"content", "isEnding", "isWinningEnding", "options": [{"text", "nextNode"}]}})
+#   and calls back when the title is known, when a node is ready, and when an option can be linked to its child.
+#   Nodes go through a StoryTreeBudget (core/story_tree.py) as they arrive: options and levels over the limits
+#   are skipped without a callback, so they are never written.
+
+import json
+from typing import Any, Callable, Optional
+
+from core.models import StoryNodeLLM
+from core.story_tree import StoryTreeBudget
+
+_WHITESPACE = " \t\r\n"
+_VALUE_END = _WHITESPACE + ",]}"
+
+
+class StoryStreamError(ValueError):
+    pass
+
+
+class JsonEventParser:
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._stack = []  # "map" / "array" for each open container
+        self._expect_key = False  # inside a map, waiting for a key (not a value)
+        self._started = False  # seen the opening "{" of the document
+        self.done = False  # the top-level object has been closed
+
+    # Adds a chunk of text and returns every event that is now complete.
+    # Text before the first "{" (like ```json fences) and after the last "}" is ignored.
+    def feed(self, chunk: str) -> list[tuple]:
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        events = []
+
+        while self._pos < len(self._buffer) and not self.done:
+            char = self._buffer[self._pos]
+
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._open("map", events)
+                self._pos += 1
+                continue
+
+            if char in _WHITESPACE or char == ":":
+                self._pos += 1
+            elif char == ",":
+                self._expect_key = self._stack[-1] == "map"
+                self._pos += 1
+            elif char == "{":
+                self._open("map", events)
+                self._pos += 1
+            elif char == "[":
+                self._open("array", events)
+                self._pos += 1
+            elif char in "}]":
+                self._close("map" if char == "}" else "array", events)
+                self._pos += 1
+            elif char == '"':
+                end = self._find_string_end(self._pos)
+                if end is None:
+                    break  # string not finished yet, wait for more text
+                text = json.loads(self._buffer[self._pos:end + 1])
+                if self._expect_key:
+                    events.append(("map_key", text))
+                    self._expect_key = False
+                else:
+                    events.append(("value", text))
+                self._pos = end + 1
+            else:
+                end = self._pos
+                while end < len(self._buffer) and self._buffer[end] not in _VALUE_END:
+                    end += 1
+                if end == len(self._buffer):
+                    break  # the number / literal may continue in the next chunk
+                try:
+                    value = json.loads(self._buffer[self._pos:end])
+                except json.JSONDecodeError:
+                    raise StoryStreamError(f"Invalid JSON value: {self._buffer[self._pos:end]!r}")
+                events.append(("value", value))
+                self._pos = end
+
+        return events
+
+    def _open(self, kind: str, events: list):
+        self._stack.append(kind)
+        self._expect_key = kind == "map"
+        events.append((f"start_{kind}",))
+
+    def _close(self, kind: str, events: list):
+        if not self._stack or self._stack[-1] != kind:
+            raise StoryStreamError(f"Unexpected closing bracket for {kind}")
+        self._stack.pop()
+        self._expect_key = False
+        events.append((f"end_{kind}",))
+        if not self._stack:
+            self.done = True
+
+    # Index of the closing quote of the string starting at `start`, or None if it hasn't arrived yet.
+    def _find_string_end(self, start: int) -> Optional[int]:
+        index = start + 1
+        while index < len(self._buffer):
+            char = self._buffer[index]
+            if char == "\\":
+                index += 2
+            elif char == '"':
+                return index
+            else:
+                index += 1
+        return None
+
+
+# Bookkeeping for one open JSON object/array while walking the story.
+class _Frame:
+    def __init__(self, kind: str, parent: "_Frame" = None, depth: int = 0):
+        self.kind = kind  # "root", "node", "options", "option" or "skip"
+        self.parent = parent
+        self.depth = depth  # node level, root node is 0
+        self.key = None  # last key seen inside this object
+        self.fields = {}  # node: content/isEnding/isWinningEnding, option: text
+        self.child = None  # option: the node frame of its nextNode
+        self.ready = False  # node: on_node has been called
+        self.ending = False  # node: is an ending once the budget has seen it
+        self.count = 0  # options: how many options were kept
+        self.linked = False  # option: on_option has been called
+        self.ref = None  # node: whatever on_node returned (e.g. the database row)
+
+
+class StoryStreamBuilder:
+
+    # on_title(title)
+    # on_node(node: StoryNodeLLM without options, depth: int) -> ref, called before any of the node's children
+    # on_option(parent_ref, text, child_ref, depth_of_parent), called once the option text and its child node are known
+    # budget: the tree limits for this story (from the settings if not given)
+    def __init__(
+            self,
+            on_title: Callable[[str], None],
+            on_node: Callable[[StoryNodeLLM, int], Any],
+            on_option: Callable[[Any, str, Any, int], None],
+            budget: Optional[StoryTreeBudget] = None
+    ):
+        self.on_title = on_title
+        self.on_node = on_node
+        self.on_option = on_option
+        self.budget = budget or StoryTreeBudget()
+
+        self._parser = JsonEventParser()
+        self._stack = []
+        self.root_ref = None
+
+    def feed(self, chunk: str):
+        for event in self._parser.feed(chunk):
+            self._handle(event)
+
+    # True once the node limit is reached: the rest of the answer would only be skipped,
+    # so the caller can stop reading it (and stop paying for it).
+    @property
+    def exhausted(self) -> bool:
+        return self.budget.exhausted
+
+    # Call after the last chunk (or once exhausted); fails if GPT stopped before the JSON was complete.
+    def close(self):
+        if not self._parser.done and not self.exhausted:
+            raise StoryStreamError("Story JSON ended before it was complete")
+        if self.root_ref is None:
+            raise StoryStreamError("Story JSON has no rootNode")
+        self.budget.finish()
+
+    def _handle(self, event: tuple):
+        kind = event[0]
+        top = self._stack[-1] if self._stack else None
+
+        if kind == "map_key":
+            top.key = event[1]
+
+        elif kind == "value":
+            if top.kind == "root" and top.key == "title":
+                self.on_title(event[1])
+            elif top.kind in ("node", "option"):
+                top.fields[top.key] = event[1]
+                if top.kind == "option":
+                    self._try_link(top)
+
+        elif kind == "start_map":
+            if top is None:
+                frame = _Frame("root")
+            elif top.kind == "root" and top.key == "rootNode":
+                frame = _Frame("node", top)
+            elif top.kind == "options":
+                # options over the per-node or per-story limit are skipped with everything below them
+                if self.budget.allow_option(top.count):
+                    top.count += 1
+                    frame = _Frame("option", top)
+                else:
+                    frame = _Frame("skip", top)
+            elif top.kind == "option" and top.key == "nextNode":
+                frame = _Frame("node", top, depth=top.parent.parent.depth + 1)
+                top.child = frame
+            else:
+                frame = _Frame("skip", top)
+            self._stack.append(frame)
+
+        elif kind == "start_array":
+            if top.kind == "node" and top.key == "options":
+                self._make_ready(top)
+                # Ending nodes never show options, so their children are ignored like before.
+                self._stack.append(_Frame("skip" if top.ending else "options", top, top.depth))
+            else:
+                self._stack.append(_Frame("skip", top))
+
+        elif kind in ("end_map", "end_array"):
+            frame = self._stack.pop()
+            if frame.kind == "node":
+                self._make_ready(frame)
+            elif frame.kind == "option":
+                self._try_link(frame)
+
+    def _make_ready(self, frame: _Frame):
+        if frame.ready:
+            return
+        # Same validation and limits as the non-streaming path, just without the options.
+        node = StoryNodeLLM.model_validate({**frame.fields, "options": None})
+        node = self.budget.node(node, frame.depth, has_options=True)
+        frame.ending = node.isEnding
+        frame.ready = True
+        frame.ref = self.on_node(node, frame.depth)
+        if frame.parent.kind == "root":
+            self.root_ref = frame.ref
+        else:
+            self._try_link(frame.parent)
+
+    def _try_link(self, option: _Frame):
+        child = option.child
+        text = option.fields.get("text")
+        if option.linked or text is None or child is None or not child.ready:
+            return
+        option.linked = True
+        parent_node = option.parent.parent
+        self.on_option(parent_node.ref, self.budget.text(text), child.ref, parent_node.depth)
@@ -0,0 +1,151 @@
+#story_tree.py
+#Purpose: Keeps the story tree the LLM sends back within fixed limits before anything is saved,
+#so one odd or runaway answer can't write thousands of nodes or hold a worker for long.
+
+# - StoryTreeLimits: levels (root included), options per node, nodes per story and characters per text,
+#   from the STORY_TREE_* settings.
+# - StoryTreeBudget: the checks for one story, node by node. Used by flatten_story_tree (single and fan-out
+#   mode, whole tree in memory) and by StoryStreamBuilder (streaming mode, node by node as they arrive).
+# - flatten_story_tree: walks the tree breadth first with a plain list as the queue (no recursion, so the
+#   depth of the answer never touches Python's stack) and returns the flat list that gets inserted.
+# STORY_TREE_LIMIT_MODE "prune" cuts whatever is over a limit (extra options and levels are dropped, a node
+# that loses all its options becomes a losing ending, long texts are shortened); "reject" fails the job instead.
+
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+from core.config import settings
+from core.metrics import story_tree_pruned_total
+from core.models import StoryNodeLLM, StoryOptionLLM
+
+logger = logging.getLogger(__name__)
+
+
+class StoryTreeError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class StoryTreeLimits:
+    max_depth: int  # levels, root included
+    max_options: int  # options per node
+    max_nodes: int  # nodes per story
+    max_text_chars: int  # per node content and per option text
+    prune: bool  # cut the tree down to the limits instead of rejecting it
+
+    @classmethod
+    def from_settings(cls) -> "StoryTreeLimits":
+        return cls(
+            max_depth=settings.STORY_TREE_MAX_DEPTH,
+            max_options=settings.STORY_TREE_MAX_OPTIONS,
+            max_nodes=settings.STORY_TREE_MAX_NODES,
+            max_text_chars=settings.STORY_TREE_MAX_TEXT_CHARS,
+            prune=settings.STORY_TREE_LIMIT_MODE != "reject"
+        )
+
+
+class StoryTreeBudget:
+
+    def __init__(self, limits: Optional[StoryTreeLimits] = None):
+        self.limits = limits or StoryTreeLimits.from_settings()
+        self.nodes = 0  # nodes kept so far
+        self.pruned = {}  # limit -> how often something was cut for it
+
+    # Counts a node that is kept and returns it within the limits: content shortened, and turned into
+    # an ending if it has children but sits on the last allowed level or no node is left for them.
+    # The returned node has no options; its children go through options() and node() themselves.
+    # has_options: whether children follow (the streaming builder can't know yet and assumes they do).
+    def node(self, node: StoryNodeLLM, depth: int, has_options: Optional[bool] = None) -> StoryNodeLLM:
+        if self.nodes >= self.limits.max_nodes:
+            self._over("nodes", f"more than {self.limits.max_nodes} nodes")
+        self.nodes += 1
+
+        update = {"options": None}
+        if len(node.content) > self.limits.max_text_chars:
+            self._over("text", f"a node with {len(node.content)} characters")
+            update["content"] = node.content[:self.limits.max_text_chars]
+        if has_options is None:
+            has_options = bool(node.options)
+        if not node.isEnding and has_options:
+            if depth + 1 >= self.limits.max_depth:
+                self._over("depth", f"more than {self.limits.max_depth} levels")
+                update.update(isEnding=True, isWinningEnding=False)
+            elif self.nodes >= self.limits.max_nodes:
+                self._over("nodes", f"more than {self.limits.max_nodes} nodes")
+                update.update(isEnding=True, isWinningEnding=False)
+        return node.model_copy(update=update)
+
+    # The options of a non-ending node that fit: at most max_options, and no more than nodes are left.
+    def options(self, options: List[StoryOptionLLM]) -> List[StoryOptionLLM]:
+        if len(options) > self.limits.max_options:
+            self._over("options", f"a node with {len(options)} options")
+            options = options[:self.limits.max_options]
+        remaining = self.limits.max_nodes - self.nodes
+        if len(options) > remaining:
+            self._over("nodes", f"more than {self.limits.max_nodes} nodes")
+            options = options[:max(remaining, 0)]
+        return options
+
+    # Whether one more option may be added to a node that already has `count` (streaming, one at a time).
+    def allow_option(self, count: int) -> bool:
+        if count >= self.limits.max_options:
+            self._over("options", f"a node with more than {self.limits.max_options} options")
+            return False
+        if self.nodes >= self.limits.max_nodes:
+            self._over("nodes", f"more than {self.limits.max_nodes} nodes")
+            return False
+        return True
+
+    # No further node can be kept, whatever else the LLM sends.
+    @property
+    def exhausted(self) -> bool:
+        return self.nodes >= self.limits.max_nodes
+
+    def text(self, value: str) -> str:
+        if len(value) > self.limits.max_text_chars:
+            self._over("text", f"an option with {len(value)} characters")
+            return value[:self.limits.max_text_chars]
+        return value
+
+    # Called once the whole tree went through the budget.
+    def finish(self):
+        if self.pruned:
+            logger.warning("Story tree cut down to the limits: %s", self.pruned)
+
+    def _over(self, limit: str, what: str):
+        if not self.limits.prune:
+            raise StoryTreeError(f"Story tree over the {limit} limit: {what}")
+        self.pruned[limit] = self.pruned.get(limit, 0) + 1
+        story_tree_pruned_total.inc(limit=limit)
+
+
+# Walks the LLM tree (root first, level by level) within the limits and turns it into a flat list.
+# Each entry holds the node (without options), whether it is the root, and (option text, child index)
+# pairs pointing at other entries of the same list. Raises StoryTreeError in "reject" mode.
+def flatten_story_tree(root_node_data: StoryNodeLLM, limits: Optional[StoryTreeLimits] = None) -> list[dict]:
+    budget = StoryTreeBudget(limits)
+    flat_nodes = [{"node": budget.node(root_node_data, 0), "source": root_node_data, "depth": 0,
+                   "is_root": True, "options": []}]
+    position = 0
+
+    while position < len(flat_nodes):
+        flat_node = flat_nodes[position]
+        node_data = flat_node["node"]
+
+        # Ending nodes never show options, same as before.
+        if not node_data.isEnding and flat_node["source"].options:
+            for option_data in budget.options(flat_node["source"].options):
+                flat_node["options"].append((budget.text(option_data.text), len(flat_nodes)))
+                flat_nodes.append({"node": budget.node(option_data.nextNode, flat_node["depth"] + 1),
+                                   "source": option_data.nextNode, "depth": flat_node["depth"] + 1,
+                                   "is_root": False, "options": []})
+            if not flat_node["options"]:
+                # every option was cut (siblings used up the node limit), so this is where the story ends
+                flat_node["node"] = node_data.model_copy(update={"isEnding": True, "isWinningEnding": False})
+        flat_node.pop("source")  # callers only need the node as it was kept
+
+        position += 1
+
+    budget.finish()
+    return flat_nodes
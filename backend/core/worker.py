@@ -0,0 +1,281 @@
+#worker.py
+#Purpose: Runs story generation jobs from the story_jobs queue, outside of the web request threads.
+
+# A StoryWorker has:
+# - WORKER_CONCURRENCY "slot" threads, each claiming one job at a time and calling the LLM for it
+#   (or up to STORY_BATCH_CLAIM_SIZE jobs of one POST /stories/batch, which are written and saved together).
+# - one housekeeping thread that renews the lease on running jobs (and stops the ones their players cancelled),
+#   re-queues jobs left behind by dead workers, and every JOB_MAINTENANCE_SECONDS fails stuck jobs and removes
+#   old finished ones.
+# - with STORY_POOL_ENABLED, the warm-pool filler (core/story_pool.py).
+# It can run inside the API process (RUN_EMBEDDED_WORKER) or on its own with `python worker.py`,
+# on as many hosts as needed, since claiming goes through the database.
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+
+from core.config import settings
+from core.job_control import JobAborted, JobControl, control_job, current_job, check_job, running_jobs
+from core.job_queue import JobQueue, utcnow
+from core.llm_call import record_llm_calls
+from core.metrics import job_queue_wait_seconds, job_run_seconds
+from core.story_cache import get_story_for_theme
+from core.story_pool import story_pool_filler
+from core.story_tree import flatten_story_tree
+from db.database import SessionLocal
+from models.job import StoryJob
+
+logger = logging.getLogger(__name__)
+
+
+# Runs one claimed job: generates (or reuses) the story and records the outcome on the job row.
+# Always uses its own DB session, like the old background task did.
+# The job stops itself (core/job_control.py) if its player cancels it or JOB_DEADLINE_SECONDS after it was created,
+# which may be before it starts when it waited in the queue that long.
+def run_story_job(job: StoryJob, worker_id: str) -> None:
+    db = SessionLocal()
+    started = time.perf_counter()
+    status = "failed"
+    control = job_control_for(job)
+
+    try:
+        # every LLM attempt for this job is stored with its outcome
+        with control_job(control), record_llm_calls() as llm_calls:
+            try:
+                check_job()
+                story = get_story_for_theme(
+                    db,
+                    job.session_id,
+                    job.theme,
+                    on_playable=lambda story_id: JobQueue.mark_playable(db, job.job_id, worker_id, story_id)
+                )
+                status = finish_story_job(db, job, worker_id, llm_calls.to_list(), story_id=story.id)
+            except Exception as e:
+                status = finish_story_job(db, job, worker_id, llm_calls.to_list(), error=e)
+    finally:  # close database instance
+        db.close()
+        job_run_seconds.observe(time.perf_counter() - started, status=status)
+
+
+# Runs jobs of one batch that a slot claimed together (POST /stories/batch).
+# Every theme gets its own single-call GPT request, STORY_BATCH_MAX_CONCURRENCY at a time, each with its own
+# retries, deadline and cancel flag; then all stories that came back are saved in one transaction
+# (StoryGenerator.save_stories) and every job gets its own outcome.
+# Batch themes skip the theme cache and single-flight: each of them is meant to become a new story.
+def run_story_batch(jobs: list[StoryJob], worker_id: str) -> None:
+    from core.story_generator import StoryGenerator  # pulls in LangChain, so only once a story is actually needed
+
+    started = time.perf_counter()
+    controls = [job_control_for(job) for job in jobs]
+
+    # Runs on a pool thread; returns (title, flat_nodes, llm_attempts, error) instead of raising.
+    def write(control: JobControl, job: StoryJob) -> tuple:
+        with current_job(control), record_llm_calls() as llm_calls:
+            try:
+                check_job()
+                story_structure = StoryGenerator.write_story(job.theme, mode="batch")
+                return story_structure.title, flatten_story_tree(story_structure.rootNode), llm_calls.to_list(), None
+            except Exception as e:
+                return None, None, llm_calls.to_list(), e
+
+    # Listed for the whole batch, so a cancel still reaches a job that waits for the others to be saved.
+    for control in controls:
+        running_jobs.add(control)
+    db = SessionLocal()
+    try:
+        with ThreadPoolExecutor(max_workers=max(settings.STORY_BATCH_MAX_CONCURRENCY, 1), thread_name_prefix="story-batch") as pool:
+            results = list(pool.map(write, controls, jobs))
+
+        outcomes = []  # (job, llm_attempts, error) with error None for the stories to save
+        to_save = []  # (session_id, title, flat_nodes) for StoryGenerator.save_stories
+        for control, job, (title, flat_nodes, llm_attempts, error) in zip(controls, jobs, results):
+            if error is None:
+                try:
+                    control.check()  # cancelled or out of time while the other themes were still being written
+                    to_save.append((job.session_id, title, flat_nodes))
+                except JobAborted as e:
+                    error = e
+            outcomes.append((job, llm_attempts, error))
+
+        story_ids = []
+        save_error = None
+        if to_save:
+            try:
+                story_ids = [story.id for story in StoryGenerator.save_stories(db, to_save)]
+            except Exception as e:
+                save_error = e
+
+        story_ids = iter(story_ids)
+        for job, llm_attempts, error in outcomes:
+            if error is None and save_error is not None:
+                error = save_error
+            if error is None:
+                status = finish_story_job(db, job, worker_id, llm_attempts, story_id=next(story_ids))
+            else:
+                status = finish_story_job(db, job, worker_id, llm_attempts, error=error)
+            job_run_seconds.observe(time.perf_counter() - started, status=status)
+    finally:
+        db.close()
+        for control in controls:
+            running_jobs.remove(control)
+
+
+# The JobControl of a claimed job. JOB_DEADLINE_SECONDS counts from when the job was created,
+# so time spent waiting in the queue counts too.
+def job_control_for(job: StoryJob) -> JobControl:
+    deadline = None
+    if job.created_at is not None:
+        created_at = job.created_at if job.created_at.tzinfo else job.created_at.replace(tzinfo=timezone.utc)  # SQLite drops the zone
+        age = max((utcnow() - created_at).total_seconds(), 0.0)
+        job_queue_wait_seconds.observe(age)
+        if settings.JOB_DEADLINE_SECONDS > 0:
+            deadline = time.monotonic() + settings.JOB_DEADLINE_SECONDS - age
+    control = JobControl(job.job_id, deadline)
+    if job.cancel_requested_at is not None:
+        control.cancel()
+    return control
+
+
+# Records how a job ended: completed with story_id, or stopped / failed by error. Returns the status.
+def finish_story_job(db, job: StoryJob, worker_id: str, llm_attempts: list, story_id: int = None, error: Exception = None) -> str:
+    if error is None:
+        JobQueue.complete(db, job.job_id, worker_id, story_id=story_id, llm_attempts=llm_attempts)
+        return "completed"
+
+    db.rollback()
+    if isinstance(error, JobAborted):
+        logger.info("Story job %s stopped: %s", job.job_id, error)
+        JobQueue.abort(db, job.job_id, worker_id, status=error.status, error=str(error), llm_attempts=llm_attempts)
+        return error.status
+
+    logger.error("Story job %s failed", job.job_id, exc_info=error)
+    JobQueue.fail(db, job.job_id, worker_id, error=str(error), llm_attempts=llm_attempts)
+    return "failed"
+
+
+class StoryWorker:
+
+    def __init__(self, concurrency: int = None, worker_id: str = None):
+        self.concurrency = concurrency or settings.WORKER_CONCURRENCY
+        # host:pid:random so leases can be traced back to a process
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._stop = threading.Event()
+        self._threads = []
+        self._active_jobs = set()  # job_ids currently being generated by this worker
+        self._active_lock = threading.Lock()
+
+    # Starts the slot threads and the housekeeping thread, then returns.
+    def start(self):
+        for slot in range(self.concurrency):
+            self._spawn(self._slot_loop, f"story-worker-slot-{slot}")
+        self._spawn(self._housekeeping_loop, "story-worker-housekeeping")
+        story_pool_filler.start()
+        logger.info("Story worker %s started with %d slots", self.worker_id, self.concurrency)
+
+    # Asks every thread to finish and waits for them.
+    # A slot that is in the middle of a job finishes it first; if we get killed instead, the lease expires
+    # and another worker picks the job up again.
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        story_pool_filler.stop(timeout)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    # Tells the worker to wind down without waiting (safe to call from a signal handler).
+    def request_stop(self):
+        self._stop.set()
+
+    # Blocks until request_stop() is called from another thread or a signal handler.
+    def run_forever(self):
+        self.start()
+        try:
+            while not self._stop.wait(1.0):
+                pass
+        finally:
+            self.stop()
+
+    def _spawn(self, target, name: str):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    # Each slot handles one job at a time, so the number of slots caps concurrent LLM calls.
+    def _slot_loop(self):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            jobs = []
+            try:
+                job = JobQueue.claim_next(db, self.worker_id)
+                if job:
+                    db.expunge(job)  # keep using its attributes after this session closes
+                    jobs.append(job)
+                    if job.batch_id and settings.STORY_BATCH_CLAIM_SIZE > 1:
+                        for other in JobQueue.claim_batch(db, self.worker_id, job.batch_id, settings.STORY_BATCH_CLAIM_SIZE - 1):
+                            db.expunge(other)
+                            jobs.append(other)
+            except Exception:
+                logger.exception("Could not claim a story job")
+            finally:
+                db.close()
+
+            if not jobs:
+                self._stop.wait(settings.WORKER_POLL_SECONDS)
+                continue
+
+            job_ids = [job.job_id for job in jobs]
+            with self._active_lock:
+                self._active_jobs.update(job_ids)
+            try:
+                if len(jobs) == 1:
+                    run_story_job(jobs[0], self.worker_id)
+                else:
+                    run_story_batch(jobs, self.worker_id)
+            finally:
+                with self._active_lock:
+                    self._active_jobs.difference_update(job_ids)
+
+    # Renews leases for our running jobs and re-queues stale jobs from any worker.
+    def _housekeeping_loop(self):
+        next_maintenance = time.monotonic() + settings.JOB_MAINTENANCE_SECONDS
+        while not self._stop.wait(settings.JOB_HEARTBEAT_SECONDS):
+            with self._active_lock:
+                active_jobs = list(self._active_jobs)
+
+            db = SessionLocal()
+            try:
+                for job_id in active_jobs:
+                    if not JobQueue.heartbeat(db, job_id, self.worker_id):
+                        logger.warning("Worker %s lost the lease on job %s", self.worker_id, job_id)
+                for job_id in JobQueue.cancel_requested(db, active_jobs):
+                    running_jobs.cancel(job_id)  # the slot gives the job up at its next check
+
+                requeued = JobQueue.requeue_stale(db)
+                if requeued:
+                    logger.info("Re-queued or failed %d stale story jobs", requeued)
+
+                if time.monotonic() >= next_maintenance:
+                    next_maintenance = time.monotonic() + settings.JOB_MAINTENANCE_SECONDS
+                    self._maintenance(db)
+            except Exception:
+                db.rollback()
+                logger.exception("Story worker housekeeping failed")
+            finally:
+                db.close()
+
+    # Keeps story_jobs small: fails jobs that run far too long and removes old finished ones.
+    def _maintenance(self, db):
+        stuck = JobQueue.fail_stuck(db)
+        if stuck:
+            logger.warning("Failed %d story jobs that ran longer than %ds", stuck, settings.JOB_MAX_RUNTIME_SECONDS)
+
+        purged = JobQueue.purge_finished(db, max_batches=settings.JOB_RETENTION_MAX_BATCHES)
+        if purged:
+            logger.info("Removed %d finished story jobs past retention", purged)
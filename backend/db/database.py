@@ -2,7 +2,7 @@
 
 #create_engine creates a connection “engine” to your database.
 #Think of it as the database’s doorway — all queries will pass through it.
-from sqlalchemy import create_engine #create engine that wraps around databse we are interacting with
+from sqlalchemy import create_engine, event #create engine that wraps around databse we are interacting with
 
 #sessionmaker makes “sessions,” which are temporary connections for interacting with the DB (reading, writing, updating data).
 #Sessions also track changes until you commit them.
@@ -12,20 +12,83 @@ from sqlalchemy.orm import sessionmaker #makes session that we can connect to to
 #This base keeps track of all the models so SQLAlchemy knows what tables to create.
 from sqlalchemy.ext.declarative import declarative_base #base class, databases inherit from
 
+#The async versions of the same pieces, used by the API routes so a request waiting on the
+#database doesn't hold a thread (the story workers keep using the sync engine above).
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
 #This pulls in your environment-based settings (like DATABASE_URL) from core/config.py.
 from core.config import settings
 
+#Connection pool settings shared by both engines (see DB_POOL_* in core/config.py).
+#pool_pre_ping checks a connection is still alive before handing it out, pool_recycle replaces old ones.
+#In-memory SQLite has a single shared connection, so it has no pool to tune.
+def pool_options(url: str) -> dict:
+    if url.startswith("sqlite") and ":memory:" in url:
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+#Same database, async driver: postgresql → asyncpg, sqlite → aiosqlite.
+def async_database_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    if scheme.startswith("postgresql"):
+        return f"postgresql+asyncpg://{rest}"
+    if scheme.startswith("sqlite"):
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+#SQLite only: applied to every new connection of both engines (see SQLITE_* in core/config.py).
+#WAL lets the API keep reading while a worker writes, busy_timeout makes a writer wait for the lock instead of
+#failing at once, and the page cache + memory mapping keep hot stories out of read() calls.
+def sqlite_pragmas() -> list[str]:
+    return [
+        f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}",
+        f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}",  # negative means KiB instead of pages
+        f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE_BYTES)}",
+        "PRAGMA temp_store=memory",
+    ]
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
 #Creates the actual DB connection engine.
 engine = create_engine(
-    settings.DATABASE_URL
+    settings.DATABASE_URL,
+    **pool_options(settings.DATABASE_URL)
 )
 
+#Async engine for the API routes.
+async_engine = create_async_engine(
+    async_database_url(settings.DATABASE_URL),
+    **pool_options(settings.DATABASE_URL)
+)
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
 #Pre-configures a session factory bound to your engine.
 #autocommit=False → you must explicitly call .commit() to save changes.
 #autoflush=False → changes are not automatically flushed to the DB until you commit or flush manually.
 #SessionLocal() will give you an independent session object.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+#Async session factory. expire_on_commit=False keeps loaded values usable after commit
+#(an async session can't lazy-load them again when the response is serialized).
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+
 #Every SQLAlchemy model in your app will inherit from this.
 Base = declarative_base()
 
@@ -42,12 +105,21 @@ def get_db():
     finally:
         db.close()
 
-#create all the tables when app starts up
+#Async version of get_db for `async def` routes.
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+#create all the tables
 def create_tables():
+    from db.migrations import add_missing_columns, replace_indexes  # imports the models, which import this module
     Base.metadata.create_all(bind=engine)
-#Scans all models that inherit from Base.
-#Automatically creates missing tables in your database when called.
-#Typically run once during app startup.
+    return add_missing_columns(engine) + replace_indexes(engine)
+#Scans all models that inherit from Base (they have to be imported first).
+#Automatically creates missing tables in your database when called, then adds columns that tables created by
+#an earlier version are missing and swaps indexes whose definition changed (db/migrations.py).
+#Returns what it changed ("column table.column", "index ...").
+#Run once per deploy with `python manage.py migrate`, or on every start with CREATE_TABLES_ON_STARTUP.
 
 
 
@@ -0,0 +1,95 @@
+#migrations.py
+#Purpose: Adds columns that were declared on the models after their table was first created, and swaps indexes
+#whose definition changed. create_all() only creates missing tables, so a database from an earlier version needs
+#these ALTER TABLE ... ADD COLUMN / CREATE INDEX + DROP INDEX statements (run them with `python manage.py migrate`).
+
+# Every entry is (table, column) of a column on the models; its type and server default come from the model.
+# Rows that already exist get the server default (story_jobs.attempts: 0), or NULL for columns without one,
+# which the code reads like their Python default (e.g. stories.is_complete: NULL counts as complete).
+# Running it again is safe: columns a table already has are skipped, and tables that don't exist yet are left
+# to create_all(), which creates them complete. New columns go at the end of ADDED_COLUMNS.
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateColumn
+
+from db.database import Base
+import models.story  # noqa: F401  registers the tables on Base.metadata
+import models.job  # noqa: F401
+
+ADDED_COLUMNS = [
+    # the leased job queue (core/job_queue.py)
+    ("story_jobs", "worker_id"),
+    ("story_jobs", "attempts"),
+    ("story_jobs", "started_at"),
+    ("story_jobs", "heartbeat_at"),
+    ("story_jobs", "lease_expires_at"),
+    # streaming generation (STORY_GENERATION_MODE=stream)
+    ("story_jobs", "playable_at"),
+    ("stories", "is_complete"),
+    # the precomputed /complete JSON (core/story_document.py)
+    ("stories", "document"),
+    # the warm pool (core/story_pool.py)
+    ("stories", "pool_theme"),
+    # story library counts (GET /stories)
+    ("stories", "node_count"),
+    ("stories", "ending_count"),
+    ("stories", "winning_ending_count"),
+    # LLM attempts per job (core/llm_call.py)
+    ("story_jobs", "llm_attempts"),
+    # job cancellation (DELETE /jobs/{job_id})
+    ("story_jobs", "cancel_requested_at"),
+    # batches (POST /stories/batch)
+    ("story_jobs", "batch_id"),
+]
+
+
+# An index that gets a new definition gets a new name too, so nothing mistakes the old one for it
+# (create_indexes' checkfirst only looks at names). Every entry is (table, old name, new name on the models).
+REPLACED_INDEXES = [
+    # cancelled and timed_out joined the finished statuses (job cancellation), the retention sweep's condition
+    ("story_jobs", "ix_story_jobs_finished", "ix_story_jobs_finished_v2"),
+]
+
+
+# Adds every column of ADDED_COLUMNS that an existing table is missing, in one transaction.
+# Returns what was added ("column table.column").
+def add_missing_columns(engine: Engine) -> list[str]:
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    existing_columns = {
+        table_name: {column["name"] for column in inspector.get_columns(table_name)}
+        for table_name in {table_name for table_name, _ in ADDED_COLUMNS} & existing_tables
+    }
+
+    added = []
+    with engine.begin() as connection:
+        for table_name, column_name in ADDED_COLUMNS:
+            if table_name not in existing_columns or column_name in existing_columns[table_name]:
+                continue
+            column = Base.metadata.tables[table_name].c[column_name]
+            column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_ddl}"))
+            existing_columns[table_name].add(column_name)
+            added.append(f"column {table_name}.{column_name}")
+    return added
+
+
+# Creates the new index of every REPLACED_INDEXES entry whose old index still exists, then drops the old one,
+# in one transaction. Returns what was replaced.
+def replace_indexes(engine: Engine) -> list[str]:
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    replaced = []
+    with engine.begin() as connection:
+        for table_name, old_name, new_name in REPLACED_INDEXES:
+            if table_name not in existing_tables:
+                continue
+            if old_name not in {index["name"] for index in inspector.get_indexes(table_name)}:
+                continue
+            index = next(index for index in Base.metadata.tables[table_name].indexes if index.name == new_name)
+            index.create(bind=connection, checkfirst=True)
+            connection.execute(text(f"DROP INDEX {old_name}"))
+            replaced.append(f"index {new_name} (replaces {old_name})")
+    return replaced
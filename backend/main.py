@@ -2,14 +2,39 @@
 # main.py → The entry point of your backend. Starts the 
 # server, sets up routes, config, and connects the pieces.
 
+from contextlib import asynccontextmanager #lets us run code when the app starts and stops
+
 from fastapi import FastAPI #main class for creating FastAPI app
 from fastapi.middleware.cors import CORSMiddleware #Middleware to handle Cross-Origin Resource Sharing (lets your frontend running on a different domain or port talk to your backend).
 
 from core.config import settings #Central place for settings (e.g., environment variables like DB connection URL, allowed origins, API prefix).
-from routers import story, job  #Two separate files that define related API endpoints for different parts of the game.
-from db.database import create_tables #Function that ensures your database tables exist before starting.
+from routers import story, job, metrics  #Files that define related API endpoints for different parts of the game (and /metrics).
+from db.database import create_tables, engine, async_engine #create_tables makes sure all the models have a table in the database
+from core.job_events import job_events #pushes job status changes to /jobs/{job_id}/events listeners
+from core.metrics import RequestMetricsMiddleware #times every request for /metrics
+from core.compression import CompressionMiddleware #gzip/br for big JSON responses
+
+#Nothing here imports LangChain/OpenAI: the story generator is loaded on the first generation
+#(or up front by a dedicated worker.py), so the API starts serving quickly.
+#Tables are created by `python manage.py create-tables` (a deploy step), or here if CREATE_TABLES_ON_STARTUP is on.
 
-create_tables() #Runs before the app is started, makes sure all the models are created in the database
+#Runs a story worker inside the API process unless workers are deployed separately (python worker.py),
+#and listens for job status notifications from other processes (Postgres only).
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.CREATE_TABLES_ON_STARTUP:
+        create_tables()
+    job_events.start(engine)
+    worker = None
+    if settings.RUN_EMBEDDED_WORKER:
+        from core.worker import StoryWorker
+        worker = StoryWorker()
+        worker.start()
+    yield
+    if worker:
+        worker.stop(timeout=5)
+    job_events.stop()
+    await async_engine.dispose() #close pooled async connections cleanly
 
 #creates FastAPI application object w metadata
 app = FastAPI(
@@ -17,7 +42,8 @@ app = FastAPI(
     description="api to generate cool stories", #for API docs
     version="0.1.0", #for API docs
     docs_url="/docs", #where Swagger UI docs are served 
-    redoc_url="/redoc" #where redoc docs are served
+    redoc_url="/redoc", #where redoc docs are served
+    lifespan=lifespan #starts/stops the embedded story worker
 )
 
 #CORS is Cross Origin Resource Sharing, we enable certain 
@@ -40,6 +66,10 @@ app.add_middleware (
     allow_headers=["*"] #Allows any custom HTTP headers. 
 )
 
+#Compresses big responses (whole stories) for browsers that accept gzip/br; the SSE stream is left alone.
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
 #setting up endpoints
 
 #include_router() pulls in the endpoints from story.py and job.py.
@@ -48,6 +78,11 @@ app.include_router(story.router, prefix = settings.API_PREFIX)
 
 app.include_router(job.router, prefix = settings.API_PREFIX)
 
+#Prometheus scrapes /metrics at the root, outside the API prefix, and every request gets timed.
+if settings.METRICS_ENABLED:
+    app.include_router(metrics.router)
+    app.add_middleware(RequestMetricsMiddleware)
+
 ##standard python practice: only execute what's inside this if statement if we directly execute this python file
 # (if we import from this file it won't run, but if we execute this file it will run)
 
@@ -0,0 +1,168 @@
+##manage.py
+# manage.py → One-off maintenance commands for the backend, run from the backend folder:
+#   python manage.py migrate              (create missing tables and add columns newer versions need to existing ones)
+#   python manage.py create-tables        (same as migrate; the API and workers no longer do this on start)
+#   python manage.py backfill-documents   (store the precomputed story JSON on stories created before it existed)
+#   python manage.py backfill-summaries   (store node/ending counts for the story library on stories created before it existed)
+#   python manage.py purge-jobs           (fail stuck jobs and remove finished jobs past JOB_RETENTION_SECONDS now)
+#   python manage.py create-indexes       (add indexes declared on the models to tables that already existed)
+# The backfill and index commands run migrate first, since they need the columns it adds.
+
+import argparse
+
+from sqlalchemy import select, func, case, update, text
+
+from db.database import Base, SessionLocal, engine, create_tables
+from models.story import Story, StoryNode
+from models.job import StoryJob, StoryJobArchive  # registers the job tables for create_indexes
+from core.job_queue import JobQueue
+from core.story_document import build_story_document
+
+
+#Builds Story.document for every finished story that doesn't have one yet, batch_size stories per commit.
+def backfill_documents(batch_size: int) -> None:
+    db = SessionLocal()
+    done = 0
+    skipped = 0
+    last_id = 0
+
+    try:
+        while True:
+            stories = db.execute(
+                select(Story)
+                .where(Story.document.is_(None), Story.is_complete.isnot(False), Story.id > last_id)
+                .order_by(Story.id)
+                .limit(batch_size)
+            ).scalars().all()
+            if not stories:
+                break
+
+            story_ids = [story.id for story in stories]
+            nodes_by_story = {story_id: [] for story_id in story_ids}
+            for node in db.execute(select(StoryNode).where(StoryNode.story_id.in_(story_ids))).scalars():
+                nodes_by_story[node.story_id].append(node)
+
+            for story in stories:
+                try:
+                    story.document = build_story_document(story, nodes_by_story[story.id])
+                    done += 1
+                except ValueError:
+                    skipped += 1  # no root node, nothing sensible to store
+
+            db.commit()
+            last_id = story_ids[-1]
+            print(f"backfilled {done} stories ({skipped} skipped)")
+    finally:
+        db.close()
+
+
+#Stores node_count / ending_count / winning_ending_count on every story that doesn't have them yet,
+#counted with one GROUP BY per batch of stories.
+def backfill_summaries(batch_size: int) -> None:
+    db = SessionLocal()
+    done = 0
+    last_id = 0
+
+    try:
+        # SQLite keeps timestamps as text: rows written by the old server default have no fractional seconds
+        # and would compare wrong against library cursors, so they get the format SQLAlchemy writes.
+        if engine.dialect.name == "sqlite":
+            db.execute(text("UPDATE stories SET created_at = created_at || '.000000' WHERE length(created_at) = 19"))
+            db.commit()
+
+        while True:
+            story_ids = db.execute(
+                select(Story.id)
+                .where(Story.node_count.is_(None), Story.is_complete.isnot(False), Story.id > last_id)
+                .order_by(Story.id)
+                .limit(batch_size)
+            ).scalars().all()
+            if not story_ids:
+                break
+
+            counts = {story_id: (0, 0, 0) for story_id in story_ids}
+            for row in db.execute(
+                select(
+                    StoryNode.story_id,
+                    func.count(),
+                    func.sum(case((StoryNode.is_ending == True, 1), else_=0)),
+                    func.sum(case((StoryNode.is_winning_ending == True, 1), else_=0))
+                )
+                .where(StoryNode.story_id.in_(story_ids))
+                .group_by(StoryNode.story_id)
+            ):
+                counts[row[0]] = tuple(row[1:])
+
+            for story_id, (node_count, ending_count, winning_ending_count) in counts.items():
+                db.execute(
+                    update(Story)
+                    .where(Story.id == story_id)
+                    .values(node_count=node_count, ending_count=ending_count, winning_ending_count=winning_ending_count)
+                )
+                done += 1
+
+            db.commit()
+            last_id = story_ids[-1]
+            print(f"backfilled {done} story summaries")
+    finally:
+        db.close()
+
+
+#Same as the worker's periodic maintenance, but works off the whole backlog at once.
+def purge_jobs(batch_size: int) -> None:
+    db = SessionLocal()
+    try:
+        print(f"failed {JobQueue.fail_stuck(db)} stuck jobs")
+        print(f"removed {JobQueue.purge_finished(db, batch_size=batch_size)} finished jobs")
+    finally:
+        db.close()
+
+
+#Brings a database from an earlier version up to date: missing tables, then missing columns and changed
+#indexes (db/migrations.py).
+def migrate() -> None:
+    changes = create_tables()
+    for change in changes:
+        print(f"added {change}")
+    print(f"ok {len(changes)} changes")
+
+
+#create_tables() only creates missing tables, so indexes added to existing tables later have to be created here.
+def create_indexes() -> None:
+    migrate()  # new tables (e.g. story_jobs_archive) come with their indexes, new columns are needed by some
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+            print(f"ok {index.name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Choose Your Own Adventure backend maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser("backfill-documents", help="precompute the story JSON for existing stories")
+    backfill.add_argument("--batch-size", type=int, default=200)
+
+    summaries = commands.add_parser("backfill-summaries", help="store node and ending counts for existing stories")
+    summaries.add_argument("--batch-size", type=int, default=500)
+
+    purge = commands.add_parser("purge-jobs", help="fail stuck jobs and remove finished jobs past retention")
+    purge.add_argument("--batch-size", type=int, default=1000)
+
+    commands.add_parser("migrate", help="create missing tables, add missing columns, replace changed indexes (run once per deploy)")
+    commands.add_parser("create-tables", help="create missing tables (run once per deploy)")
+    commands.add_parser("create-indexes", help="create missing indexes on existing tables")
+
+    args = parser.parse_args()
+    if args.command == "backfill-documents":
+        migrate()
+        backfill_documents(args.batch_size)
+    elif args.command == "backfill-summaries":
+        migrate()
+        backfill_summaries(args.batch_size)
+    elif args.command == "purge-jobs":
+        purge_jobs(args.batch_size)
+    elif args.command in ("migrate", "create-tables"):
+        migrate()
+    elif args.command == "create-indexes":
+        create_indexes()
@@ -3,11 +3,14 @@
 #This table tracks the intent to generate a story. It’s like a job queue:
 #job is going to represent intent to make a story
 
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Index, text
 from sqlalchemy.sql import func #functions
 
 from db.database import Base
 
+ACTIVE_JOB_STATUSES = ("pending", "processing")  # jobs a worker still has to finish
+FINISHED_JOB_STATUSES = ("completed", "failed", "cancelled", "timed_out")
+
 class StoryJob(Base):
     __tablename__ = "story_jobs"
 
@@ -21,6 +24,78 @@ class StoryJob(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     completed_at = Column(DateTime(timezone=True), nullable=True)
 
+    # Queue bookkeeping, owned by core/job_queue.py
+    worker_id = Column(String, nullable=True)                          # Which worker slot claimed the job
+    attempts = Column(Integer, default=0, server_default="0")          # How many times the job has been claimed
+    started_at = Column(DateTime(timezone=True), nullable=True)        # When the latest claim happened
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)      # Last "still alive" from the worker
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)  # After this, the job is considered abandoned
+    playable_at = Column(DateTime(timezone=True), nullable=True)       # Streaming mode: the story can be played before it is finished
+    cancel_requested_at = Column(DateTime(timezone=True), nullable=True)  # DELETE /jobs/{job_id} while processing; the worker stops at its next check
+
+    batch_id = Column(String, nullable=True)  # Set for jobs created together by POST /stories/batch (StoryBatch.batch_id)
+
+    # Every LLM request made for the latest run: [{"stage", "attempt", "outcome", "ms", "hedge"?}, ...]
+    # (see core/llm_call.py). Empty when the story came from the theme cache or another job's call.
+    llm_attempts = Column(JSON, nullable=True)
+
+    # Partial indexes: only the rows they are for, so they stay small however many finished jobs pile up.
+    # - active: the claim query (pending, oldest first) and sweeps over processing jobs; SQLite only uses it
+    #   when the query repeats its condition word for word, hence the extra `status IN (...)` in core/job_queue.py
+    # - finished: the retention sweep (oldest finished first); "_v2" since cancelled and timed_out joined the
+    #   condition, so databases that have the old index get the new one from `manage.py migrate` (db/migrations.py)
+    __table_args__ = (
+        Index(
+            "ix_story_jobs_active", "status", "created_at", "id",
+            postgresql_where=text(f"status IN {ACTIVE_JOB_STATUSES}"),
+            sqlite_where=text(f"status IN {ACTIVE_JOB_STATUSES}")
+        ),
+        Index(
+            "ix_story_jobs_finished_v2", "completed_at",
+            postgresql_where=text(f"status IN {FINISHED_JOB_STATUSES}"),
+            sqlite_where=text(f"status IN {FINISHED_JOB_STATUSES}")
+        ),
+        # - batch: a batch's jobs for its status endpoint and for claiming them together; rows without a batch stay out
+        Index(
+            "ix_story_jobs_batch", "batch_id", "status",
+            postgresql_where=text("batch_id IS NOT NULL"),
+            sqlite_where=text("batch_id IS NOT NULL")
+        ),
+    )
+
 #You enqueue a job here when someone wants a new story generated.
 #You can track if the job is done and the generated story’s ID.
 #Stores metadata about the job, like creation and completion time.
+#Workers claim pending rows and keep a lease on them; if a worker dies the lease runs out
+#and the job goes back to pending (see core/job_queue.py).
+
+
+#A set of themes submitted together with POST /stories/batch (e.g. stories seeded for an event).
+#Every theme is a normal StoryJob with this batch_id; size is kept here so progress still adds up
+#after finished jobs were removed by the retention sweep.
+class StoryBatch(Base):
+    __tablename__ = "story_batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(String, index=True, unique=True)
+    session_id = Column(String, index=True)
+    size = Column(Integer)  # number of themes (and jobs)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+#Finished jobs moved out of story_jobs by the retention sweep when JOB_ARCHIVE_ENABLED is on
+#(only the outcome is kept, not the queue bookkeeping).
+class StoryJobArchive(Base):
+    __tablename__ = "story_jobs_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # same id as in story_jobs
+    job_id = Column(String, index=True, unique=True)
+    session_id = Column(String, index=True)
+    theme = Column(String)
+    status = Column(String)
+    story_id = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True))
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
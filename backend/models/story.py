@@ -12,9 +12,10 @@
 #sqlalchemy is known as a ORM (Object Relational Mapping), allow us to map data 
 # into pythn code, so we dont write sql code (structured-query language)
 #typically how u interact with the database
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, Index, text
 from sqlalchemy.sql import func #functions
 from sqlalchemy.orm import relationship #make relationship
+from datetime import datetime, timezone
 
 from db.database import Base
 
@@ -26,16 +27,38 @@ from db.database import Base
 
 class Story(Base):
     __tablename__ = "stories"
+    __table_args__ = (
+        # only unclaimed warm-pool stories are in it, so claiming the next one stays a tiny lookup
+        Index(
+            "ix_stories_pool_theme", "pool_theme", "id",
+            postgresql_where=text("pool_theme IS NOT NULL"),
+            sqlite_where=text("pool_theme IS NOT NULL")
+        ),
+        # the story library (GET /stories): one session's stories newest first, paged by (created_at, id)
+        Index("ix_stories_session_created_id", "session_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     session_id = Column(String, index=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # also set in Python, so every row stores the same timestamp format (SQLite keeps it as text) and pages compare correctly
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=func.now())
+    is_complete = Column(Boolean, default=True)  # False while a streamed story is still being written
+    document = Column(Text, nullable=True)  # The full /stories/{id}/complete JSON, built once at generation time
+    pool_theme = Column(String, nullable=True)  # Set while the story waits in the warm pool (core/story_pool.py), cleared when a player gets it
+
+    # Counted once when the story is written, for the story library (None for older stories until backfilled)
+    node_count = Column(Integer, nullable=True)
+    ending_count = Column(Integer, nullable=True)
+    winning_ending_count = Column(Integer, nullable=True)
 
     nodes = relationship("StoryNode", back_populates="story")
 
 class StoryNode(Base):
     __tablename__ = "story_nodes"
+    __table_args__ = (
+        Index("ix_story_nodes_story_id_id", "story_id", "id"),  # node-by-node reads: WHERE story_id = ? AND id IN (...)
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     story_id = Column(Integer, ForeignKey("stories.id"), index=True) # Foreign key linking to Story
@@ -2,14 +2,24 @@
 #This file manages story generation jobs — like tracking status of a story creation request.
 #Creates a router with prefix /jobs and tag "jobs" for documentation grouping.
 
+import asyncio
+import json
+import time
 import uuid 
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, Cookie
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Cookie, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.database import get_db
+from db.database import get_async_db, AsyncSessionLocal, async_engine
 from models.job import StoryJob
 from schemas.job import StoryJobResponse
+from core.job_events import job_events, TERMINAL_STATUSES
+from core.job_queue import JobQueue
+
+KEEP_ALIVE_SECONDS = 15  # comment line sent on idle streams so proxies don't close them
+DB_POLL_SECONDS = 2  # without Postgres, how often an idle stream re-reads its job from the DB
 
 router = APIRouter(
     prefix="/jobs",
@@ -21,10 +31,105 @@ router = APIRouter(
 # Returns 404 if not found.
 # Returns job info serialized with StoryJobResponse schema.
 @router.get("/{job_id}", response_model=StoryJobResponse)
-def get_job_status(job_id: str, db: Session = Depends(get_db)):
-    job = db.query(StoryJob).filter(StoryJob.job_id == job_id).first()
+async def get_job_status(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    job = (await db.execute(select(StoryJob).where(StoryJob.job_id == job_id))).scalar()
 
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return job
 
+#cancelling a job
+# The player no longer wants the story (e.g. navigated away), so its worker slot can go to the next queued job.
+# A pending job is cancelled right away (200). A processing one is stopped by its worker at the next safe point
+# (between LLM attempts and streamed chunks, before saving) and then turns "cancelled" on /events; until then
+# this answers 202 with the job still processing. Jobs that already finished otherwise give 409.
+# Only the session that created the job can cancel it; anyone else gets 404.
+@router.delete("/{job_id}", response_model=StoryJobResponse)
+async def cancel_job(
+        job_id: str,
+        response: Response,
+        session_id: Optional[str] = Cookie(None),
+        db: AsyncSession = Depends(get_async_db)
+):
+    job = await JobQueue.cancel(db, job_id, session_id) if session_id else None
+
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status in ("pending", "processing"):
+        response.status_code = 202
+    elif job.status != "cancelled":
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    return job
+
+#streaming job status (Server-Sent Events)
+# Sends the current status right away, then one event per status change
+# (pending → processing → completed/failed, with story_id), and closes once the job is finished.
+# On Postgres only the first status is read from the DB; after that events come from the hub (core/job_events.py),
+# so waiting clients cost no DB queries. Anywhere else the hub only hears about jobs run by this process, so a
+# worker in another process (manage.py worker, a second uvicorn) would leave the stream hanging: there the job is
+# also re-read every DB_POLL_SECONDS without an event, and the stream closes once it is finished (or removed).
+@router.get("/{job_id}/events")
+async def stream_job_events(job_id: str):
+    # Subscribe before reading the current status so no transition can slip in between.
+    queue = job_events.subscribe(job_id)
+
+    try:
+        current = await load_job_event(job_id)
+    except Exception:
+        job_events.unsubscribe(job_id, queue)
+        raise
+    if current is None:
+        job_events.unsubscribe(job_id, queue)
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    poll_db = async_engine.dialect.name != "postgresql"
+    wait_seconds = DB_POLL_SECONDS if poll_db else KEEP_ALIVE_SECONDS
+
+    async def event_stream():
+        try:
+            event = current
+            yield f"data: {json.dumps(event)}\n\n"
+            last_sent = time.monotonic()
+
+            while event["status"] not in TERMINAL_STATUSES:
+                try:
+                    next_event = await asyncio.wait_for(queue.get(), timeout=wait_seconds)
+                except asyncio.TimeoutError:
+                    next_event = await load_job_event(job_id) if poll_db else event
+                    if next_event is None:
+                        break  # removed by the retention sweep
+                # A polled status can also come from the hub afterwards (or the other way round): send it once.
+                if not event_changed(event, next_event):
+                    if time.monotonic() - last_sent >= KEEP_ALIVE_SECONDS:
+                        yield ": keep-alive\n\n"
+                        last_sent = time.monotonic()
+                    continue
+                event = next_event
+                yield f"data: {json.dumps(event)}\n\n"
+                last_sent = time.monotonic()
+        finally:
+            job_events.unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # no-buffering hint for nginx-style proxies
+    )
+
+#HELPER
+#Whether `new` tells the client something `old` didn't: another status, the story id, or the story becoming playable.
+def event_changed(old: dict, new: dict) -> bool:
+    return (
+        new["status"] != old["status"]
+        or new["story_id"] != old["story_id"]
+        or (new["playable_at"] is None) != (old["playable_at"] is None)
+    )
+
+#HELPER
+#Reads a job once and shapes it like the pushed events (None if the job doesn't exist).
+async def load_job_event(job_id: str) -> Optional[dict]:
+    async with AsyncSessionLocal() as db:
+        job = (await db.execute(select(StoryJob).where(StoryJob.job_id == job_id))).scalar()
+        if not job:
+            return None
+        return StoryJobResponse.model_validate(job).model_dump(mode="json")
@@ -0,0 +1,34 @@
+#metrics.py
+#Serves /metrics for Prometheus: everything recorded in this process (core/metrics.py)
+#plus job counts read from the database, so they are right no matter which process ran the jobs.
+
+from fastapi import APIRouter, Depends, Response
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.database import get_async_db
+from models.job import StoryJob
+from core.metrics import metrics, render_gauge, CONTENT_TYPE
+
+router = APIRouter(
+    tags=["metrics"]
+)
+
+JOB_STATUSES = ("pending", "processing", "completed", "failed", "cancelled", "timed_out")  # always reported, even at 0
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics(db: AsyncSession = Depends(get_async_db)):
+    # one GROUP BY for all statuses
+    rows = (await db.execute(select(StoryJob.status, func.count()).group_by(StoryJob.status))).all()
+    counts = dict.fromkeys(JOB_STATUSES, 0)
+    counts.update({status: count for status, count in rows})
+
+    body = (
+        metrics.render()
+        + render_gauge("story_jobs", "Story jobs in the database, by status.",
+                       [({"status": status}, count) for status, count in counts.items()])
+        + render_gauge("story_queue_depth", "Pending story jobs waiting for a worker.",
+                       [({}, counts["pending"])])
+    )
+    return Response(content=body, media_type=CONTENT_TYPE)
@@ -1,24 +1,35 @@
 #story.py
 #This file handles creating stories and fetching complete stories with all nodes.
 
+import base64
 import uuid
-from typing import Optional
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, Cookie, Response, BackgroundTasks
-from sqlalchemy.orm import Session
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Cookie, Request, Response, Query
+from sqlalchemy import select, func, tuple_, insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.database import get_db, SessionLocal
+from db.database import get_async_db
 from models.story import Story, StoryNode
-from models.job import StoryJob
+from models.job import StoryJob, StoryBatch, ACTIVE_JOB_STATUSES
 from schemas.story import (
-    CompleteStoryResponse, CompleteStoryNodeResponse, CreateStoryRequest
+    CompleteStoryResponse, CreateStoryRequest, StoryOverviewResponse, StoryNodeWindowResponse,
+    StoryListResponse, StorySummaryResponse
+)
+from schemas.job import (
+    StoryJobResponse, StoryBatchCreate, StoryBatchItem, StoryBatchResponse, StoryBatchStatusResponse
 )
-from schemas.job import StoryJobResponse
-from core.story_generator import StoryGenerator
+from core.config import settings
+from core.response_cache import story_response_cache, cached_json_response, CachedResponse, make_etag
+from core.story_document import build_story_response
+from core.rate_limit import rate_limiter
+from core.metrics import story_create_rejected_total, story_pool_claims_total
+from core.story_pool import claim_pooled_story, pool_key_for
+from core.job_queue import utcnow, IS_ACTIVE
 
 #organizing the story specific routes
 # Router for /stories endpoints.
-# Imports models, schemas, and the story generator utility.
+# Imports models and schemas; story generation itself happens in the workers.
 router = APIRouter(
     prefix="/stories",
     tags=["stories"]
@@ -38,30 +49,116 @@ def get_session_id(session_id: Optional[str] = Cookie(None)):
         session_id = str(uuid.uuid4())
     return session_id
 
+#HELPER
+#Address of the player; behind a trusted reverse proxy the real one is the first X-Forwarded-For entry.
+def get_client_ip(request: Request) -> str:
+    if settings.RATE_LIMIT_TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+#HELPER
+#Refuses `stories` new stories with 429 + Retry-After when this session or this address created too many stories
+#in a short time (token buckets, core/rate_limit.py).
+#Batches are charged to buckets of their own (RATE_LIMIT_BATCH_*), so they never touch the players' /create limits.
+async def check_rate_limits(request: Request, session_id: str, stories: int = 1, batch: bool = False):
+    session_limit, ip_limit = rate_limits(batch)
+    kind = "batch_" if batch else ""
+
+    retry_after = rate_limiter.check(f"{kind}session:{session_id}", *session_limit, stories)
+    if retry_after:
+        reject_story(f"{kind}session", retry_after, "Too many stories created from this session")
+
+    retry_after = rate_limiter.check(f"{kind}ip:{get_client_ip(request)}", *ip_limit, stories)
+    if retry_after:
+        reject_story(f"{kind}ip", retry_after, "Too many stories created from this address")
+
+#HELPER
+#(per minute, burst) of the session and the address limit, for /create or for batches.
+def rate_limits(batch: bool) -> tuple[tuple[float, int], tuple[float, int]]:
+    if batch:
+        return (
+            (settings.RATE_LIMIT_BATCH_SESSION_PER_MINUTE, settings.RATE_LIMIT_BATCH_SESSION_BURST),
+            (settings.RATE_LIMIT_BATCH_IP_PER_MINUTE, settings.RATE_LIMIT_BATCH_IP_BURST)
+        )
+    return (
+        (settings.RATE_LIMIT_SESSION_PER_MINUTE, settings.RATE_LIMIT_SESSION_BURST),
+        (settings.RATE_LIMIT_IP_PER_MINUTE, settings.RATE_LIMIT_IP_BURST)
+    )
+
+#HELPER
+#Most themes one batch may have: STORY_BATCH_MAX_THEMES, and no more than the batch rate limits' bursts, since a
+#batch costs one token per theme and a bigger one could never be let through.
+def max_batch_themes() -> int:
+    limit = settings.STORY_BATCH_MAX_THEMES
+    for per_minute, burst in rate_limits(batch=True):
+        if per_minute > 0:
+            limit = min(limit, burst)
+    return limit
+
+#HELPER
+#Refuses new_jobs more stories with 429 + Retry-After when too many are already waiting or being generated
+#(all players together, counted in the DB so every process agrees).
+async def check_active_jobs(db: AsyncSession, new_jobs: int = 1):
+    if settings.MAX_ACTIVE_JOBS > 0:
+        active_jobs = (await db.execute(
+            select(func.count()).select_from(StoryJob).where(IS_ACTIVE)
+        )).scalar_one()
+        if active_jobs + new_jobs > settings.MAX_ACTIVE_JOBS:
+            reject_story("busy", settings.ACTIVE_JOBS_RETRY_AFTER_SECONDS, "Too many stories are being generated right now")
+
+def reject_story(reason: str, retry_after: int, detail: str):
+    story_create_rejected_total.inc(reason=reason)
+    raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+
 #Takes a request with a theme (e.g., "fantasy").
+    # Checks the rate limits (429 if hit).
     # Assigns or reuses a session id cookie.
-    # Creates a new StoryJob with pending status.
-    # Saves the job in DB.
-    # Starts generate_story_task in background (async task) to generate the story without blocking the API response.
+    # With the warm pool on, a ready story for the theme is handed over right away and the job is already completed.
+    # Otherwise checks the cap on running generations (429 if hit) and creates a new StoryJob with pending status.
+    # Saves the job in DB, which puts it on the queue.
+    # A story worker (core/worker.py) claims it and generates the story without blocking the API response.
     # Returns the job info immediately (so frontend can poll job status).
 #CREATE A NEW STORY JOB
 #endpoints
 @router.post("/create", response_model=StoryJobResponse)
 
 #inject these dependencies into these parameters 
-def create_story(
+async def create_story(
         request: CreateStoryRequest,
-        background_tasks: BackgroundTasks,
+        http_request: Request,
         response: Response,
         session_id: str = Depends(get_session_id),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    response.set_cookie(key="session_id", value=session_id, httponly=True)
+    await check_rate_limits(http_request, session_id)
 
-    #call LLM in openai to create a story (JOB)
+    response.set_cookie(key="session_id", value=session_id, httponly=True)
 
     job_id = str(uuid.uuid4())
 
+    #warm pool: no LLM call needed, the job is born finished
+    if settings.STORY_POOL_ENABLED and pool_key_for(request.theme) is not None:
+        story_id = await claim_pooled_story(db, request.theme, session_id)
+        story_pool_claims_total.inc(result="hit" if story_id else "miss")
+        if story_id:
+            job = StoryJob(
+                job_id = job_id,
+                session_id = session_id,
+                theme = request.theme,
+                status = "completed",
+                story_id = story_id,
+                completed_at = utcnow()
+            )
+            db.add(job)
+            await db.commit() #story ownership and the finished job are saved together
+            return job
+
+    await check_active_jobs(db)
+
+    #call LLM in openai to create a story (JOB)
+
     #create a new instance of StoryJob
     job = StoryJob(
         job_id = job_id, 
@@ -71,53 +168,156 @@ def create_story(
     )
 
     db.add(job) #staging it in database, job of orm
-    db.commit() #save into database
+    await db.commit() #save into database, any worker can claim it from here
 
-    background_tasks.add_task(
-        generate_story_task,
-        job_id = job_id,
-        theme = request.theme, 
-        session_id = session_id
+    return job
+
+#CREATE MANY STORY JOBS AT ONCE
+# Takes a list of themes (e.g. stories seeded for an event) and creates one pending job per theme.
+    # Every theme costs one token of the batch rate limits (RATE_LIMIT_BATCH_*, apart from the players' /create
+    # limits) and counts against MAX_ACTIVE_JOBS (429 if the batch doesn't fit; nothing is created then).
+    # A batch can't be larger than STORY_BATCH_MAX_THEMES or the batch bursts (422).
+    # The batch row and all its jobs are written with one multi-row INSERT in one transaction.
+    # Workers claim up to STORY_BATCH_CLAIM_SIZE jobs of a batch together and write them concurrently
+    # (core/worker.py), after any player's own /create jobs.
+    # Returns the batch id to poll with GET /stories/batch/{batch_id} and every job id, in theme order.
+@router.post("/batch", response_model=StoryBatchResponse)
+async def create_story_batch(
+        request: StoryBatchCreate,
+        http_request: Request,
+        response: Response,
+        session_id: str = Depends(get_session_id),
+        db: AsyncSession = Depends(get_async_db)
+):
+    if len(request.themes) > max_batch_themes():
+        raise HTTPException(status_code=422, detail=f"At most {max_batch_themes()} themes per batch")
+
+    await check_rate_limits(http_request, session_id, stories=len(request.themes), batch=True)
+
+    response.set_cookie(key="session_id", value=session_id, httponly=True)
+
+    await check_active_jobs(db, new_jobs=len(request.themes))
+
+    batch_id = str(uuid.uuid4())
+    created_at = utcnow()
+    jobs = [
+        {
+            "job_id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "theme": theme,
+            "status": "pending",
+            "batch_id": batch_id,
+            "created_at": created_at
+        }
+        for theme in request.themes
+    ]
+
+    db.add(StoryBatch(batch_id=batch_id, session_id=session_id, size=len(jobs), created_at=created_at))
+    await db.execute(insert(StoryJob), jobs)
+    await db.commit()
+
+    return StoryBatchResponse(
+        batch_id=batch_id,
+        created_at=created_at,
+        jobs=[StoryBatchItem(job_id=job["job_id"], theme=job["theme"], status="pending") for job in jobs]
     )
 
-    return job
+#BATCH PROGRESS
+# How many jobs of a batch are in each status, counted with one GROUP BY over ix_story_jobs_batch
+# (the batch row is joined in, so an unknown batch is a 404 from the same query).
+# With ?items=true every job comes along too (one more query), e.g. to collect the story ids at the end.
+@router.get("/batch/{batch_id}", response_model=StoryBatchStatusResponse)
+async def get_story_batch(batch_id: str, items: bool = False, db: AsyncSession = Depends(get_async_db)):
+    rows = (await db.execute(
+        select(StoryBatch.created_at, StoryBatch.size, StoryJob.status, func.count(StoryJob.id))
+        .select_from(StoryBatch)
+        .outerjoin(StoryJob, StoryJob.batch_id == StoryBatch.batch_id)
+        .where(StoryBatch.batch_id == batch_id)
+        .group_by(StoryBatch.id, StoryBatch.created_at, StoryBatch.size, StoryJob.status)
+    )).all()
 
-# Opens a fresh DB session (important for background tasks).
-# Updates job status to "processing".
-# Calls StoryGenerator.generate_story() which:
-# Generates the story using GPT.
-# Saves story and nodes to DB.
-# Updates job status to "completed" and saves story id.
-# On error, marks job as "failed" and logs the error.
-# Always closes DB session.
+    if not rows:
+        raise HTTPException(status_code=404, detail="Batch not found")
 
-#BACKGROUND TASK
-def generate_story_task(job_id: str, theme: str, session_id: str):
-    db = SessionLocal()
+    created_at, size = rows[0][0], rows[0][1]
+    counts = {status: count for _, _, status, count in rows if status is not None}
+    removed = size - sum(counts.values())  # finished jobs the retention sweep already deleted
+    if removed > 0:
+        counts["removed"] = removed
+    finished = size - sum(counts.get(status, 0) for status in ACTIVE_JOB_STATUSES)
 
-    try:
-        job = db.query(StoryJob).filter(StoryJob.job_id == job_id).first()
+    jobs = None
+    if items:
+        jobs = [
+            StoryBatchItem.model_validate(job)
+            for job in (await db.execute(
+                select(StoryJob).where(StoryJob.batch_id == batch_id).order_by(StoryJob.id)
+            )).scalars()
+        ]
 
-        if not job:
-            return
+    return StoryBatchStatusResponse(
+        batch_id=batch_id,
+        created_at=created_at,
+        size=size,
+        counts=counts,
+        finished=finished,
+        done=finished == size,
+        jobs=jobs
+    )
 
-        try:
-            job.status = "processing"
-            db.commit()
+#LIST MY STORIES
+# The caller's stories (by session cookie), newest first, `limit` at a time.
+# Keyset pagination: the cursor is the (created_at, id) of the last story on the previous page, and the next
+# page starts right after it, so every page is one range read on ix_stories_session_created_id however many
+# stories a session has (OFFSET would read and throw away every earlier page).
+# Node and ending counts were stored when each story was written; nothing is counted here.
+@router.get("", response_model=StoryListResponse)
+async def list_stories(
+        cursor: Optional[str] = None,
+        limit: int = Query(None, ge=1, le=settings.STORY_LIST_MAX_PAGE_SIZE),
+        session_id: str = Depends(get_session_id),
+        db: AsyncSession = Depends(get_async_db)
+):
+    limit = limit or settings.STORY_LIST_PAGE_SIZE
+    query = (
+        select(
+            Story.id, Story.title, Story.created_at, Story.is_complete,
+            Story.node_count, Story.ending_count, Story.winning_ending_count
+        )
+        .where(Story.session_id == session_id, Story.pool_theme.is_(None))
+        .order_by(Story.created_at.desc(), Story.id.desc())
+        .limit(limit + 1)  # one extra row tells us whether there is a next page
+    )
+    if cursor:
+        query = query.where(tuple_(Story.created_at, Story.id) < tuple_(*decode_story_cursor(cursor)))
 
-            story = StoryGenerator.generate_story(db, session_id, theme)
+    rows = (await db.execute(query)).all()
+    stories = [
+        StorySummaryResponse(
+            id=row.id,
+            title=row.title,
+            created_at=row.created_at,
+            is_complete=row.is_complete is not False,
+            node_count=row.node_count,
+            ending_count=row.ending_count,
+            winning_ending_count=row.winning_ending_count
+        )
+        for row in rows[:limit]
+    ]
+    next_cursor = encode_story_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+    return StoryListResponse(stories=stories, next_cursor=next_cursor)
 
-            job.story_id = story.id  # todo: update story id
-            job.status = "completed"
-            job.completed_at = datetime.now()
-            db.commit()
-        except Exception as e:
-            job.status = "failed"
-            job.completed_at = datetime.now()
-            job.error = str(e)
-            db.commit()
-    finally: #close database instance
-        db.close()
+#HELPER
+#The cursor is opaque to clients: "<created_at>|<id>" in URL-safe base64.
+def encode_story_cursor(created_at: datetime, story_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{story_id}".encode()).decode().rstrip("=")
+
+def decode_story_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, story_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("|")
+        return datetime.fromisoformat(created_at), int(story_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 #GET FULL STORY DATA
 # Retrieves story by id.
@@ -125,47 +325,115 @@ def generate_story_task(job_id: str, theme: str, session_id: str):
 # If not found, returns 404.
 
 # Calls build_complete_story_tree to build the entire story tree response.
+
+# Finished stories never change, so their JSON is cached (core/response_cache.py) and sent with
+# a strong ETag + "immutable"; repeat requests are answered without touching the database,
+# and clients that already have it (If-None-Match) get 304 Not Modified.
 @router.get("/{story_id}/complete", response_model=CompleteStoryResponse)
-def get_complete_story(story_id: int, db: Session = Depends(get_db)):
-    story = db.query(Story).filter(Story.id == story_id).first()
-    if not story:
+async def get_complete_story(story_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    cached = story_response_cache.get(str(story_id))
+    if cached is not None:
+        return cached_json_response(request, cached)
+
+    story = (await db.execute(select(Story).where(Story.id == story_id))).scalar()
+    if not story or story.pool_theme is not None:  # pooled stories belong to nobody until claimed
         raise HTTPException(status_code = 404, detail="Story Not Found")
-    
-    complete_story = build_complete_story_tree(db, story)
-    return complete_story
+
+    # a streamed story that is still being written must not be cached
+    if story.is_complete is False:
+        body = (await build_complete_story_tree(db, story)).model_dump_json().encode()
+        return cached_json_response(request, CachedResponse(body, make_etag(body)), immutable=False)
+
+    # stories generated since the document column exists already carry their JSON;
+    # older ones are built from their nodes (run `python manage.py backfill-documents` once to skip this)
+    if story.document:
+        body = story.document.encode()
+    else:
+        body = (await build_complete_story_tree(db, story)).model_dump_json().encode()
+    return cached_json_response(request, story_response_cache.set(str(story_id), body))
 
 #HELPER
-def build_complete_story_tree(db: Session, story: Story) -> CompleteStoryResponse:
-    nodes = db.query(StoryNode).filter(StoryNode.story_id == story.id).all()
-    
-    node_dict = {}
-    for node in nodes:
-        node_response = CompleteStoryNodeResponse(
-            id=node.id,
-            content=node.content,
-            is_ending=node.is_ending,
-            is_winning_ending=node.is_winning_ending, 
-            options=node.options
-        )
+async def build_complete_story_tree(db: AsyncSession, story: Story) -> CompleteStoryResponse:
+    nodes = (await db.execute(select(StoryNode).where(StoryNode.story_id == story.id))).scalars().all()
 
-        node_dict[node.id] = node_response
-    root_node = next((node for node in nodes if node.is_root), None)
-    if not root_node:
+    try:
+        return build_story_response(story, nodes)
+    except ValueError:
         raise HTTPException(status_code=500, detail="Story root node not found")
-    return CompleteStoryResponse(
+#Queries all nodes belonging to the story.
+
+# Builds a dictionary mapping node IDs to serialized node data.
+
+# Finds the root node (start of the story).
+
+# Returns a complete story response including all nodes and root node.
+
+#GET STORY OVERVIEW
+# Title, owner and where the story starts, so the frontend can fetch nodes one at a time
+# instead of downloading the whole tree.
+@router.get("/{story_id}", response_model=StoryOverviewResponse)
+async def get_story(story_id: int, db: AsyncSession = Depends(get_async_db)):
+    story = (await db.execute(select(Story).where(Story.id == story_id))).scalar()
+    if not story or story.pool_theme is not None:
+        raise HTTPException(status_code=404, detail="Story Not Found")
+
+    root_node_id = (await db.execute(
+        select(StoryNode.id).where(StoryNode.story_id == story_id, StoryNode.is_root == True)
+    )).scalar()
+    return StoryOverviewResponse(
         id=story.id,
         title=story.title,
         session_id=story.session_id,
         created_at=story.created_at,
-        root_node=node_dict[root_node.id],
-        all_nodes=node_dict
+        root_node_id=root_node_id,
+        is_complete=story.is_complete is not False
     )
-#Queries all nodes belonging to the story.
 
-# Builds a dictionary mapping node IDs to serialized node data.
+#GET ONE NODE (PLUS WHAT COMES NEXT)
+# Returns the node and `depth` levels of its children, so the next choices can be shown without waiting.
+# Each level is one indexed lookup on (story_id, id).
+# Nodes of finished stories never change, so those responses are marked immutable.
+@router.get("/{story_id}/nodes/{node_id}", response_model=StoryNodeWindowResponse)
+async def get_story_node(
+        story_id: int,
+        node_id: int,
+        request: Request,
+        depth: int = Query(None, ge=0, le=settings.NODE_PREFETCH_MAX_DEPTH),
+        db: AsyncSession = Depends(get_async_db)
+):
+    story = (await db.execute(select(Story.id, Story.is_complete, Story.pool_theme).where(Story.id == story_id))).first()
+    if not story or story.pool_theme is not None:
+        raise HTTPException(status_code=404, detail="Story Not Found")
 
-# Finds the root node (start of the story).
+    nodes = await load_node_window(db, story_id, node_id, settings.NODE_PREFETCH_DEPTH if depth is None else depth)
+    if node_id not in nodes:
+        raise HTTPException(status_code=404, detail="Story Node Not Found")
 
-# Returns a complete story response including all nodes and root node.
+    window = StoryNodeWindowResponse.model_validate({"story_id": story_id, "node_id": node_id, "nodes": nodes})
+    body = window.model_dump_json().encode()
+    return cached_json_response(request, CachedResponse(body, make_etag(body)), immutable=story.is_complete is not False)
+
+#HELPER
+# Loads a node and its descendants level by level (breadth first), at most `depth` levels below it.
+async def load_node_window(db: AsyncSession, story_id: int, node_id: int, depth: int) -> dict[int, StoryNode]:
+    nodes = {}
+    level_ids = [node_id]
+
+    for _ in range(depth + 1):
+        if not level_ids:
+            break
+        level_nodes = (await db.execute(
+            select(StoryNode).where(StoryNode.story_id == story_id, StoryNode.id.in_(level_ids))
+        )).scalars().all()
+
+        level_ids = []
+        for node in level_nodes:
+            nodes[node.id] = node
+            for option in node.options or []:
+                child_id = option.get("node_id")
+                if child_id is not None and child_id not in nodes:
+                    level_ids.append(child_id)
+
+    return nodes
 
 
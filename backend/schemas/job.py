@@ -1,9 +1,9 @@
 #job.py
 #This file defines schemas related to the story generation jobs — what 
 # data is expected when creating a job and what is returned in responses.
-from typing import Optional
+from typing import Optional, List, Dict
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 #Basic model with just the theme string. Used as a base for creation.
 class StoryJobBase(BaseModel):
@@ -13,9 +13,10 @@ class StoryJobBase(BaseModel):
 
 # Includes:
     # job_id — unique job identifier.
-    # status — pending, processing, completed, or failed.
+    # status — pending, processing, completed, failed, cancelled (DELETE /jobs/{job_id}) or timed_out (JOB_DEADLINE_SECONDS).
     # created_at and optional completed_at timestamps.
     # Optional story_id if story was created.
+    # Optional playable_at once a streamed story can be played (story_id is already set then).
     # Optional error string in case of failure.
     # from_attributes = True tells Pydantic it can read data from ORM model attributes (SQLAlchemy objects).
 class StoryJobResponse(BaseModel):
@@ -24,6 +25,7 @@ class StoryJobResponse(BaseModel):
     created_at: datetime
     story_id: Optional[int] = None
     completed_at: Optional[datetime] = None
+    playable_at: Optional[datetime] = None
     error: Optional[str] = None
 
     class Config:
@@ -35,3 +37,38 @@ class StoryJobResponse(BaseModel):
 class StoryJobCreate(StoryJobBase):
     pass
 
+
+#Request body of POST /stories/batch: one job is created per theme (at most STORY_BATCH_MAX_THEMES).
+class StoryBatchCreate(BaseModel):
+    themes: List[str] = Field(min_length=1)
+
+#One theme of a batch and the job writing it.
+class StoryBatchItem(BaseModel):
+    job_id: str
+    theme: str
+    status: str
+    story_id: Optional[int] = None
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+#Returned by POST /stories/batch: the batch id to poll and the job of every theme, in the order they were sent.
+class StoryBatchResponse(BaseModel):
+    batch_id: str
+    created_at: datetime
+    jobs: List[StoryBatchItem]
+
+#Returned by GET /stories/batch/{batch_id}.
+    # counts — jobs per status; jobs already removed by the retention sweep are counted as "removed".
+    # finished — jobs that won't change any more (completed, failed, cancelled, timed_out or removed).
+    # done — True once every job is finished.
+    # jobs — every job of the batch, only with ?items=true.
+class StoryBatchStatusResponse(BaseModel):
+    batch_id: str
+    created_at: datetime
+    size: int
+    counts: Dict[str, int]
+    finished: int
+    done: bool
+    jobs: Optional[List[StoryBatchItem]] = None
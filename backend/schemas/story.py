@@ -73,6 +73,43 @@ class CompleteStoryResponse(StoryBase):
     class Config:
         from_attributes = True
 
-    
 
-    
+# Returned by GET /stories/{story_id}: what a player needs to start, without any node content.
+# root_node_id is where the story starts (None while a streamed story hasn't written its root yet).
+# is_complete is False while a streamed story is still being written.
+class StoryOverviewResponse(StoryBase):
+    id: int
+    created_at: datetime
+    root_node_id: Optional[int] = None
+    is_complete: bool = True
+
+
+# Returned by GET /stories/{story_id}/nodes/{node_id}.
+# nodes holds the requested node plus its children, grandchildren, ... up to the requested depth.
+class StoryNodeWindowResponse(BaseModel):
+    story_id: int
+    node_id: int
+    nodes: Dict[int, CompleteStoryNodeResponse]
+
+
+
+# One entry of the story library (GET /stories): everything needed to show the story in a list, no nodes.
+# The counts are None for stories written before they were stored (python manage.py backfill-summaries).
+class StorySummaryResponse(BaseModel):
+    id: int
+    title: str
+    created_at: datetime
+    is_complete: bool = True
+    node_count: Optional[int] = None
+    ending_count: Optional[int] = None
+    winning_ending_count: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+
+# Returned by GET /stories: one page of the caller's stories, newest first.
+# next_cursor goes into ?cursor= to get the following page; None on the last page.
+class StoryListResponse(BaseModel):
+    stories: List[StorySummaryResponse]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,30 @@
+##worker.py
+# worker.py → Runs story generation workers without the web server.
+# Start as many of these as you need (on any host that can reach the database),
+# and set RUN_EMBEDDED_WORKER=False on the API so generation scales separately from serving.
+
+import logging
+import signal
+
+from core.config import settings
+from core.metrics import start_metrics_server #stage timings of this process, scraped like the API's /metrics
+from core.worker import StoryWorker #claims jobs from the story_jobs table and generates the stories
+from db.database import create_tables #same as main.py, only with CREATE_TABLES_ON_STARTUP
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if settings.CREATE_TABLES_ON_STARTUP:
+        create_tables()
+
+    #this process only generates stories, so load LangChain and build the LLM client now instead of on the first job
+    from core.llm_context import get_generator_context
+    get_generator_context()
+
+    start_metrics_server(settings.WORKER_METRICS_PORT)
+    worker = StoryWorker()
+
+    #stop cleanly on Ctrl+C or when the platform stops the container
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.request_stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.request_stop())
+
+    worker.run_forever()
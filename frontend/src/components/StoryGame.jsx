@@ -1,43 +1,70 @@
-import {useState, useEffect} from 'react';
+import {useState, useEffect, useRef} from 'react';
+import axios from 'axios';
+import {API_BASE_URL} from "../util.js";
+
+const OPTIONS_POLL_MS = 2000 //how often a streamed node that has no choices yet is asked for again
 
 function StoryGame({story, onNewStory}) {
     const [currentNodeId, setCurrentNodeId] = useState(null);
-    const [currentNode, setCurrentNode] = useState(null)
-    const [options, setOptions] = useState([])
-    const [isEnding, setIsEnding] = useState(false)
-    const [isWinningEnding, setIsWinningEnding] = useState(false)
+    const [nodes, setNodes] = useState({}) //every node we have downloaded so far, by id
+    const [error, setError] = useState(null)
+    const visitedNodeId = useRef(null) //the node the last visit already asked the server for
 
     useEffect(() => {
-        if (story && story.root_node) {
-            const rootNodeId = story.root_node.id
-            setCurrentNodeId(rootNodeId)
+        if (story && story.root_node_id) {
+            setNodes({})
+            visitedNodeId.current = null
+            setCurrentNodeId(story.root_node_id)
         }
     }, [story])
 
+    //nodes are fetched on demand: the current node comes with a few levels of its children,
+    //so the next choices are usually already here when the player clicks
     useEffect(() => {
-        if (currentNodeId && story && story.all_nodes) {
-            const node = story.all_nodes[currentNodeId]
-
-            setCurrentNode(node)
-            setIsEnding(node.is_ending)
-            setIsWinningEnding(node.is_winning_ending)
-
-            if (!node.is_ending && node.options && node.options.length > 0) {
-                setOptions(node.options)
-            } else {
-                setOptions([])
-            }
+        if (!currentNodeId) {
+            return
+        }
+
+        const node = nodes[currentNodeId]
+        const childrenLoaded = node && (node.options || []).every(option => nodes[option.node_id])
+
+        //a streamed node can arrive before its choices are written: ask again until they are there
+        //(every answer replaces `nodes`, which runs this again; a failed request stops it)
+        if (node && !story.is_complete && !node.is_ending && !(node.options || []).length) {
+            const timer = setTimeout(() => loadNodes(currentNodeId), OPTIONS_POLL_MS)
+            return () => clearTimeout(timer)
         }
-    }, [currentNodeId, story])
 
+        //a story that is still being written can get new options, so ask again on every visit,
+        //but only once: this also runs whenever `nodes` changes
+        if (visitedNodeId.current !== currentNodeId && (!node || !childrenLoaded || !story.is_complete)) {
+            visitedNodeId.current = currentNodeId
+            loadNodes(currentNodeId)
+        }
+    }, [currentNodeId, nodes, story])
+
+    const loadNodes = async (nodeId) => {
+        try {
+            const response = await axios.get(`${API_BASE_URL}/stories/${story.id}/nodes/${nodeId}`)
+            setNodes(previous => ({...previous, ...response.data.nodes}))
+        } catch (e) {
+            setError(`Failed to load the story: ${e.message}`)
+        }
+    }
+
+    const currentNode = currentNodeId ? nodes[currentNodeId] : null
+    const isEnding = currentNode ? currentNode.is_ending : false
+    const isWinningEnding = currentNode ? currentNode.is_winning_ending : false
+    const options = currentNode && !currentNode.is_ending && currentNode.options ? currentNode.options : []
 
     const chooseOption = (optionId) => {
         setCurrentNodeId(optionId)
     }
 
     const restartStory = () => {
-        if (story && story.root_node) {
-            setCurrentNodeId(story.root_node.id)
+        if (story && story.root_node_id) {
+            visitedNodeId.current = null
+            setCurrentNodeId(story.root_node_id)
         }
     }
 
@@ -47,6 +74,10 @@ function StoryGame({story, onNewStory}) {
         </header>
 
         <div className="story-content">
+            {error && <div className="error-message"><p>{error}</p></div>}
+
+            {!currentNode && !error && <p>Loading...</p>}
+
             {currentNode && <div className="story-node">
                 <p>{currentNode.content}</p>
 
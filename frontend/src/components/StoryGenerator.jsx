@@ -15,20 +15,33 @@ function StoryGenerator() {
     const [loading, setLoading] = useState(false)
 
     useEffect(() => {
-        let pollInterval;
+        if (!jobId) {
+            return
+        }
+
+        //the server pushes every status change of the job, so there is nothing to poll
+        const events = new EventSource(`${API_BASE_URL}/jobs/${jobId}/events`)
 
-        if (jobId && jobStatus === "processing") {
-            pollInterval = setInterval(() => {
-                pollJobStatus(jobId)
-            }, 5000)
+        events.onmessage = (e) => {
+            const job = JSON.parse(e.data)
+            if (["completed", "failed", "cancelled", "timed_out"].includes(job.status)) {
+                events.close() //finished, stop listening
+            }
+            handleJobUpdate(job)
         }
 
-        return () => {
-            if (pollInterval) {
-                clearInterval(pollInterval)
+        events.onerror = () => {
+            //the browser reconnects on its own unless the stream was closed for good (e.g. 404)
+            if (events.readyState === EventSource.CLOSED) {
+                setError("Failed to check story status")
+                setLoading(false)
             }
         }
-    }, [jobId, jobStatus]) //if jobid or jobstatus changes, we run this effect
+
+        return () => {
+            events.close()
+        }
+    }, [jobId]) //open a new stream whenever we get a new job
 
     const generateStory = async (theme) => {
         setLoading(true)
@@ -38,33 +51,28 @@ function StoryGenerator() {
         try {
             const response = await axios.post(`${API_BASE_URL}/stories/create`, {theme})
             const {job_id, status} = response.data
-            setJobId(job_id) //setting jobid and status
+            setJobId(job_id) //setting jobid and status, this opens the status stream above
             setJobStatus(status)
-
-            pollJobStatus(job_id) //we send request, we get jobid back, and we start polling immediately, until the job is done
         } catch (e) {
             setLoading(false)
-            setError(`Failed to generate story: ${e.message}`)
+            if (e.response?.status === 429) { //rate limited or server busy, tell the player when to try again
+                const retryAfter = e.response.headers["retry-after"]
+                setError(`${e.response.data?.detail || "Too many stories right now"}. Please try again in ${retryAfter || "a few"} seconds.`)
+            } else {
+                setError(`Failed to generate story: ${e.message}`)
+            }
         }
     }
 
-    const pollJobStatus = async (id) => {
-        try { 
-            const response = await axios.get(`${API_BASE_URL}/jobs/${id}`) 
-            const {status, story_id, error: jobError} = response.data
-            setJobStatus(status)
+    const handleJobUpdate = ({status, story_id, playable_at, error: jobError}) => {
+        setJobStatus(status)
 
-            if (status === "completed" && story_id) {
-                fetchStory(story_id)
-            } else if (status === "failed" || jobError) { //failed or error
-                setError(jobError || "Failed to generate story")
-                setLoading(false)
-            }
-        } catch (e) {
-            if (e.response?.status !== 404) {
-                setError(`Failed to check story status: ${e.message}`) //if we didnt get 404 error, show message
-                setLoading(false)
-            }
+        //a streamed story can be played as soon as its beginning is written (playable_at)
+        if ((status === "completed" || playable_at) && story_id) {
+            fetchStory(story_id)
+        } else if (status === "failed" || jobError) { //failed or error
+            setError(jobError || "Failed to generate story")
+            setLoading(false)
         }
     }
 
@@ -21,7 +21,7 @@ function StoryLoader() {
         setError(null)
 
         try {
-            const response = await axios.get(`${API_BASE_URL}/stories/${storyId}/complete`)
+            const response = await axios.get(`${API_BASE_URL}/stories/${storyId}`) //just the overview, StoryGame loads nodes as you play
             setStory(response.data)
             setLoading(false)
         } catch (err) {